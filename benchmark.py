@@ -0,0 +1,448 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from importlib import metadata
+from types import SimpleNamespace
+import numpy as np
+from patient_schema import PATIENT_SCHEMA
+
+# Variación relativa a partir de la cual compare() marca una regresión
+REGRESSION_TOLERANCE = 0.2
+
+# Valores válidos de cada variable categórica, tomados de PATIENT_SCHEMA
+PATIENT_OPTIONS = {
+    key: spec["enum"] if spec["type"] == "string" else [True, False]
+    for key, spec in PATIENT_SCHEMA.items() if spec["type"] != "number"
+}
+
+# Mensaje que el usuario escribe en el turno completo de la app
+APP_PROMPT = "Calcula el riesgo, explícalo y enséñame el waterfall plot."
+
+PACKAGES = ["numpy", "pandas", "scikit-learn", "shap", "matplotlib",
+            "tensorflow", "streamlit", "openai"]
+
+
+def sample_patients(n, seed=0):
+    """
+    Genera pacientes sintéticos válidos de forma reproducible.
+
+    Args:
+        n (int): Número de pacientes.
+        seed (int): Semilla del generador.
+
+    Returns:
+        list: Lista de diccionarios de pacientes.
+    """
+    rng = np.random.default_rng(seed)
+    patients = []
+    for _ in range(n):
+        patient = {key: values[rng.integers(len(values))]
+                   for key, values in PATIENT_OPTIONS.items()}
+        patient.update(age=round(float(rng.uniform(1, 90)), 1),
+                       avg_glucose_level=round(float(rng.uniform(55, 270)),
+                                               1),
+                       bmi=round(float(rng.uniform(12, 50)), 1))
+        patients.append(patient)
+    return patients
+
+
+def latency_stats(samples):
+    """
+    Resume una lista de latencias en segundos.
+
+    Returns:
+        dict: n, media, p50, p99 y máximo (en milisegundos).
+    """
+    samples_ms = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "n": len(samples_ms),
+        "mean_ms": float(samples_ms.mean()),
+        "p50_ms": float(np.percentile(samples_ms, 50)),
+        "p99_ms": float(np.percentile(samples_ms, 99)),
+        "max_ms": float(samples_ms.max()),
+    }
+
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def cold_import_seconds(statement, repeats=3):
+    """
+    Mide en procesos nuevos el tiempo de ejecutar una sentencia.
+
+    Args:
+        statement (str): Código Python a cronometrar (p. ej. un import).
+        repeats (int): Procesos a lanzar; se informa la mediana.
+
+    Returns:
+        float: Mediana de segundos.
+    """
+    code = ("import time\n"
+            "start = time.perf_counter()\n"
+            f"{statement}\n"
+            "print(time.perf_counter() - start)")
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL="3")
+    times = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", code], env=env,
+                                capture_output=True, text=True, check=True)
+        times.append(float(output.stdout.strip().splitlines()[-1]))
+    return float(np.median(times))
+
+
+def bench_imports(repeats=3):
+    """
+    Tiempos en frío de importar los módulos y de la primera predicción.
+    """
+    patient = sample_patients(1)[0]
+    return {
+        "stroke_prediction_s": cold_import_seconds(
+            "import stroke_prediction", repeats),
+        "stroke_SHAP_s": cold_import_seconds("import stroke_SHAP", repeats),
+        "first_prediction_s": cold_import_seconds(
+            "import stroke_prediction as sp\n"
+            f"sp.get_stroke_prediction({patient!r})", repeats),
+    }
+
+
+def bench_prediction(patients, batch_sizes=(1, 32, 256, 2048)):
+    """
+    Latencia de get_stroke_prediction sin caché y rendimiento por lotes.
+    """
+    import stroke_prediction as sp
+
+    sp.get_stroke_prediction(patients[0], use_cache=False)
+    samples = [_timed(sp.get_stroke_prediction, patient, use_cache=False)
+               for patient in patients]
+    # Segunda pasada sobre los mismos pacientes: todo aciertos de caché
+    warm = patients[:100]
+    for patient in warm:
+        sp.get_stroke_prediction(patient)
+    cached = [_timed(sp.get_stroke_prediction, patient) for patient in warm]
+
+    throughput = {}
+    for size in batch_sizes:
+        batch = (patients * (size // len(patients) + 1))[:size]
+        seconds = min(_timed(sp.get_stroke_predictions_batch, batch)
+                      for _ in range(3))
+        throughput[str(size)] = size / seconds
+    return {
+        "latency": latency_stats(samples),
+        "cached_latency": latency_stats(cached),
+        "single_rows_per_s": len(samples) / float(np.sum(samples)),
+        "batch_rows_per_s": throughput,
+    }
+
+
+def bench_validation(patients, batch_size=10000, invalid_fraction=0.1):
+    """
+    Coste de validate_input por paciente y de la validación columnar de un
+    lote válido y de uno con filas inválidas.
+    """
+    import stroke_prediction as sp
+    from patient_schema import VALIDATOR
+
+    samples = [_timed(sp.validate_input, patient) for patient in patients]
+    batch = (patients * (batch_size // len(patients) + 1))[:batch_size]
+    rng = np.random.default_rng(0)
+    broken = [dict(patient) for patient in batch]
+    for i in rng.choice(batch_size, int(batch_size * invalid_fraction),
+                        replace=False):
+        broken[i].update(age=-1, smoking_status="a veces")
+        del broken[i]["bmi"]
+
+    results = {"latency": latency_stats(samples)}
+    for name, records in (("valid", batch), ("with_errors", broken)):
+        seconds = min(_timed(VALIDATOR.record_list_errors, records)
+                      for _ in range(3))
+        results[f"{name}_rows_per_s"] = batch_size / seconds
+    return results
+
+
+def bench_shap(patients, generic_count=5):
+    """
+    Latencia de get_reverted_shap_explanation en cada modo, sin caché.
+    """
+    import stroke_SHAP as shp
+
+    results = {}
+    for mode, count in (("grouped", len(patients)),
+                        ("generic", generic_count)):
+        shp.get_reverted_shap_explanation(patients[0], mode=mode,
+                                          use_cache=False)
+        results[mode] = latency_stats(
+            [_timed(shp.get_reverted_shap_explanation, patient, mode=mode,
+                    use_cache=False) for patient in patients[:count]])
+    return results
+
+
+def bench_plots(patient, repeats=5):
+    """
+    Tiempo de cada gráfico: construcción de la figura, PNG completo y
+    especificación Vega-Lite serializada.
+    """
+    import stroke_SHAP as shp
+    from plot_rendering import PlotRenderer, PLOT_TYPES, _build_figure
+    from prediction_cache import TTLCache
+
+    explanation = shp.get_reverted_shap_explanation(patient)
+    renderer = PlotRenderer(cache=TTLCache(max_entries=0, ttl=0))
+    results = {}
+    for plot_type in PLOT_TYPES:
+        renderer.render(explanation, plot_type)
+        figure_times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fig = _build_figure(explanation, plot_type, 10)
+            figure_times.append(time.perf_counter() - start)
+            fig.clear()
+        results[plot_type] = {
+            "figure": latency_stats(figure_times),
+            "png": latency_stats([_timed(renderer.render, explanation,
+                                         plot_type)
+                                  for _ in range(repeats)]),
+            "vega": latency_stats([_timed(
+                lambda: json.dumps(renderer.render_spec(explanation,
+                                                        plot_type)))
+                for _ in range(repeats)]),
+        }
+    return results
+
+
+def _chunk(content=None, tool_calls=None):
+    return SimpleNamespace(choices=[SimpleNamespace(
+        delta=SimpleNamespace(content=content, tool_calls=tool_calls))])
+
+
+class FakeOpenAI:
+    """
+    Cliente sin red con la interfaz de OpenAI que usa chat_engine.
+
+    Cuando la petición incluye herramientas responde pidiendo predicción,
+    explicación y waterfall plot del siguiente paciente de la lista, con
+    los argumentos troceados como en el streaming real; sin herramientas,
+    responde un texto corto.
+
+    Args:
+        patients (list): Pacientes a usar en cada turno, en orden.
+        api_key (str, optional): Ignorado.
+    """
+
+    def __init__(self, patients=None, api_key=None):
+        self.patients = list(patients or sample_patients(1))
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(
+            create=self._create))
+
+    def _create(self, **request):
+        self.requests.append(request)
+        if request.get("tools"):
+            return self._tool_calls()
+        return iter([_chunk(content=word + " ")
+                     for word in "La probabilidad estimada es baja.".split()])
+
+    def _tool_calls(self):
+        patient = self.patients[(len(self.requests) // 2)
+                                % len(self.patients)]
+        arguments = json.dumps({"person_data": patient})
+        calls = [("get_stroke_prediction", arguments),
+                 ("get_reverted_shap_explanation", arguments),
+                 ("get_waterfall_plot", '{"max_display": 10}')]
+        for index, (name, arguments) in enumerate(calls):
+            half = len(arguments) // 2
+            yield _chunk(tool_calls=[SimpleNamespace(
+                index=index, id=f"call_{index}",
+                function=SimpleNamespace(name=name,
+                                         arguments=arguments[:half]))])
+            yield _chunk(tool_calls=[SimpleNamespace(
+                index=index, id=None,
+                function=SimpleNamespace(name=None,
+                                         arguments=arguments[half:]))])
+
+
+def bench_chat_turn(patients):
+    """
+    Turno completo de chat_engine.run_turn con el cliente falso.
+    """
+    from chat_engine import as_chat_tools, run_turn
+    from tools_config import tools
+
+    chat_tools = as_chat_tools(tools)
+    client = FakeOpenAI(patients)
+    samples = []
+    for _ in patients:
+        messages = [{"role": "system", "content": ""},
+                    {"role": "user", "content": APP_PROMPT}]
+        samples.append(_timed(run_turn, client, "fake", messages,
+                              chat_tools, {}))
+    return latency_stats(samples)
+
+
+def bench_app_turn(patients):
+    """
+    Turno completo de stroke_bot_app.py con streamlit.testing y el cliente
+    falso.
+
+    Returns:
+        dict: Tiempo del arranque del script y latencias de cada turno, o
+        'error' si la app lanzó una excepción.
+    """
+    import openai
+    from streamlit.testing.v1 import AppTest
+
+    original = openai.OpenAI
+    # La app crea el cliente en cada ejecución del script: se comparte uno
+    # para que cada turno use un paciente nuevo
+    client = FakeOpenAI(patients)
+    openai.OpenAI = lambda api_key=None: client
+    try:
+        app = AppTest.from_file("stroke_bot_app.py", default_timeout=300)
+        app.secrets["API_KEY"] = "benchmark"
+        startup = _timed(app.run)
+        samples = []
+        for _ in patients:
+            if app.exception:
+                return {"error": app.exception[0].message}
+            samples.append(_timed(app.chat_input[0].set_value(APP_PROMPT).run))
+        if app.exception:
+            return {"error": app.exception[0].message}
+        return {"startup_s": startup, "turn": latency_stats(samples)}
+    finally:
+        openai.OpenAI = original
+
+
+def environment():
+    """
+    Versiones y configuración con las que se tomaron las medidas.
+    """
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    from model_registry import REGISTRY
+    from shap_pool import SHAP_POOL
+    from stroke_SHAP import SHAP_MODE
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "packages": versions,
+        "backend": REGISTRY.backend,
+        "shap_mode": SHAP_MODE,
+        "shap_workers": SHAP_POOL.workers,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+SECTIONS = ["imports", "prediction", "validation", "shap", "plots",
+            "chat_turn", "app_turn"]
+
+
+def run_benchmarks(sections=None, n_patients=200, seed=0):
+    """
+    Ejecuta las secciones pedidas del benchmark.
+
+    Args:
+        sections (list, optional): Subconjunto de SECTIONS. Por defecto,
+            todas.
+        n_patients (int): Pacientes sintéticos para las medidas por fila.
+        seed (int): Semilla de los pacientes.
+
+    Returns:
+        dict: Resultados por sección más 'environment'.
+    """
+    sections = sections or SECTIONS
+    patients = sample_patients(n_patients, seed)
+    # Las secciones de SHAP y de la app usan pacientes distintos a los de
+    # la predicción para no medir aciertos de caché
+    runners = {
+        "imports": lambda: bench_imports(),
+        "prediction": lambda: bench_prediction(patients),
+        "validation": lambda: bench_validation(patients),
+        "shap": lambda: bench_shap(sample_patients(20, seed + 1)),
+        "plots": lambda: bench_plots(patients[0]),
+        "chat_turn": lambda: bench_chat_turn(sample_patients(10, seed + 2)),
+        "app_turn": lambda: bench_app_turn(sample_patients(5, seed + 3)),
+    }
+    results = {}
+    for section in sections:
+        results[section] = runners[section]()
+    results["environment"] = environment()
+    return results
+
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline, current, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compara dos resultados de run_benchmarks.
+
+    Las métricas en segundos o milisegundos empeoran al subir y las de
+    filas por segundo, al bajar.
+
+    Args:
+        baseline (dict): Resultados de referencia.
+        current (dict): Resultados nuevos.
+        tolerance (float): Variación relativa tolerada.
+
+    Returns:
+        dict: Para cada métrica común, 'baseline', 'current', 'ratio' y
+        'regression'.
+    """
+    old = _flatten({k: v for k, v in baseline.items() if k != "environment"})
+    new = _flatten({k: v for k, v in current.items() if k != "environment"})
+    report = {}
+    for name in sorted(set(old) & set(new)):
+        if name.endswith(".n") or not old[name]:
+            continue
+        ratio = new[name] / old[name]
+        higher_is_better = "per_s" in name
+        regression = (ratio < 1 - tolerance if higher_is_better
+                      else ratio > 1 + tolerance)
+        report[name] = {"baseline": old[name], "current": new[name],
+                        "ratio": ratio, "regression": regression}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark de latencia de Stroke Bot.")
+    parser.add_argument("--sections", nargs="+", choices=SECTIONS,
+                        help="Secciones a medir (por defecto, todas).")
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Archivo JSON de resultados.")
+    parser.add_argument("--compare", help="JSON de referencia con el que "
+                                          "comparar los resultados.")
+    args = parser.parse_args()
+
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "3")
+    results = run_benchmarks(args.sections, args.patients, args.seed)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            results["comparison"] = compare(json.load(file), results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    print(json.dumps(results, indent=2))
+    if any(item["regression"]
+           for item in results.get("comparison", {}).values()):
+        sys.exit(1)
@@ -0,0 +1,392 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from explanation_cache import file_fingerprint
+from model_registry import REGISTRY
+from patient_schema import VALIDATOR
+from prediction_cache import canonicalize_columns
+from shap_pool import (WORKERS, _explain_rows_in_worker, _init_worker,
+                        worker_initargs)
+
+# Filas leídas, validadas y puntuadas de una vez; fija la memoria máxima
+CHUNK_ROWS = int(os.environ.get("STROKE_BOT_BULK_CHUNK_ROWS", "50000"))
+# Filas por tarea enviada al pool de explicaciones
+EXPLAIN_TASK_ROWS = 64
+CHECKPOINT_SUFFIX = ".checkpoint.json"
+
+
+class BulkScoringError(ValueError):
+    """
+    Formato de archivo no soportado o checkpoint incompatible.
+    """
+
+
+def _file_format(path):
+    extension = os.path.splitext(path.rstrip("/"))[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".parquet", ".pq"):
+        return "parquet"
+    raise BulkScoringError(
+        f"Formato no soportado para '{path}': usa .csv o .parquet.")
+
+
+def _import_parquet():
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise BulkScoringError(
+            f"Leer o escribir Parquet requiere pyarrow: {e}") from e
+    return pq
+
+
+def read_chunks(path, chunk_rows=CHUNK_ROWS, skip_rows=0):
+    """
+    Lee un CSV o Parquet por bloques sin cargarlo entero en memoria.
+
+    Args:
+        path (str): Archivo de entrada.
+        chunk_rows (int): Filas por bloque.
+        skip_rows (int): Filas de datos iniciales que se saltan (reanudar).
+
+    Yields:
+        pd.DataFrame: Bloques de como mucho chunk_rows filas.
+    """
+    if _file_format(path) == "csv":
+        skiprows = range(1, skip_rows + 1) if skip_rows else None
+        yield from pd.read_csv(path, chunksize=chunk_rows,
+                               skiprows=skiprows)
+        return
+
+    parquet_file = _import_parquet().ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows):
+        if skip_rows >= batch.num_rows:
+            skip_rows -= batch.num_rows
+            continue
+        if skip_rows:
+            batch = batch.slice(skip_rows)
+            skip_rows = 0
+        yield batch.to_pandas()
+
+
+class _ChunkWriter:
+    """
+    Escritura incremental del resultado: un único CSV al que se añaden
+    bloques, o un directorio Parquet con un archivo por bloque.
+
+    Cada bloque queda en disco (fsync o renombrado atómico) antes de
+    actualizar el checkpoint, así que al reanudar basta con recortar el CSV
+    al tamaño guardado o borrar las partes posteriores.
+    """
+
+    def __init__(self, path):
+        self.path = path.rstrip("/")
+        self.format = _file_format(path)
+
+    def reset(self, chunks_done=0, output_bytes=0):
+        if self.format == "csv":
+            if os.path.exists(self.path):
+                with open(self.path, "r+b") as file:
+                    file.truncate(output_bytes)
+            return
+        if chunks_done == 0 and os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path, exist_ok=True)
+        for name in os.listdir(self.path):
+            if name.startswith("part-") and (
+                    not name.endswith(".parquet")
+                    or int(name[5:10]) >= chunks_done):
+                os.remove(os.path.join(self.path, name))
+
+    def write(self, frame, chunk_index):
+        """
+        Guarda un bloque de resultados.
+
+        Returns:
+            int: Tamaño del CSV tras la escritura (0 para Parquet).
+        """
+        if self.format == "csv":
+            with open(self.path, "ab") as file:
+                frame.to_csv(file, header=file.tell() == 0, index=False)
+                file.flush()
+                os.fsync(file.fileno())
+                return file.tell()
+        _import_parquet()
+        part = os.path.join(self.path, f"part-{chunk_index:05d}.parquet")
+        frame.to_parquet(part + ".tmp", index=False)
+        os.replace(part + ".tmp", part)
+        return 0
+
+
+def _checkpoint_path(output_path):
+    return output_path.rstrip("/") + CHECKPOINT_SUFFIX
+
+
+def _run_signature(input_path, explain, id_column):
+    from grouped_shap import BACKGROUND_METHOD, BACKGROUND_SIZE
+
+    stat = os.stat(input_path)
+    # El predictor se carga antes de firmar: si la paridad del artefacto
+    # falla, el motor pasa a Keras y cambian los resultados
+    REGISTRY.get_predictor()
+    # El mismo archivo de entrada con el mismo modelo, el mismo motor y
+    # precisión, el mismo fondo de SHAP y las mismas opciones
+    signature = {
+        "input": os.path.abspath(input_path),
+        "input_size": stat.st_size,
+        "input_mtime_ns": stat.st_mtime_ns,
+        "model": file_fingerprint([REGISTRY.model_path,
+                                   REGISTRY.preprocessor_path]),
+        "predictor": REGISTRY.predictor_signature(),
+        "explain": explain,
+        "id_column": id_column,
+    }
+    if explain:
+        signature["background"] = file_fingerprint(
+            [REGISTRY.background_data_path])
+        signature["background_size"] = BACKGROUND_SIZE
+        signature["background_method"] = BACKGROUND_METHOD
+    return signature
+
+
+def _save_checkpoint(path, checkpoint):
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(checkpoint, file, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _explain_rows(rows, executor):
+    if executor is None:
+        return REGISTRY.get_grouped_explainer().shapley_values(rows)
+    tasks = [rows[start:start + EXPLAIN_TASK_ROWS]
+             for start in range(0, len(rows), EXPLAIN_TASK_ROWS)]
+    results = list(executor.map(_explain_rows_in_worker, tasks))
+    return (np.concatenate([values for values, _ in results]),
+            np.concatenate([base for _, base in results]))
+
+
+def score_chunk(frame, first_row=0, explain=False, executor=None,
+                id_column=None, timings=None):
+    """
+    Valida, puntúa y, opcionalmente, explica un bloque de pacientes.
+
+    Las filas inválidas no detienen el bloque: su probabilidad queda vacía
+    y 'error' recoge todos sus problemas.
+
+    Args:
+        frame (pd.DataFrame): Pacientes con una columna por variable.
+        first_row (int): Número de la primera fila en el archivo.
+        explain (bool): Si es True, añade los valores SHAP agrupados
+            ('shap_<variable>') y el valor base.
+        executor (ProcessPoolExecutor, optional): Pool para las
+            explicaciones; sin él se calculan en este proceso.
+        id_column (str, optional): Columna de entrada que se copia al
+            resultado.
+        timings (dict, optional): Segundos acumulados por etapa.
+
+    Returns:
+        pd.DataFrame: Una fila de resultado por paciente.
+    """
+    timings = {} if timings is None else timings
+
+    def _lap(stage, start):
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+        return time.perf_counter()
+
+    start = time.perf_counter()
+    n_rows = len(frame)
+    columns = canonicalize_columns(
+        {name: frame[name].to_numpy() for name in VALIDATOR.names
+         if name in frame.columns})
+    errors = VALIDATOR.column_errors(columns, n_rows)
+    valid = np.ones(n_rows, dtype=bool)
+    valid[list(errors)] = False
+    start = _lap("validate", start)
+
+    result = {}
+    if id_column is not None:
+        result[id_column] = frame[id_column].to_numpy()
+    result["row"] = np.arange(first_row, first_row + n_rows)
+    probability = np.full(n_rows, np.nan)
+    rows = None
+    if valid.any():
+        encoder = REGISTRY.get_encoder()
+        rows = encoder.transform_columns(
+            {key: columns[key][valid] for key in encoder.feature_names})
+        probability[valid] = REGISTRY.get_predictor().predict(
+            rows, batch_size=len(rows), verbose=0)[:, 0]
+    result["probability"] = np.round(probability, 4)
+    messages = np.full(n_rows, "", dtype=object)
+    for row, row_errors in errors.items():
+        messages[row] = " ".join(row_errors)
+    result["error"] = messages
+    start = _lap("predict", start)
+
+    if explain:
+        feature_names = REGISTRY.get_encoder().feature_names
+        values = np.full((n_rows, len(feature_names)), np.nan)
+        base_values = np.full(n_rows, np.nan)
+        if rows is not None:
+            values[valid], base_values[valid] = _explain_rows(rows, executor)
+        for i, feature in enumerate(feature_names):
+            result[f"shap_{feature}"] = np.round(values[:, i], 5)
+        result["shap_base_value"] = np.round(base_values, 5)
+        _lap("explain", start)
+    return pd.DataFrame(result)
+
+
+def _peak_memory_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss está en KiB en Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                 1)
+
+
+def score_file(input_path, output_path, chunk_rows=CHUNK_ROWS,
+               explain=False, workers=WORKERS, id_column=None, restart=False,
+               progress=True):
+    """
+    Puntúa un CSV o Parquet por bloques y escribe el resultado de forma
+    incremental.
+
+    Tras cada bloque se guarda un checkpoint junto a la salida; si la
+    ejecución se interrumpe, la siguiente con los mismos argumentos
+    continúa desde el último bloque completo.
+
+    Args:
+        input_path (str): CSV o Parquet de entrada.
+        output_path (str): CSV, o directorio .parquet con un archivo por
+            bloque.
+        chunk_rows (int): Filas por bloque.
+        explain (bool): Si es True, calcula explicaciones SHAP agrupadas.
+        workers (int): Procesos para las explicaciones; 0 las calcula en
+            este proceso.
+        id_column (str, optional): Columna identificadora a conservar.
+        restart (bool): Si es True, ignora el checkpoint y empieza de cero.
+        progress (bool): Si es True, informa del avance por consola.
+
+    Returns:
+        dict: Informe de rendimiento (filas, segundos, filas por segundo,
+            tiempo por etapa y memoria máxima).
+
+    Raises:
+        BulkScoringError: Si el formato no es válido o el checkpoint es de
+            otra entrada, otro modelo u otras opciones.
+    """
+    writer = _ChunkWriter(output_path)
+    checkpoint_path = _checkpoint_path(output_path)
+    signature = _run_signature(input_path, explain, id_column)
+    checkpoint = None
+    if os.path.exists(checkpoint_path) and not restart:
+        with open(checkpoint_path, encoding="utf-8") as file:
+            checkpoint = json.load(file)
+        if checkpoint["signature"] != signature:
+            raise BulkScoringError(
+                f"El checkpoint '{checkpoint_path}' es de otra entrada, otro "
+                f"modelo u otras opciones. Usa --restart para empezar de "
+                f"cero.")
+        if progress:
+            print(f"Reanudando desde la fila {checkpoint['rows_done']}")
+    if checkpoint is None:
+        checkpoint = {"signature": signature, "rows_done": 0,
+                      "chunks_done": 0, "invalid_rows": 0,
+                      "output_bytes": 0, "seconds": 0.0}
+        if os.path.exists(output_path) and writer.format == "csv":
+            os.remove(output_path)
+    writer.reset(checkpoint["chunks_done"], checkpoint["output_bytes"])
+    resumed_rows = checkpoint["rows_done"]
+
+    executor = None
+    if explain and workers > 0:
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=worker_initargs("grouped"))
+
+    timings = {}
+    rows_scored = 0
+    start = time.perf_counter()
+    try:
+        read_start = time.perf_counter()
+        for frame in read_chunks(input_path, chunk_rows, resumed_rows):
+            timings["read"] = (timings.get("read", 0.0)
+                               + time.perf_counter() - read_start)
+            result = score_chunk(frame, checkpoint["rows_done"], explain,
+                                 executor, id_column, timings)
+
+            write_start = time.perf_counter()
+            output_bytes = writer.write(result, checkpoint["chunks_done"])
+            rows_scored += len(frame)
+            checkpoint.update(
+                rows_done=checkpoint["rows_done"] + len(frame),
+                chunks_done=checkpoint["chunks_done"] + 1,
+                invalid_rows=checkpoint["invalid_rows"]
+                + int((result["error"] != "").sum()),
+                output_bytes=output_bytes,
+                seconds=checkpoint["seconds"] + time.perf_counter() - start)
+            start = time.perf_counter()
+            _save_checkpoint(checkpoint_path, checkpoint)
+            timings["write"] = (timings.get("write", 0.0)
+                                + time.perf_counter() - write_start)
+            if progress:
+                elapsed = sum(timings.values())
+                print(f"{checkpoint['rows_done']} filas "
+                      f"({rows_scored / max(elapsed, 1e-9):.0f} filas/s)")
+            read_start = time.perf_counter()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    seconds = sum(timings.values())
+    return {
+        "rows": checkpoint["rows_done"],
+        "rows_this_run": rows_scored,
+        "resumed_from_row": resumed_rows,
+        "invalid_rows": checkpoint["invalid_rows"],
+        "chunks": checkpoint["chunks_done"],
+        "seconds": round(seconds, 3),
+        "rows_per_second": (round(rows_scored / seconds, 1) if seconds
+                            else None),
+        "stage_seconds": {stage: round(value, 3)
+                          for stage, value in timings.items()},
+        "explain_workers": workers if explain else None,
+        "peak_memory_mb": _peak_memory_mb(),
+        "output": output_path,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Puntúa un CSV o Parquet de pacientes por bloques.")
+    parser.add_argument("input", help="Archivo .csv o .parquet de entrada.")
+    parser.add_argument(
+        "output", help="Archivo .csv o directorio .parquet de salida.")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--explain", action="store_true",
+                        help="Añade los valores SHAP agrupados.")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="Procesos para las explicaciones.")
+    parser.add_argument("--id-column", default=None,
+                        help="Columna identificadora a copiar al resultado.")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignora el checkpoint y empieza de cero.")
+
+    args = parser.parse_args()
+    report = score_file(args.input, args.output, args.chunk_rows,
+                        args.explain, args.workers, args.id_column,
+                        args.restart)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
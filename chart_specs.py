@@ -0,0 +1,218 @@
+import numpy as np
+
+# Colores de SHAP para contribuciones positivas y negativas
+POSITIVE_COLOR = "#ff0051"
+NEGATIVE_COLOR = "#008bfb"
+CHART_WIDTH = 600
+ROW_HEIGHT = 28
+
+_SIGN_SCALE = {"domain": ["Aumenta el riesgo", "Reduce el riesgo"],
+               "range": [POSITIVE_COLOR, NEGATIVE_COLOR]}
+_TOOLTIP = [{"field": "feature", "title": "Variable"},
+            {"field": "value", "title": "Valor"},
+            {"field": "contribution", "title": "Contribución",
+             "format": "+.4f"}]
+
+
+def _format_value(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bool):
+        return "Sí" if value else "No"
+    if isinstance(value, float):
+        return f"{value:g}"
+    return "" if value is None else str(value)
+
+
+def _contributions(explanation):
+    """
+    Contribuciones por variable original, listas para serializar en JSON.
+
+    Returns:
+        tuple: (base_value, filas) con una fila por variable.
+    """
+    from stroke_SHAP import _group_contributions
+
+    base_value = float(np.ravel(explanation.base_values)[0])
+    rows = []
+    for feature, value, contribution in _group_contributions(explanation):
+        value = _format_value(value)
+        rows.append({
+            "feature": feature,
+            "value": value,
+            "label": f"{feature} = {value}" if value else feature,
+            "contribution": round(contribution, 6),
+            "sign": ("Aumenta el riesgo" if contribution >= 0
+                     else "Reduce el riesgo"),
+        })
+    return base_value, rows
+
+
+def _waterfall_spec(base_value, rows, max_display):
+    rows = sorted(rows, key=lambda row: -abs(row["contribution"]))
+    if len(rows) > max_display:
+        # Como en shap.plots.waterfall, el resto se suma en una sola barra
+        rest = rows[max_display - 1:]
+        total = sum(row["contribution"] for row in rest)
+        rows = rows[:max_display - 1] + [{
+            "feature": f"otras {len(rest)} variables",
+            "value": "",
+            "label": f"otras {len(rest)} variables",
+            "contribution": round(total, 6),
+            "sign": "Aumenta el riesgo" if total >= 0 else "Reduce el riesgo",
+        }]
+    # Las barras se apilan desde el valor base, de abajo arriba
+    position = base_value
+    for row in reversed(rows):
+        row["start"] = round(position, 6)
+        position += row["contribution"]
+        row["end"] = round(position, 6)
+    prediction = position
+    y = {"field": "label", "type": "nominal", "title": None,
+         "sort": [row["label"] for row in rows]}
+
+    return {
+        "title": f"f(x) = {prediction:.3f}    E[f(X)] = {base_value:.3f}",
+        "width": CHART_WIDTH,
+        "height": ROW_HEIGHT * len(rows),
+        "data": {"values": rows},
+        "layer": [
+            {"mark": {"type": "bar", "height": ROW_HEIGHT * 0.7},
+             "encoding": {
+                 "y": y,
+                 "x": {"field": "start", "type": "quantitative",
+                       "title": "Probabilidad de ictus",
+                       "scale": {"zero": False}},
+                 "x2": {"field": "end"},
+                 "color": {"field": "sign", "type": "nominal",
+                           "scale": _SIGN_SCALE, "legend": None},
+                 "tooltip": _TOOLTIP}},
+            {"mark": {"type": "text", "align": "left", "dx": 4},
+             "encoding": {
+                 "y": y,
+                 "x": {"field": "end", "type": "quantitative"},
+                 "text": {"field": "contribution", "format": "+.3f"}}},
+            {"data": {"values": [{"x": base_value}]},
+             "mark": {"type": "rule", "strokeDash": [4, 4],
+                      "color": "gray"},
+             "encoding": {"x": {"field": "x", "type": "quantitative"}}},
+        ],
+    }
+
+
+def _force_spec(base_value, rows):
+    prediction = base_value + sum(row["contribution"] for row in rows)
+    # Como en shap.plots.force: las contribuciones positivas llegan a f(x)
+    # desde la izquierda y las negativas desde la derecha, las mayores más
+    # cerca de f(x)
+    segments = []
+    for sign, direction in (("Aumenta el riesgo", -1),
+                            ("Reduce el riesgo", 1)):
+        position = prediction
+        for row in sorted((row for row in rows if row["sign"] == sign),
+                          key=lambda row: -abs(row["contribution"])):
+            end = position + direction * abs(row["contribution"])
+            segments.append(dict(row, start=round(min(position, end), 6),
+                                 end=round(max(position, end), 6)))
+            position = end
+    # Solo se rotulan los segmentos con anchura suficiente
+    min_width = 0.05 * max(abs(prediction - base_value), 0.01)
+
+    return {
+        "title": f"f(x) = {prediction:.3f}    E[f(X)] = {base_value:.3f}",
+        "width": CHART_WIDTH,
+        "height": 60,
+        "data": {"values": segments},
+        "layer": [
+            {"mark": {"type": "bar", "height": 24, "stroke": "white"},
+             "encoding": {
+                 "x": {"field": "start", "type": "quantitative",
+                       "title": "Probabilidad de ictus",
+                       "scale": {"zero": False}},
+                 "x2": {"field": "end"},
+                 "color": {"field": "sign", "type": "nominal",
+                           "scale": _SIGN_SCALE,
+                           "legend": {"orient": "bottom", "title": None}},
+                 "tooltip": _TOOLTIP}},
+            {"transform": [{"filter": f"datum.end - datum.start > "
+                                      f"{min_width:.6f}"},
+                           {"calculate": "(datum.start + datum.end) / 2",
+                            "as": "middle"}],
+             "mark": {"type": "text", "dy": 24, "fontSize": 10},
+             "encoding": {
+                 "x": {"field": "middle", "type": "quantitative"},
+                 "text": {"field": "label"}}},
+            {"data": {"values": [{"x": base_value, "name": "E[f(X)]"},
+                                 {"x": prediction, "name": "f(x)"}]},
+             "mark": {"type": "rule", "strokeDash": [4, 4],
+                      "color": "gray"},
+             "encoding": {"x": {"field": "x", "type": "quantitative"},
+                          "tooltip": [{"field": "name"},
+                                      {"field": "x", "format": ".4f"}]}},
+        ],
+    }
+
+
+def _decision_spec(base_value, rows):
+    # Como en shap.decision_plot: la variable más influyente queda arriba y
+    # la línea sube desde el valor base hasta la predicción
+    rows = sorted(rows, key=lambda row: abs(row["contribution"]))
+    points = [{"label": "E[f(X)]", "feature": "", "value": "",
+               "contribution": 0.0, "output": round(base_value, 6),
+               "order": 0}]
+    position = base_value
+    for order, row in enumerate(rows, start=1):
+        position += row["contribution"]
+        points.append(dict(row, output=round(position, 6), order=order))
+
+    return {
+        "title": f"f(x) = {position:.3f}    E[f(X)] = {base_value:.3f}",
+        "width": CHART_WIDTH,
+        "height": ROW_HEIGHT * len(points),
+        "data": {"values": points},
+        "encoding": {
+            "y": {"field": "label", "type": "nominal", "title": None,
+                  "sort": [point["label"] for point in reversed(points)]},
+            "x": {"field": "output", "type": "quantitative",
+                  "title": "Probabilidad de ictus",
+                  "scale": {"zero": False}},
+        },
+        "layer": [
+            {"mark": {"type": "line", "color": "gray"},
+             "encoding": {"order": {"field": "order"}}},
+            {"mark": {"type": "point", "filled": True, "size": 60},
+             "encoding": {
+                 "color": {"field": "sign", "type": "nominal",
+                           "scale": _SIGN_SCALE, "legend": None},
+                 "tooltip": _TOOLTIP + [{"field": "output",
+                                         "title": "Acumulado",
+                                         "format": ".4f"}]}},
+        ],
+    }
+
+
+def build_chart_spec(explanation, plot_type, max_display=10):
+    """
+    Convierte una explicación SHAP en una especificación Vega-Lite que
+    dibuja el navegador (st.vega_lite_chart).
+
+    Solo se serializan las contribuciones por variable original, así que
+    el coste en el servidor es el de construir un diccionario pequeño.
+
+    Args:
+        explanation (shap.Explanation): Explicación de un paciente.
+        plot_type (str): 'force', 'waterfall' o 'decision'.
+        max_display (int): Barras del waterfall; el resto se suma en una.
+
+    Returns:
+        dict: Especificación Vega-Lite con los datos incluidos.
+    """
+    base_value, rows = _contributions(explanation)
+    if plot_type == "force":
+        spec = _force_spec(base_value, rows)
+    elif plot_type == "waterfall":
+        spec = _waterfall_spec(base_value, rows, max(2, max_display))
+    else:
+        spec = _decision_spec(base_value, rows)
+    spec["$schema"] = "https://vega.github.io/schema/vega-lite/v5.json"
+    return spec
@@ -0,0 +1,396 @@
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import stroke_prediction as sp
+import stroke_SHAP as shp
+from cohort_stats import COHORT_STATS, CohortStatsMissingError
+from history_manager import HISTORY_MANAGER, count_text_tokens
+from plot_rendering import RENDERER
+from tracing import TRACER, submit_in_context
+from what_if import risk_sweep
+
+TOOL_WORKERS = int(os.environ.get("STROKE_BOT_TOOL_WORKERS", "4"))
+
+# Herramientas que dibujan y el tipo de gráfico que generan
+PLOT_TOOLS = {
+    "get_force_plot": "force",
+    "get_waterfall_plot": "waterfall",
+    "get_decision_plot": "decision",
+}
+
+NO_EXPLANATION_ERROR = ("No hay 'reverted_shap_explanation' en la sesión. "
+                        "Primero genera la explicación.")
+
+# Pool compartido para ejecutar las herramientas de un turno en paralelo
+TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=TOOL_WORKERS,
+                                   thread_name_prefix="stroke-bot-tool")
+
+
+def as_chat_tools(functions):
+    """
+    Convierte las definiciones de tools_config al formato 'tools' de la API
+    de chat.
+
+    Args:
+        functions (list): Definiciones con 'name', 'description' y
+            'parameters'.
+
+    Returns:
+        list: Herramientas con {"type": "function", "function": ...}.
+    """
+    return [{"type": "function", "function": function}
+            for function in functions]
+
+
+def create_tool_message(tool_call_id, payload):
+    """
+    Crea un mensaje con role='tool' para devolver a GPT el resultado de una
+    llamada a herramienta.
+    """
+    return {"role": "tool", "tool_call_id": tool_call_id,
+            "content": json.dumps(payload)}
+
+
+class ToolResult:
+    """
+    Resultado de ejecutar una herramienta fuera del hilo de Streamlit.
+
+    Args:
+        tool_call_id (str): Identificador de la llamada de GPT.
+        name (str): Nombre de la herramienta.
+        payload (dict): Respuesta serializable para GPT.
+        image (bytes, optional): PNG a mostrar en la interfaz.
+        updates (dict, optional): Cambios a aplicar al estado de la sesión.
+        chart (dict, optional): Especificación Vega-Lite a mostrar en la
+            interfaz.
+    """
+
+    def __init__(self, tool_call_id, name, payload, image=None, updates=None,
+                 chart=None):
+        self.tool_call_id = tool_call_id
+        self.name = name
+        self.payload = payload
+        self.image = image
+        self.updates = updates or {}
+        self.chart = chart
+
+    def to_message(self):
+        return create_tool_message(self.tool_call_id, self.payload)
+
+
+def _plot_status(plot_type, max_display):
+    if plot_type == "waterfall":
+        return f"Waterfall plot generado con max_display={max_display}."
+    return f"{plot_type.capitalize()} plot generado y mostrado en la interfaz."
+
+
+def run_tool(name, arguments, context):
+    """
+    Ejecuta una herramienta sin tocar st.session_state.
+
+    Args:
+        name (str): Nombre de la herramienta pedida por GPT.
+        arguments (dict): Argumentos ya decodificados.
+        context (dict): Estado de la sesión necesario (p. ej. la última
+            'reverted_shap_explanation').
+
+    Returns:
+        tuple: (payload, image, updates); image es un PNG o una
+            especificación Vega-Lite.
+    """
+    if name == "get_stroke_prediction":
+        return sp.get_stroke_prediction(arguments["person_data"]), None, {}
+
+    if name == "validate_input":
+        try:
+            sp.validate_input(arguments["person_data"])
+            return {"valid": True, "message": "Datos válidos."}, None, {}
+        except Exception as e:
+            # Todos los errores a la vez, para pedir los datos de una vez
+            return ({"valid": False, "message": str(e),
+                     "errors": getattr(e, "errors", [str(e)])}, None, {})
+
+    if name == "get_reverted_shap_explanation":
+        prediction = sp.get_stroke_prediction(arguments["person_data"])
+        # Sin probabilidad no hay resumen que cuadrar: se devuelve el error
+        if prediction["probability"] is None:
+            return prediction, None, {}
+        shap_explanation = shp.get_reverted_shap_explanation(
+            arguments["person_data"])
+        # A GPT solo se le envía el resumen; la explicación completa queda
+        # en la sesión para los gráficos
+        return (shp.summarize_explanation(shap_explanation,
+                                          prediction["probability"]), None,
+                {"reverted_shap_explanation": shap_explanation})
+
+    if name == "predict_and_explain":
+        try:
+            prediction, shap_explanation = shp.get_prediction_and_explanation(
+                arguments["person_data"])
+        except Exception as e:
+            return {"error": f"Error al predecir y explicar: {e}"}, None, {}
+        if prediction["probability"] is None:
+            return {"error": prediction["message"]}, None, {}
+        payload = {"prediction": prediction,
+                   "explanation": shp.summarize_explanation(
+                       shap_explanation, prediction["probability"])}
+        plot = None
+        plot_type = arguments.get("plot_type") or "none"
+        if plot_type != "none":
+            max_display = arguments.get("max_display", 10)
+            plot = RENDERER.render_plot(shap_explanation, plot_type,
+                                        max_display=max_display)
+            payload["plot"] = _plot_status(plot_type, max_display)
+        return (payload, plot,
+                {"reverted_shap_explanation": shap_explanation})
+
+    if name == "what_if_sweep":
+        try:
+            sweep = risk_sweep(arguments["person_data"], arguments["sweeps"])
+        except Exception as e:
+            return ({"error": f"Error en el análisis de sensibilidad: {e}"},
+                    None, {})
+        png = None
+        if arguments.get("plot"):
+            png = RENDERER.render_sweep(sweep)
+            sweep["plot"] = "Gráfico de sensibilidad mostrado en la interfaz."
+        return sweep, png, {}
+
+    if name == "get_cohort_statistics":
+        probability = None
+        if arguments.get("person_data"):
+            prediction = sp.get_stroke_prediction(arguments["person_data"])
+            if prediction["probability"] is None:
+                return {"error": prediction["message"]}, None, {}
+            probability = prediction["probability"]
+        try:
+            return (COHORT_STATS.summary(arguments.get("features"),
+                                         probability), None, {})
+        except (CohortStatsMissingError, ValueError) as e:
+            return {"error": str(e)}, None, {}
+
+    if name in PLOT_TOOLS:
+        shap_explanation = context.get("reverted_shap_explanation")
+        if shap_explanation is None:
+            return {"error": NO_EXPLANATION_ERROR}, None, {}
+        plot_type = PLOT_TOOLS[name]
+        max_display = arguments.get("max_display", 10)
+        # Ya estamos fuera del hilo de Streamlit: se dibuja aquí mismo. Con
+        # el motor 'vega' solo se genera la especificación y dibuja el
+        # navegador
+        plot = RENDERER.render_plot(shap_explanation, plot_type,
+                                    max_display=max_display)
+        return {"status": _plot_status(plot_type, max_display)}, plot, {}
+
+    return {"error": f"Herramienta desconocida: '{name}'."}, None, {}
+
+
+def _run_tool_call(tool_call, context):
+    name = tool_call["function"]["name"]
+    with TRACER.span(f"tool.{name}") as span:
+        try:
+            arguments = json.loads(tool_call["function"]["arguments"] or "{}")
+            payload, image, updates = run_tool(name, arguments, context)
+        except Exception as e:
+            payload = {"error": f"Error en '{name}': {e}"}
+            image, updates = None, {}
+        if span is not None and "error" in payload:
+            span.set(error=payload["error"])
+    chart = None
+    if isinstance(image, dict):
+        image, chart = None, image
+    return ToolResult(tool_call["id"], name, payload, image, updates, chart)
+
+
+def execute_tool_calls(tool_calls, context, executor=TOOL_EXECUTOR):
+    """
+    Ejecuta en paralelo todas las herramientas pedidas en un turno.
+
+    Las herramientas de cálculo (predicción, validación, SHAP) se ejecutan
+    primero y a la vez; después, los gráficos, que pueden depender de la
+    explicación calculada en la misma tanda.
+
+    Args:
+        tool_calls (list): Llamadas acumuladas del mensaje del asistente.
+        context (dict): Estado de la sesión; se actualiza con los cambios
+            de cada herramienta.
+        executor (Executor): Pool donde ejecutar las herramientas.
+
+    Returns:
+        list: ToolResult en el mismo orden que 'tool_calls'.
+    """
+    results = {}
+    phases = [
+        [call for call in tool_calls
+         if call["function"]["name"] not in PLOT_TOOLS],
+        [call for call in tool_calls
+         if call["function"]["name"] in PLOT_TOOLS],
+    ]
+    for phase in phases:
+        futures = [(call["id"], submit_in_context(executor, _run_tool_call,
+                                                  call, dict(context)))
+                   for call in phase]
+        for call_id, future in futures:
+            result = future.result()
+            context.update(result.updates)
+            results[call_id] = result
+    return [results[call["id"]] for call in tool_calls]
+
+
+def stream_completion(client, model, messages, tools=None, on_token=None):
+    """
+    Pide una respuesta en streaming y acumula texto y llamadas a
+    herramientas.
+
+    Args:
+        client (OpenAI): Cliente de OpenAI.
+        model (str): Modelo de chat.
+        messages (list): Historial a enviar.
+        tools (list, optional): Herramientas en formato 'tools'.
+        on_token (callable, optional): Recibe el texto acumulado cada vez
+            que llega un fragmento nuevo.
+
+    Returns:
+        dict: Mensaje del asistente con 'content' y, si las hay,
+        'tool_calls'.
+    """
+    with TRACER.span("llm.request", model=model,
+                     tools=len(tools or [])) as span:
+        message, usage = _stream_message(client, model, messages, tools,
+                                         on_token, span)
+        if span is not None:
+            if usage is None:
+                # Sin 'usage' en el stream se estima con el mismo contador
+                # que el presupuesto de tokens
+                usage = {
+                    "prompt_tokens": HISTORY_MANAGER.total_tokens(messages),
+                    "completion_tokens": count_text_tokens(
+                        json.dumps(message)),
+                    "estimated": True,
+                }
+            span.set(**usage, tool_calls=len(message.get("tool_calls", [])))
+    return message
+
+
+def _stream_message(client, model, messages, tools, on_token, span):
+    request = {"model": model, "messages": messages, "stream": True,
+               "stream_options": {"include_usage": True}}
+    if tools:
+        request["tools"] = tools
+        request["tool_choice"] = "auto"
+
+    content = ""
+    tool_calls = {}
+    usage = None
+    for chunk in client.chat.completions.create(**request):
+        if getattr(chunk, "usage", None) is not None:
+            usage = {"prompt_tokens": chunk.usage.prompt_tokens,
+                     "completion_tokens": chunk.usage.completion_tokens}
+        if not chunk.choices:
+            continue
+        if span is not None and "first_chunk_ms" not in span.attributes:
+            span.set(first_chunk_ms=round(span.elapsed() * 1000, 1))
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content += delta.content
+            if on_token is not None:
+                on_token(content)
+        for tool_call in delta.tool_calls or []:
+            # Los argumentos llegan troceados entre varios fragmentos
+            call = tool_calls.setdefault(tool_call.index, {
+                "id": None, "type": "function",
+                "function": {"name": "", "arguments": ""}})
+            if tool_call.id:
+                call["id"] = tool_call.id
+            if tool_call.function is not None:
+                if tool_call.function.name:
+                    call["function"]["name"] += tool_call.function.name
+                if tool_call.function.arguments:
+                    call["function"]["arguments"] += (
+                        tool_call.function.arguments)
+
+    message = {"role": "assistant", "content": content or None}
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[index]
+                                 for index in sorted(tool_calls)]
+    return message, usage
+
+
+def run_turn(client, model, messages, tools, context, on_token=None,
+             on_tool_result=None, executor=TOOL_EXECUTOR):
+    """
+    Ejecuta un turno completo del chat.
+
+    Primero se pide una respuesta con herramientas. Si GPT pide una o varias
+    herramientas, se ejecutan en paralelo y todos los resultados se envían
+    en una única petición de seguimiento, también en streaming.
+
+    Args:
+        client (OpenAI): Cliente de OpenAI.
+        model (str): Modelo de chat.
+        messages (list): Historial completo, mensaje de sistema incluido.
+        tools (list): Herramientas en formato 'tools'.
+        context (dict): Estado de la sesión que usan las herramientas.
+        on_token (callable, optional): Recibe el texto acumulado.
+        on_tool_result (callable, optional): Recibe cada ToolResult.
+        executor (Executor): Pool donde ejecutar las herramientas.
+
+    Returns:
+        list: Mensajes nuevos del turno (asistente y herramientas), el
+        último de ellos la respuesta final.
+    """
+    message = stream_completion(client, model, messages, tools, on_token)
+    if not message.get("tool_calls"):
+        return [message]
+    return _answer_tool_calls(client, model, messages, message, context,
+                              on_token, on_tool_result, executor)
+
+
+def run_local_turn(client, model, messages, name, arguments, context,
+                   on_token=None, on_tool_result=None,
+                   executor=TOOL_EXECUTOR):
+    """
+    Ejecuta un turno cuya llamada a herramienta ya se conoce de antemano
+    (p. ej. porque patient_parser extrajo todos los datos del mensaje).
+
+    Se ahorra la primera petición a GPT: la llamada se registra en el
+    historial como si la hubiera pedido el asistente, se ejecuta en local y
+    GPT solo redacta la respuesta final.
+
+    Args:
+        client (OpenAI): Cliente de OpenAI.
+        model (str): Modelo de chat.
+        messages (list): Historial completo, mensaje de sistema incluido.
+        name (str): Herramienta a ejecutar.
+        arguments (dict): Argumentos de la herramienta.
+        context (dict): Estado de la sesión que usan las herramientas.
+        on_token (callable, optional): Recibe el texto acumulado.
+        on_tool_result (callable, optional): Recibe cada ToolResult.
+        executor (Executor): Pool donde ejecutar las herramientas.
+
+    Returns:
+        list: Mensajes nuevos del turno, igual que run_turn.
+    """
+    message = {"role": "assistant", "content": None, "tool_calls": [{
+        "id": f"call_local_{uuid.uuid4().hex[:24]}", "type": "function",
+        "function": {"name": name, "arguments": json.dumps(arguments)}}]}
+    return _answer_tool_calls(client, model, messages, message, context,
+                              on_token, on_tool_result, executor)
+
+
+def _answer_tool_calls(client, model, messages, message, context, on_token,
+                       on_tool_result, executor):
+    new_messages = [message]
+    with TRACER.span("tools", calls=len(message["tool_calls"])):
+        results = execute_tool_calls(message["tool_calls"], context,
+                                     executor)
+    for result in results:
+        new_messages.append(result.to_message())
+        if on_tool_result is not None:
+            on_tool_result(result)
+
+    message = stream_completion(client, model, messages + new_messages,
+                                on_token=on_token)
+    new_messages.append(message)
+    return new_messages
@@ -0,0 +1,307 @@
+import argparse
+import json
+import os
+import threading
+import time
+import numpy as np
+from explanation_cache import file_fingerprint
+from model_registry import REGISTRY
+
+COHORT_PATH = os.environ.get("STROKE_BOT_COHORT_PATH",
+                             os.path.join(".cache", "cohort_stats.npz"))
+# Intervalos por cuantiles en los resúmenes de dependencia numéricos
+DEPENDENCE_BINS = 6
+RISK_PERCENTILES = (5, 10, 25, 50, 75, 90, 95)
+# Filas de fondo explicadas por llamada a shapley_values
+EXPLAIN_CHUNK_ROWS = 256
+
+
+class CohortStatsMissingError(RuntimeError):
+    """
+    No hay estadísticas precalculadas válidas para el modelo actual.
+    """
+
+
+def _source_paths(registry):
+    return [registry.model_path, registry.preprocessor_path,
+            registry.background_data_path]
+
+
+def _fingerprint(registry):
+    from grouped_shap import BACKGROUND_METHOD, BACKGROUND_SIZE
+
+    # Los mismos archivos con el mismo fondo de referencia y el mismo
+    # motor y precisión; cualquier cambio invalida las estadísticas
+    registry.get_predictor()
+    return json.dumps({
+        "sources": file_fingerprint(_source_paths(registry)),
+        "background_size": BACKGROUND_SIZE,
+        "background_method": BACKGROUND_METHOD,
+        "predictor": registry.predictor_signature(),
+    }, sort_keys=True)
+
+
+def decode_background(encoder, background):
+    """
+    Recupera los valores originales de las filas de fondo transformadas.
+
+    Las numéricas se desestandarizan; en las categóricas se toma la columna
+    one-hot activa, o None si no hay ninguna (categoría no vista por el
+    OneHotEncoder).
+
+    Returns:
+        dict: Matriz de valores por variable original.
+    """
+    n_numerical = len(encoder.numerical_features)
+    decoded = {}
+    for j, key in enumerate(encoder.numerical_features):
+        decoded[key] = background[:, j] * encoder.scale[j] + encoder.mean[j]
+    offset = n_numerical
+    for key, values in zip(encoder.categorical_features, encoder.categories):
+        block = background[:, offset:offset + len(values)] > 0.5
+        labels = np.array([str(value) for value in values] + [None],
+                          dtype=object)
+        active = np.where(block.any(axis=1), block.argmax(axis=1),
+                          len(values))
+        decoded[key] = labels[active]
+        offset += len(values)
+    return decoded
+
+
+def _numeric_dependence(values, shap_values, risks, bins=DEPENDENCE_BINS):
+    edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)))
+    index = np.clip(np.searchsorted(edges, values, side="right") - 1, 0,
+                    len(edges) - 2)
+    summary = []
+    for b in range(len(edges) - 1):
+        mask = index == b
+        if not mask.any():
+            continue
+        summary.append({
+            "range": [round(float(edges[b]), 1),
+                      round(float(edges[b + 1]), 1)],
+            "n": int(mask.sum()),
+            "mean_shap": round(float(shap_values[mask].mean()), 4),
+            "mean_risk": round(float(risks[mask].mean()), 4),
+        })
+    return summary
+
+
+def _categorical_dependence(labels, shap_values, risks):
+    summary = []
+    for label in dict.fromkeys(labels.tolist()):
+        mask = labels == label
+        summary.append({
+            "value": label if label is not None else "otra",
+            "n": int(mask.sum()),
+            "mean_shap": round(float(shap_values[mask].mean()), 4),
+            "mean_risk": round(float(risks[mask].mean()), 4),
+        })
+    return sorted(summary, key=lambda item: -item["n"])
+
+
+def precompute(registry=REGISTRY, path=COHORT_PATH, rows=None,
+               progress=True):
+    """
+    Explica las filas de background_data.pkl y guarda las estadísticas
+    globales de la cohorte.
+
+    Se calculan la predicción y los valores SHAP agrupados de cada fila y,
+    a partir de ellos, la importancia media |SHAP| por variable original,
+    un resumen de dependencia por variable (intervalos de cuantiles para
+    las numéricas, categorías para las categóricas) y los percentiles de
+    riesgo. Las probabilidades ordenadas se guardan para situar después a
+    un paciente con una búsqueda binaria.
+
+    Args:
+        registry (ModelRegistry): Registro del que leer modelo y fondo.
+        path (str): Archivo .npz de salida.
+        rows (int, optional): Filas equiespaciadas a explicar. Por defecto,
+            todas.
+        progress (bool): Si es True, informa del avance por consola.
+
+    Returns:
+        dict: Resumen guardado.
+    """
+    from grouped_shap import summarize_background
+
+    encoder = registry.get_encoder()
+    background = np.asarray(registry.get_background_data(),
+                            dtype=np.float32)
+    background = summarize_background(background, rows)
+    explainer = registry.get_grouped_explainer()
+    risks = registry.get_predictor().predict(
+        background, batch_size=len(background), verbose=0)[:, 0].astype(
+        np.float64)
+
+    start = time.perf_counter()
+    shap_values = np.zeros((len(background), len(explainer.groups)))
+    base_values = np.zeros(len(background))
+    for first in range(0, len(background), EXPLAIN_CHUNK_ROWS):
+        last = min(first + EXPLAIN_CHUNK_ROWS, len(background))
+        shap_values[first:last], base_values[first:last] = (
+            explainer.shapley_values(background[first:last]))
+        if progress:
+            print(f"{last}/{len(background)} filas explicadas "
+                  f"({time.perf_counter() - start:.0f} s)")
+
+    decoded = decode_background(encoder, background)
+    features = list(encoder.feature_names)
+    mean_abs = np.abs(shap_values).mean(axis=0)
+    importance = [
+        {"feature": feature,
+         "mean_abs_shap": round(float(mean_abs[i]), 4),
+         "mean_shap": round(float(shap_values[:, i].mean()), 4)}
+        for i, feature in enumerate(features)]
+    importance.sort(key=lambda item: -item["mean_abs_shap"])
+
+    dependence = {}
+    for i, feature in enumerate(features):
+        if feature in encoder.numerical_features:
+            dependence[feature] = _numeric_dependence(
+                decoded[feature], shap_values[:, i], risks)
+        else:
+            dependence[feature] = _categorical_dependence(
+                decoded[feature], shap_values[:, i], risks)
+
+    summary = {
+        "n_rows": len(background),
+        "reference_rows": len(explainer.background),
+        "base_value": round(float(base_values.mean()), 4),
+        "importance": importance,
+        "dependence": dependence,
+        "risk": {
+            "mean": round(float(risks.mean()), 4),
+            "percentiles": {str(p): round(float(np.percentile(risks, p)), 4)
+                            for p in RISK_PERCENTILES},
+            "share_above_50": round(float(np.mean(risks >= 0.5)), 4),
+        },
+    }
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    np.savez(path, summary=np.array(json.dumps(summary)),
+             fingerprint=np.array(_fingerprint(registry)),
+             sorted_risks=np.sort(risks), shap_values=shap_values,
+             feature_names=np.array(features))
+    return summary
+
+
+class CohortStats:
+    """
+    Estadísticas de la cohorte precalculadas con precompute().
+
+    Se cargan la primera vez que se piden y solo si corresponden al modelo
+    y los datos actuales.
+
+    Args:
+        path (str): Archivo .npz generado por precompute().
+        registry (ModelRegistry): Registro cuyos archivos deben coincidir.
+    """
+
+    def __init__(self, path=COHORT_PATH, registry=REGISTRY):
+        self.path = path
+        self.registry = registry
+        self._summary = None
+        self._sorted_risks = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._summary is not None:
+                return
+            if not os.path.exists(self.path):
+                raise CohortStatsMissingError(
+                    "No hay estadísticas de la cohorte precalculadas. "
+                    "Ejecuta 'python cohort_stats.py precompute'.")
+            with np.load(self.path) as data:
+                fingerprint = str(data["fingerprint"])
+                if fingerprint != _fingerprint(self.registry):
+                    raise CohortStatsMissingError(
+                        "Las estadísticas de la cohorte no corresponden al "
+                        "modelo o al fondo de SHAP actuales. Vuelve a ejecutar 'python "
+                        "cohort_stats.py precompute'.")
+                self._sorted_risks = data["sorted_risks"]
+                self._summary = json.loads(str(data["summary"]))
+
+    def risk_percentile(self, probability):
+        """
+        Sitúa una probabilidad en la distribución de riesgo de la cohorte
+        mediante búsqueda binaria.
+
+        Returns:
+            float: Porcentaje de la cohorte con riesgo menor o igual.
+        """
+        self._load()
+        rank = np.searchsorted(self._sorted_risks, probability, side="right")
+        return round(100.0 * rank / len(self._sorted_risks), 1)
+
+    def summary(self, features=None, probability=None):
+        """
+        Devuelve el resumen global para enviarlo al LLM.
+
+        Args:
+            features (list, optional): Variables cuyo resumen de
+                dependencia se incluye. Por defecto, ninguna.
+            probability (float, optional): Riesgo de un paciente a situar
+                en la cohorte.
+
+        Returns:
+            dict: Importancia global, percentiles de riesgo y, si se piden,
+                dependencias y percentil del paciente.
+
+        Raises:
+            CohortStatsMissingError: Si no hay estadísticas válidas.
+            ValueError: Si alguna variable no existe.
+        """
+        self._load()
+        payload = {key: self._summary[key]
+                   for key in ("n_rows", "base_value", "importance",
+                               "risk")}
+        if features:
+            unknown = [f for f in features
+                       if f not in self._summary["dependence"]]
+            if unknown:
+                raise ValueError(f"Variables desconocidas: {unknown}")
+            payload["dependence"] = {
+                feature: self._summary["dependence"][feature]
+                for feature in features}
+        if probability is not None:
+            payload["patient"] = {
+                "probability": round(float(probability), 4),
+                "cohort_percentile": self.risk_percentile(probability),
+            }
+        return payload
+
+
+# Instancia compartida por todas las sesiones del proceso
+COHORT_STATS = CohortStats()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precalcula las estadísticas globales de la cohorte.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    precompute_parser = subparsers.add_parser(
+        "precompute", help="Explica el fondo y guarda las estadísticas.")
+    precompute_parser.add_argument("--output", default=COHORT_PATH)
+    precompute_parser.add_argument(
+        "--rows", type=int, default=None,
+        help="Filas equiespaciadas a explicar (por defecto, todas).")
+    subparsers.add_parser("show", help="Muestra el resumen guardado.")
+
+    args = parser.parse_args()
+    if args.command == "precompute":
+        start = time.perf_counter()
+        summary = precompute(path=args.output, rows=args.rows)
+        print(f"{summary['n_rows']} filas en "
+              f"{time.perf_counter() - start:.1f} s -> {args.output}")
+    else:
+        summary = COHORT_STATS.summary(
+            features=list(COHORT_STATS.registry.get_encoder().feature_names))
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+import numpy as np
+
+MODEL_PATH = "best_ann.keras"
+BACKGROUND_DATA_PATH = "background_data.pkl"
+CACHE_PATH = os.path.join(".cache", "shap_explanations.sqlite3")
+
+MEMORY_ENTRIES = int(os.environ.get("STROKE_BOT_SHAP_CACHE_MEMORY", "256"))
+DISK_ENTRIES = int(os.environ.get("STROKE_BOT_SHAP_CACHE_DISK", "5000"))
+
+# Segundos que un proceso espera a que otro libere la base de datos
+BUSY_TIMEOUT = 30.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS explanations (
+    key TEXT PRIMARY KEY,
+    last_access REAL NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS explanations_last_access
+    ON explanations (last_access);
+"""
+
+
+def file_fingerprint(paths):
+    """
+    Calcula una huella SHA-256 del contenido de varios archivos.
+
+    Args:
+        paths (list): Rutas de los archivos.
+
+    Returns:
+        str: Huella hexadecimal.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def canonical_key(person_data, *parts):
+    """
+    Genera una clave estable para un paciente, independiente del orden de
+    las claves del diccionario.
+
+    Args:
+        person_data (dict): Datos del paciente.
+        *parts: Valores adicionales que distinguen la clave (modo, etc.).
+
+    Returns:
+        str: Hash SHA-256 hexadecimal.
+    """
+    payload = json.dumps([person_data, parts], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def to_payload(explanation):
+    # Representación compacta y sin objetos de SHAP para el disco
+    return {
+        "values": np.asarray(explanation.values),
+        "base_values": np.asarray(explanation.base_values),
+        "data": np.asarray(explanation.data),
+        "feature_names": list(explanation.feature_names),
+    }
+
+
+def _pack(payload):
+    return zlib.compress(pickle.dumps(payload,
+                                      protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _unpack(blob):
+    return pickle.loads(zlib.decompress(blob))
+
+
+def from_payload(payload):
+    import shap
+
+    # Copias para que quien reciba la explicación no altere la caché
+    return shap.Explanation(values=payload["values"].copy(),
+                            base_values=payload["base_values"].copy(),
+                            data=payload["data"].copy(),
+                            feature_names=list(payload["feature_names"]))
+
+
+class ExplanationCache:
+    """
+    Caché de explicaciones SHAP en dos niveles: LRU en memoria y SQLite en
+    disco.
+
+    Las claves combinan el hash normalizado de 'person_data' con la huella
+    de best_ann.keras y background_data.pkl. Si alguno de los dos archivos
+    cambia, la caché se vacía automáticamente.
+
+    La base de datos usa WAL y puede compartirse entre procesos (la app de
+    Streamlit e inference_server.py). La última consulta de cada entrada
+    vive en una columna indexada, así que refrescarla es un UPDATE y la
+    expulsión borra las más antiguas sin leer sus datos. SQLite reutiliza
+    las páginas liberadas, por lo que el archivo no crece sin límite.
+
+    Args:
+        path (str): Base de datos SQLite.
+        memory_entries (int): Máximo de explicaciones en memoria.
+        disk_entries (int): Máximo de explicaciones en disco.
+        artifact_paths (list): Archivos cuya modificación invalida la caché.
+    """
+
+    def __init__(self, path=CACHE_PATH, memory_entries=MEMORY_ENTRIES,
+                 disk_entries=DISK_ENTRIES, artifact_paths=None):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.artifact_paths = list(artifact_paths
+                                   or [MODEL_PATH, BACKGROUND_DATA_PATH])
+
+        self._memory = OrderedDict()
+        self._connection = None
+        self._lock = threading.RLock()
+        self._artifact_stats = None
+        self._fingerprint = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0,
+                      "evictions": 0, "invalidations": 0}
+
+    def _check_artifacts(self):
+        """
+        Recalcula la huella si los artefactos cambiaron en disco y vacía la
+        caché cuando la huella no coincide con la guardada.
+        """
+        artifact_stats = [(os.stat(path).st_mtime_ns, os.stat(path).st_size)
+                          for path in self.artifact_paths]
+        if artifact_stats == self._artifact_stats:
+            return
+        fingerprint = file_fingerprint(self.artifact_paths)
+        self._artifact_stats = artifact_stats
+        if fingerprint == self._fingerprint:
+            return
+
+        self._memory.clear()
+        connection = self._connect()
+        with connection:
+            # Lectura y borrado en la misma transacción de escritura para
+            # que dos procesos no se pisen al invalidar
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT value FROM meta WHERE name = 'fingerprint'"
+            ).fetchone()
+            if row is None or row[0] != fingerprint:
+                deleted = connection.execute(
+                    "DELETE FROM explanations").rowcount
+                if self._fingerprint is not None or deleted:
+                    self.stats["invalidations"] += 1
+                connection.execute(
+                    "INSERT OR REPLACE INTO meta (name, value) "
+                    "VALUES ('fingerprint', ?)", (fingerprint,))
+        self._fingerprint = fingerprint
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Una conexión por proceso protegida por el cerrojo; el timeout
+            # cubre las escrituras simultáneas de otros procesos
+            self._connection = sqlite3.connect(self.path,
+                                               timeout=BUSY_TIMEOUT,
+                                               check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(_SCHEMA)
+        return self._connection
+
+    def key(self, person_data, *parts):
+        with self._lock:
+            self._check_artifacts()
+            return canonical_key(person_data, self._fingerprint, *parts)
+
+    def get(self, key):
+        """
+        Busca una explicación en memoria y, si no está, en disco.
+
+        Args:
+            key (str): Clave obtenida con key().
+
+        Returns:
+            shap.Explanation | None: Explicación o None si no está.
+        """
+        with self._lock:
+            self._check_artifacts()
+            payload = self._memory.get(key)
+            if payload is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return from_payload(payload)
+
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT payload FROM explanations WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            with connection:
+                # Solo se refresca la marca de uso, no los datos
+                connection.execute(
+                    "UPDATE explanations SET last_access = ? WHERE key = ?",
+                    (time.time(), key))
+
+            payload = _unpack(row[0])
+            self.stats["disk_hits"] += 1
+            self._remember(key, payload)
+            return from_payload(payload)
+
+    def put(self, key, explanation):
+        """
+        Guarda una explicación en ambos niveles.
+
+        Args:
+            key (str): Clave obtenida con key().
+            explanation (shap.Explanation): Explicación a guardar.
+        """
+        payload = to_payload(explanation)
+        blob = _pack(payload)
+        with self._lock:
+            self._remember(key, payload)
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO explanations "
+                    "(key, last_access, payload) VALUES (?, ?, ?)",
+                    (key, time.time(), blob))
+                self._evict_disk(connection)
+
+    def get_or_compute(self, person_data, compute, *parts):
+        """
+        Devuelve la explicación cacheada o la calcula y la guarda.
+
+        Args:
+            person_data (dict): Datos del paciente.
+            compute (callable): Función sin argumentos que calcula la
+                explicación.
+            *parts: Valores adicionales de la clave (modo, etc.).
+
+        Returns:
+            shap.Explanation: Explicación del paciente.
+        """
+        key = self.key(person_data, *parts)
+        explanation = self.get(key)
+        if explanation is None:
+            explanation = compute()
+            self.put(key, explanation)
+        return explanation
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM explanations")
+
+    def info(self):
+        """
+        Devuelve contadores y tamaño de cada nivel para monitorización.
+
+        Returns:
+            dict: Aciertos, fallos, expulsiones, invalidaciones y entradas.
+        """
+        with self._lock:
+            disk_size = self._connect().execute(
+                "SELECT COUNT(*) FROM explanations").fetchone()[0]
+            return dict(self.stats, memory_size=len(self._memory),
+                        disk_size=disk_size)
+
+    def _remember(self, key, payload):
+        self._memory[key] = payload
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _evict_disk(self, connection):
+        size = connection.execute(
+            "SELECT COUNT(*) FROM explanations").fetchone()[0]
+        if size <= self.disk_entries:
+            return
+        # Se baja al 90% del límite para no expulsar en cada put
+        excess = size - int(self.disk_entries * 0.9)
+        deleted = connection.execute(
+            "DELETE FROM explanations WHERE key IN (SELECT key FROM "
+            "explanations ORDER BY last_access LIMIT ?)",
+            (excess,)).rowcount
+        self.stats["evictions"] += deleted
+
+
+# Instancia compartida por todas las sesiones del proceso
+EXPLANATION_CACHE = ExplanationCache()
@@ -0,0 +1,243 @@
+import numpy as np
+
+# Configuración de columnas
+CATEGORICAL_FEATURES = [
+    "gender", "hypertension", "heart_disease", "ever_married",
+    "work_type", "Residence_type", "smoking_status"
+]
+NUMERICAL_FEATURES = ["age", "avg_glucose_level", "bmi"]
+
+# Diferencia máxima admitida frente a ColumnTransformer.transform
+EQUIVALENCE_ATOL = 1e-6
+
+
+class CompiledEncoder:
+    """
+    Réplica compilada del ColumnTransformer de preprocessor.pkl.
+
+    Estandariza las columnas numéricas con las medias y escalas del
+    StandardScaler y codifica las categóricas en one-hot mediante tablas de
+    búsqueda, escribiendo directamente en una matriz float32 sin pasar por
+    pandas ni sklearn.
+
+    Args:
+        mean (array-like): Media de cada columna numérica.
+        scale (array-like): Escala de cada columna numérica.
+        categories (list): Categorías de cada columna categórica, en el orden
+            del OneHotEncoder.
+        handle_unknown (str): 'ignore' deja a cero las categorías
+            desconocidas; 'error' lanza ValueError.
+        numerical_features (list): Nombres de las columnas numéricas.
+        categorical_features (list): Nombres de las columnas categóricas.
+    """
+
+    def __init__(self, mean, scale, categories, handle_unknown="ignore",
+                 numerical_features=None, categorical_features=None):
+        self.numerical_features = list(numerical_features
+                                       or NUMERICAL_FEATURES)
+        self.categorical_features = list(categorical_features
+                                         or CATEGORICAL_FEATURES)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.categories = [list(values) for values in categories]
+        self.handle_unknown = handle_unknown
+
+        # Tabla valor -> columna de salida para cada variable categórica
+        self._lookups = []
+        offset = len(self.numerical_features)
+        for values in self.categories:
+            self._lookups.append(
+                {value: offset + j for j, value in enumerate(values)})
+            offset += len(values)
+        self.n_outputs = offset
+
+    @classmethod
+    def from_preprocessor(cls, preprocessor):
+        """
+        Construye el codificador a partir del ColumnTransformer ajustado.
+
+        Args:
+            preprocessor (ColumnTransformer): Preprocesador con los pasos
+                'num' (StandardScaler) y 'cat' (OneHotEncoder).
+
+        Returns:
+            CompiledEncoder: Codificador equivalente.
+
+        Raises:
+            ValueError: Si el preprocesador tiene una estructura distinta.
+        """
+        names = [name for name, _, _ in preprocessor.transformers_
+                 if name != "remainder"]
+        if names != ["num", "cat"]:
+            raise ValueError(
+                f"Estructura de preprocesador no soportada: {names}")
+
+        scaler = preprocessor.named_transformers_['num']
+        encoder = preprocessor.named_transformers_['cat']
+        if encoder.drop is not None:
+            raise ValueError("No se admite OneHotEncoder con 'drop'.")
+
+        n_numerical = scaler.n_features_in_
+        mean = (scaler.mean_ if scaler.with_mean
+                else np.zeros(n_numerical))
+        scale = (scaler.scale_ if scaler.with_std
+                 else np.ones(n_numerical))
+        numerical_features, categorical_features = [
+            list(columns) for name, _, columns in preprocessor.transformers_
+            if name in ("num", "cat")]
+
+        return cls(mean, scale, encoder.categories_,
+                   handle_unknown=encoder.handle_unknown,
+                   numerical_features=numerical_features,
+                   categorical_features=categorical_features)
+
+    @property
+    def feature_names(self):
+        return self.numerical_features + self.categorical_features
+
+    @property
+    def output_names(self):
+        """
+        Nombre de cada columna de salida, con el mismo formato que
+        ColumnTransformer.get_feature_names_out para la parte one-hot
+        ('gender_Male', ...).
+        """
+        return self.numerical_features + [
+            f"{key}_{value}"
+            for key, values in zip(self.categorical_features,
+                                   self.categories)
+            for value in values]
+
+    def transform(self, records, out=None):
+        """
+        Transforma uno o varios pacientes en la matriz de entrada del modelo.
+
+        Args:
+            records (dict | list): Un diccionario de paciente o una lista de
+                ellos.
+            out (np.ndarray, optional): Matriz float32 preasignada de forma
+                (n_filas, n_outputs) donde escribir el resultado.
+
+        Returns:
+            np.ndarray: Matriz float32 transformada.
+        """
+        if isinstance(records, dict):
+            records = [records]
+        columns = {key: [record[key] for record in records]
+                   for key in self.feature_names}
+        return self.transform_columns(columns, out=out)
+
+    def transform_columns(self, columns, out=None):
+        """
+        Transforma datos columnares ({clave: secuencia de valores}).
+
+        Args:
+            columns (dict): Secuencia de valores por variable; todas de la
+                misma longitud.
+            out (np.ndarray, optional): Matriz float32 preasignada.
+
+        Returns:
+            np.ndarray: Matriz float32 transformada.
+
+        Raises:
+            ValueError: Si hay una categoría desconocida y
+                handle_unknown='error', o si 'out' no tiene la forma
+                esperada.
+        """
+        n_rows = len(columns[self.numerical_features[0]])
+        if out is None:
+            out = np.zeros((n_rows, self.n_outputs), dtype=np.float32)
+        else:
+            if out.shape != (n_rows, self.n_outputs):
+                raise ValueError(
+                    f"'out' debe tener forma {(n_rows, self.n_outputs)}.")
+            out.fill(0.0)
+
+        for j, key in enumerate(self.numerical_features):
+            values = np.asarray(columns[key], dtype=np.float64)
+            out[:, j] = (values - self.mean[j]) / self.scale[j]
+
+        rows = np.arange(n_rows)
+        for key, lookup in zip(self.categorical_features, self._lookups):
+            indices = np.fromiter(
+                (lookup.get(value, -1) for value in columns[key]),
+                dtype=np.intp, count=n_rows)
+            known = indices >= 0
+            if not known.all() and self.handle_unknown == "error":
+                unknown = columns[key][int(np.argmin(known))]
+                raise ValueError(
+                    f"Categoría desconocida '{unknown}' en '{key}'.")
+            out[rows[known], indices[known]] = 1.0
+
+        return out
+
+
+def probe_records(encoder):
+    """
+    Genera pacientes sintéticos que recorren todas las categorías conocidas,
+    además de valores desconocidos y los valores de entrada de la app.
+
+    Args:
+        encoder (CompiledEncoder): Codificador de referencia.
+
+    Returns:
+        list: Lista de diccionarios de pacientes.
+    """
+    extra_values = {
+        "gender": ["Male", "Female"],
+        "hypertension": [True, False],
+        "heart_disease": [True, False],
+        "ever_married": [True, False],
+        "work_type": ["Private", "Self-employed", "Govt_job", "children",
+                      "Never_worked"],
+        "Residence_type": ["Urban", "Rural"],
+        "smoking_status": ["never smoked", "formerly smoked", "smokes",
+                           "Unknown"],
+    }
+    options = {
+        key: list(values) + [value for value in extra_values.get(key, [])
+                             if value not in values]
+        for key, values in zip(encoder.categorical_features,
+                               encoder.categories)
+    }
+    n_rows = max(len(values) for values in options.values()) * 4
+    records = []
+    for i in range(n_rows):
+        record = {key: 1.0 + 7.3 * i + 11.0 * j
+                  for j, key in enumerate(encoder.numerical_features)}
+        for key, values in options.items():
+            record[key] = values[i % len(values)]
+        records.append(record)
+    return records
+
+
+def check_equivalence(encoder, preprocessor, records=None,
+                      atol=EQUIVALENCE_ATOL):
+    """
+    Compara la salida del codificador con ColumnTransformer.transform.
+
+    Args:
+        encoder (CompiledEncoder): Codificador a verificar.
+        preprocessor (ColumnTransformer): Transformador de referencia.
+        records (list, optional): Pacientes de prueba. Por defecto se usan
+            los de probe_records.
+        atol (float): Diferencia absoluta máxima admitida.
+
+    Returns:
+        float: Diferencia absoluta máxima observada.
+
+    Raises:
+        ValueError: Si la diferencia supera 'atol'.
+    """
+    import pandas as pd
+
+    records = records or probe_records(encoder)
+    expected = preprocessor.transform(
+        pd.DataFrame(records)[encoder.feature_names])
+    actual = encoder.transform(records)
+    max_abs_diff = float(np.max(np.abs(actual - expected.astype(np.float32))))
+    if max_abs_diff > atol:
+        raise ValueError(
+            f"El codificador compilado difiere del preprocesador en "
+            f"{max_abs_diff:.2e} (tolerancia {atol:.0e}).")
+    return max_abs_diff
@@ -0,0 +1,497 @@
+import argparse
+import json
+import os
+import time
+from math import factorial
+import numpy as np
+
+# Número de filas de background_data.pkl usadas como referencia
+BACKGROUND_SIZE = int(os.environ.get("STROKE_BOT_GROUPED_BACKGROUND", "100"))
+# Cómo se resume el fondo: 'uniform' (filas equiespaciadas), 'kmeans'
+# (centroides ponderados), 'stratified' (muestreo por combinación de
+# categorías) o 'categorical' (una referencia por combinación)
+BACKGROUND_METHOD = os.environ.get("STROKE_BOT_GROUPED_BACKGROUND_METHOD",
+                                   "uniform")
+BACKGROUND_METHODS = ("uniform", "kmeans", "stratified", "categorical")
+KMEANS_ITERATIONS = 50
+# Filas evaluadas por llamada al modelo al calcular v(S); con fondos grandes
+# las coaliciones se evalúan por bloques de filas de referencia
+PREDICT_CHUNK_ROWS = 1 << 17
+
+
+def feature_groups(encoder):
+    """
+    Agrupa las columnas transformadas por variable original.
+
+    Args:
+        encoder (CompiledEncoder): Codificador con las categorías del
+            preprocesador.
+
+    Returns:
+        list: Para cada variable original (en el orden de
+        encoder.feature_names), la lista de índices de columna que ocupa en
+        la matriz transformada.
+    """
+    groups = [[j] for j in range(len(encoder.numerical_features))]
+    offset = len(encoder.numerical_features)
+    for values in encoder.categories:
+        groups.append(list(range(offset, offset + len(values))))
+        offset += len(values)
+    return groups
+
+
+def summarize_background(background, size=BACKGROUND_SIZE):
+    """
+    Selecciona filas equiespaciadas del fondo de forma determinista.
+
+    Args:
+        background (np.ndarray): Datos de fondo transformados.
+        size (int): Número máximo de filas a conservar.
+
+    Returns:
+        np.ndarray: Subconjunto del fondo.
+    """
+    if size is None or len(background) <= size:
+        return background
+    indices = np.linspace(0, len(background) - 1, size).round().astype(int)
+    return background[indices]
+
+
+def _category_codes(background, categorical_groups):
+    """
+    Devuelve un código entero por fila con su combinación de categorías.
+    """
+    blocks = background[:, [j for group in categorical_groups
+                            for j in group]] > 0.5
+    _, codes = np.unique(blocks, axis=0, return_inverse=True)
+    return codes.reshape(-1)
+
+
+def _nearest_center(x, centers):
+    distances = ((x * x).sum(axis=1)[:, None] - 2.0 * x @ centers.T
+                 + (centers * centers).sum(axis=1)[None, :])
+    return distances.argmin(axis=1)
+
+
+def _kmeans_background(background, size, categorical_groups,
+                       iterations=KMEANS_ITERATIONS, seed=0):
+    x = background.astype(np.float64)
+    rng = np.random.default_rng(seed)
+    # Inicialización k-means++ con semilla fija: el resumen es determinista
+    centers = [x[rng.integers(len(x))]]
+    closest = ((x - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, size):
+        if closest.sum() == 0:
+            break
+        chosen = x[rng.choice(len(x), p=closest / closest.sum())]
+        centers.append(chosen)
+        closest = np.minimum(closest, ((x - chosen) ** 2).sum(axis=1))
+    centers = np.array(centers)
+
+    for _ in range(iterations):
+        labels = _nearest_center(x, centers)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, x)
+        counts = np.bincount(labels, minlength=len(centers))
+        updated = np.where(counts[:, None] > 0,
+                           sums / np.maximum(counts, 1)[:, None], centers)
+        if np.allclose(updated, centers):
+            break
+        centers = updated
+
+    labels = _nearest_center(x, centers)
+    counts = np.bincount(labels, minlength=len(centers))
+    kept = np.flatnonzero(counts)
+    # Un centroide con one-hot fraccionario no es un paciente posible: cada
+    # variable categórica toma la categoría más frecuente de su grupo
+    for k in kept:
+        members = background[labels == k]
+        for group in categorical_groups:
+            patterns, frequency = np.unique(members[:, group], axis=0,
+                                            return_counts=True)
+            centers[k, group] = patterns[frequency.argmax()]
+    return centers[kept], counts[kept]
+
+
+def _stratified_background(background, size, categorical_groups):
+    codes = _category_codes(background, categorical_groups)
+    strata_counts = np.bincount(codes)
+    order = np.argsort(-strata_counts, kind="stable")
+    allocation = np.zeros(len(strata_counts), dtype=int)
+    if size < len(strata_counts):
+        # No hay filas para todos los estratos: uno por cada uno de los más
+        # frecuentes
+        allocation[order[:size]] = 1
+    else:
+        # Una fila por estrato y el resto en proporción a su tamaño, por
+        # restos mayores
+        allocation[:] = 1
+        share = (size - len(strata_counts)) * strata_counts / len(codes)
+        allocation += np.floor(share).astype(int)
+        remainder = size - allocation.sum()
+        allocation[np.argsort(-(share % 1), kind="stable")[:remainder]] += 1
+        allocation = np.minimum(allocation, strata_counts)
+
+    rows, weights = [], []
+    for stratum in np.flatnonzero(allocation):
+        members = np.flatnonzero(codes == stratum)
+        picks = np.linspace(0, len(members) - 1,
+                            allocation[stratum]).round().astype(int)
+        rows.append(background[members[np.unique(picks)]])
+        # Cada fila representa su parte del estrato completo
+        weights.append(np.full(len(rows[-1]),
+                               strata_counts[stratum] / len(rows[-1])))
+    return np.concatenate(rows), np.concatenate(weights)
+
+
+def _categorical_background(background, size, categorical_groups):
+    codes = _category_codes(background, categorical_groups)
+    counts = np.bincount(codes)
+    order = np.argsort(-counts, kind="stable")
+    if size is not None:
+        order = order[:size]
+    rows = np.zeros((len(order), background.shape[1]))
+    for i, code in enumerate(order):
+        members = background[codes == code]
+        # Numéricas: media de la combinación; categóricas: la combinación
+        rows[i] = members.mean(axis=0)
+        for group in categorical_groups:
+            rows[i, group] = members[0, group]
+    return rows, counts[order]
+
+
+def reference_background(background, groups, n_numerical,
+                         size=BACKGROUND_SIZE, method=BACKGROUND_METHOD):
+    """
+    Resume el fondo en un conjunto de filas de referencia ponderadas.
+
+    El coste de cada explicación crece linealmente con el número de filas
+    de referencia, así que 'size' fija el punto entre latencia y fidelidad
+    respecto al fondo completo (ver background_report).
+
+    Args:
+        background (np.ndarray): Datos de fondo transformados.
+        groups (list): Índices de columna de cada variable original, con
+            las numéricas primero (feature_groups).
+        n_numerical (int): Número de variables numéricas.
+        size (int): Filas de referencia como máximo; None conserva el fondo
+            completo ('categorical': todas las combinaciones).
+        method (str): Uno de BACKGROUND_METHODS.
+
+    Returns:
+        tuple: (rows, weights); weights es None si todas pesan lo mismo.
+
+    Raises:
+        ValueError: Si el método no existe.
+    """
+    if method not in BACKGROUND_METHODS:
+        raise ValueError(f"El método de resumen del fondo debe ser uno de "
+                         f"{BACKGROUND_METHODS}.")
+    background = np.asarray(background, dtype=np.float32)
+    categorical_groups = groups[n_numerical:]
+    if method == "categorical":
+        rows, weights = _categorical_background(background, size,
+                                                categorical_groups)
+    elif size is None or len(background) <= size or method == "uniform":
+        return summarize_background(background, size), None
+    elif method == "kmeans":
+        rows, weights = _kmeans_background(background, size,
+                                           categorical_groups)
+    else:
+        rows, weights = _stratified_background(background, size,
+                                               categorical_groups)
+    return rows.astype(np.float32), np.asarray(weights, dtype=np.float64)
+
+
+class GroupedShapleyExplainer:
+    """
+    Valores de Shapley exactos sobre las variables originales.
+
+    Cada variable original (p. ej. 'work_type') se trata como un único
+    jugador que activa a la vez todas sus columnas one-hot. Se evalúan las
+    2^M coaliciones contra un fondo de referencia en una sola pasada del
+    modelo, de modo que el resultado es determinista y cumple exactamente
+    base_value + sum(values) = predicción.
+
+    Args:
+        predictor: Objeto con predict(x) (NumpyANN o modelo Keras).
+        groups (list): Índices de columna de cada variable original.
+        background (np.ndarray): Filas de referencia ya transformadas.
+        weights (np.ndarray, optional): Peso de cada fila de referencia. Por
+            defecto, todas pesan lo mismo.
+    """
+
+    def __init__(self, predictor, groups, background, weights=None):
+        self.predictor = predictor
+        self.groups = [list(group) for group in groups]
+        self.background = np.asarray(background, dtype=np.float32)
+        if weights is None:
+            weights = np.ones(len(self.background))
+        weights = np.asarray(weights, dtype=np.float64)
+        self.weights = weights / weights.sum()
+
+        n_groups = len(self.groups)
+        n_columns = self.background.shape[1]
+        coalitions = np.arange(2 ** n_groups)
+        # members[c, i] indica si la variable i está en la coalición c
+        self._members = ((coalitions[:, None] >> np.arange(n_groups)) & 1
+                         ).astype(bool)
+        self._column_masks = np.zeros((len(coalitions), n_columns),
+                                      dtype=bool)
+        for i, group in enumerate(self.groups):
+            self._column_masks[:, group] = self._members[:, [i]]
+
+        # Peso de Shapley |S|!(M-|S|-1)!/M! de cada coalición sin i
+        sizes = self._members.sum(axis=1)
+        self._shapley_weights = np.array(
+            [factorial(s) * factorial(n_groups - s - 1) / factorial(n_groups)
+             if s < n_groups else 0.0 for s in sizes])
+
+    @property
+    def n_coalitions(self):
+        return len(self._members)
+
+    def coalition_values(self, x):
+        """
+        Calcula v(S) para todas las coaliciones de una o varias filas.
+
+        Las filas se evalúan juntas en pasadas del modelo de hasta
+        PREDICT_CHUNK_ROWS entradas, así que un lote pequeño con un fondo
+        reducido cabe en una sola pasada.
+
+        Args:
+            x (np.ndarray): Fila (n_columnas,) o matriz (n_filas,
+                n_columnas) transformada.
+
+        Returns:
+            np.ndarray: Valor esperado del modelo para cada coalición, de
+            forma (n_coaliciones,) o (n_filas, n_coaliciones).
+        """
+        x = np.asarray(x, dtype=np.float32)
+        rows = np.atleast_2d(x)
+        masks = self._column_masks[None, :, None, :]
+        chunk = max(1, PREDICT_CHUNK_ROWS // self.n_coalitions)
+        rows_per_pass = max(1, chunk // len(self.background))
+        values = np.zeros((len(rows), self.n_coalitions))
+        for first in range(0, len(rows), rows_per_pass):
+            block = rows[first:first + rows_per_pass]
+            for start in range(0, len(self.background), chunk):
+                background = self.background[start:start + chunk]
+                inputs = np.where(masks, block[:, None, None, :],
+                                  background[None, None, :, :])
+                inputs = inputs.reshape(-1, background.shape[1])
+                outputs = np.asarray(
+                    self.predictor.predict(inputs, batch_size=len(inputs),
+                                           verbose=0),
+                    dtype=np.float64)
+                outputs = outputs.reshape(len(block), self.n_coalitions,
+                                          len(background))
+                values[first:first + len(block)] += (
+                    outputs @ self.weights[start:start + chunk])
+        return values if x.ndim > 1 else values[0]
+
+    def shapley_values(self, x):
+        """
+        Calcula los valores de Shapley agrupados de una o varias filas.
+
+        Args:
+            x (np.ndarray): Matriz transformada (n_filas, n_columnas).
+
+        Returns:
+            tuple: (values, base_values) con forma (n_filas, n_variables) y
+            (n_filas,).
+        """
+        x = np.atleast_2d(np.asarray(x, dtype=np.float32))
+        v = self.coalition_values(x)
+        values = np.zeros((len(x), len(self.groups)))
+        coalitions = np.arange(self.n_coalitions)
+        for i in range(len(self.groups)):
+            without = coalitions[~self._members[:, i]]
+            values[:, i] = ((v[:, without | (1 << i)] - v[:, without])
+                            @ self._shapley_weights[without])
+        return values, v[:, 0]
+
+
+def build_grouped_explainer(registry, background_size=BACKGROUND_SIZE,
+                            method=BACKGROUND_METHOD):
+    """
+    Construye el explainer agrupado con los componentes del registro.
+
+    Args:
+        registry (ModelRegistry): Registro de recursos del modelo.
+        background_size (int): Filas de referencia a usar.
+        method (str): Método de resumen del fondo (BACKGROUND_METHODS).
+
+    Returns:
+        GroupedShapleyExplainer: Explainer listo para usar.
+    """
+    encoder = registry.get_encoder()
+    groups = feature_groups(encoder)
+    background, weights = reference_background(
+        registry.get_background_data(), groups,
+        len(encoder.numerical_features), background_size, method)
+    return GroupedShapleyExplainer(registry.get_predictor(), groups,
+                                   background, weights)
+
+
+def background_report(registry, sizes=(10, 25, 50, 100, 200),
+                      methods=BACKGROUND_METHODS, n_patients=20):
+    """
+    Mide fidelidad y latencia del explainer agrupado con cada resumen del
+    fondo, tomando como referencia el fondo completo.
+
+    Los pacientes son filas equiespaciadas del propio fondo. Para cada
+    método y tamaño se comparan sus valores SHAP y su valor base con los
+    del fondo completo.
+
+    Args:
+        registry (ModelRegistry): Registro de recursos del modelo.
+        sizes (Sequence): Tamaños de resumen a evaluar.
+        methods (Sequence): Métodos de resumen a evaluar.
+        n_patients (int): Pacientes explicados en cada configuración.
+
+    Returns:
+        dict: Latencia del fondo completo y, por configuración, filas de
+            referencia, latencia media (s), aceleración, error absoluto
+            medio y máximo de los valores SHAP, error del valor base y
+            proporción de pacientes con las mismas tres variables más
+            influyentes.
+    """
+    encoder = registry.get_encoder()
+    groups = feature_groups(encoder)
+    n_numerical = len(encoder.numerical_features)
+    predictor = registry.get_predictor()
+    background = np.asarray(registry.get_background_data(),
+                            dtype=np.float32)
+    patients = summarize_background(background[1::2], n_patients)
+
+    def _explain(explainer):
+        explainer.shapley_values(patients[0])
+        start = time.perf_counter()
+        values, base_values = explainer.shapley_values(patients)
+        return values, base_values, (time.perf_counter() - start) / len(
+            patients)
+
+    full_values, full_base, full_seconds = _explain(
+        GroupedShapleyExplainer(predictor, groups, background))
+    full_top = np.sort(np.argsort(-np.abs(full_values), axis=1)[:, :3])
+
+    results = []
+    for method in methods:
+        for size in sizes:
+            rows, weights = reference_background(background, groups,
+                                                 n_numerical, size, method)
+            values, base_values, seconds = _explain(
+                GroupedShapleyExplainer(predictor, groups, rows, weights))
+            errors = np.abs(values - full_values)
+            top = np.sort(np.argsort(-np.abs(values), axis=1)[:, :3])
+            results.append({
+                "method": method,
+                "size": size,
+                "rows": len(rows),
+                "seconds": round(seconds, 5),
+                "speedup": round(full_seconds / seconds, 1),
+                "mean_abs_error": round(float(errors.mean()), 5),
+                "max_abs_error": round(float(errors.max()), 5),
+                "base_value_error": round(
+                    float(np.abs(base_values - full_base).max()), 5),
+                "top3_agreement": round(
+                    float(np.mean((top == full_top).all(axis=1))), 3),
+            })
+    return {
+        "n_patients": len(patients),
+        "full_rows": len(background),
+        "full_seconds": round(full_seconds, 4),
+        "results": results,
+    }
+
+
+def benchmark_against_generic(records, repeats=1):
+    """
+    Compara el explainer agrupado con el shap.Explainer genérico.
+
+    Para cada paciente mide la latencia de ambos modos y la diferencia
+    entre los valores agrupados y los valores one-hot del explainer genérico
+    sumados por variable original.
+
+    Args:
+        records (list): Pacientes a explicar.
+        repeats (int): Repeticiones del modo agrupado por paciente.
+
+    Returns:
+        dict: Latencias medias (s), aceleración y diferencia absoluta máxima.
+    """
+    import stroke_SHAP as shp
+
+    # Excluir de la medida la carga en frío de ambos explainers
+    for mode in ("grouped", "generic"):
+        shp.get_reverted_shap_explanation(records[0], mode=mode,
+                                          use_cache=False)
+
+    grouped_times, generic_times, differences = [], [], []
+    for person_data in records:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            grouped = shp.get_reverted_shap_explanation(
+                person_data, mode="grouped", use_cache=False)
+        grouped_times.append((time.perf_counter() - start) / repeats)
+
+        start = time.perf_counter()
+        generic = shp.get_reverted_shap_explanation(
+            person_data, mode="generic", use_cache=False)
+        generic_times.append(time.perf_counter() - start)
+
+        groups = feature_groups(shp.REGISTRY.get_encoder())
+        generic_grouped = np.array(
+            [generic.values[0, group].sum() for group in groups])
+        differences.append(
+            float(np.max(np.abs(generic_grouped - grouped.values[0]))))
+
+    grouped_mean = float(np.mean(grouped_times))
+    generic_mean = float(np.mean(generic_times))
+    return {
+        "n_records": len(records),
+        "grouped_seconds": grouped_mean,
+        "generic_seconds": generic_mean,
+        "speedup": generic_mean / grouped_mean,
+        "max_abs_difference": max(differences),
+    }
+
+
+def main():
+    from model_registry import REGISTRY
+
+    parser = argparse.ArgumentParser(
+        description="Evalúa el explainer agrupado.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser(
+        "compare", help="Compara con shap.Explainer (opción por defecto).")
+    report_parser = subparsers.add_parser(
+        "report", help="Fidelidad y latencia de cada resumen del fondo.")
+    report_parser.add_argument("--sizes", type=int, nargs="+",
+                               default=[10, 25, 50, 100, 200])
+    report_parser.add_argument("--methods", nargs="+",
+                               choices=BACKGROUND_METHODS,
+                               default=list(BACKGROUND_METHODS))
+    report_parser.add_argument("--patients", type=int, default=20)
+
+    args = parser.parse_args()
+    if args.command == "report":
+        report = background_report(REGISTRY, args.sizes, args.methods,
+                                   args.patients)
+        print(json.dumps(report, indent=2))
+        return
+
+    from fast_preprocessing import probe_records
+
+    patients = probe_records(REGISTRY.get_encoder())[:5]
+    for patient in patients:
+        # Valores dentro del rango clínico habitual
+        patient.update(age=45.0 + patient["age"] % 40,
+                       avg_glucose_level=80.0 + patient["avg_glucose_level"],
+                       bmi=20.0 + patient["bmi"] % 15)
+    print(json.dumps(benchmark_against_generic(patients), indent=2))
+
+
+if __name__ == "__main__":
+    main()
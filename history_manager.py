@@ -0,0 +1,210 @@
+import json
+import os
+
+TOKEN_BUDGET = int(os.environ.get("STROKE_BOT_TOKEN_BUDGET", "6000"))
+
+# Resultados de herramientas antiguos más largos que esto se resumen
+COMPACT_CHARS = 300
+# Variables conservadas al resumir una explicación SHAP antigua
+COMPACT_TOP_FEATURES = 3
+# Coste fijo aproximado de cada mensaje en el formato de chat
+MESSAGE_OVERHEAD_TOKENS = 4
+
+TOOL_ROLES = ("tool", "function")
+
+
+def _load_encoding():
+    # tiktoken es opcional: sin él se estima ~4 caracteres por token
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+_ENCODING = _load_encoding()
+
+
+def count_text_tokens(text):
+    """
+    Cuenta (o estima, si tiktoken no está instalado) los tokens de un texto.
+    """
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return (len(text) + 3) // 4
+
+
+def _message_text(message):
+    parts = [message.get("content") or ""]
+    for tool_call in message.get("tool_calls") or []:
+        parts.append(tool_call["function"]["name"])
+        parts.append(tool_call["function"]["arguments"])
+    return "".join(parts)
+
+
+def _is_explanation(payload):
+    if not isinstance(payload, dict):
+        return False
+    if "explanation" in payload:
+        # Resultado de predict_and_explain
+        return _is_explanation(payload["explanation"])
+    return ("contributions" in payload
+            or ("feature_names" in payload and "values" in payload))
+
+
+def _tool_payload(message):
+    try:
+        return json.loads(message.get("content") or "")
+    except ValueError:
+        return None
+
+
+def compact_explanation(payload, top_k=COMPACT_TOP_FEATURES):
+    """
+    Resume una explicación SHAP antigua a sus variables más influyentes.
+
+    Args:
+        payload (dict): Resumen de summarize_explanation o arrays completos
+            de la explicación.
+        top_k (int): Número de variables a conservar.
+
+    Returns:
+        dict: Resumen con las top_k contribuciones redondeadas.
+    """
+    if "explanation" in payload:
+        return dict(payload, explanation=compact_explanation(
+            payload["explanation"], top_k))
+    if "contributions" in payload:
+        ranked = [(item["feature"], item["shap"])
+                  for item in payload["contributions"]]
+    else:
+        values = payload["values"][0]
+        names = payload["feature_names"]
+        ranked = sorted(zip(names, values), key=lambda item: -abs(item[1]))
+    return {
+        "compacted": True,
+        "summary": "Explicación SHAP anterior (resumida)",
+        "top_contributions": {name: round(value, 3)
+                              for name, value in ranked[:top_k]},
+    }
+
+
+class HistoryManager:
+    """
+    Construye cada petición al LLM dentro de un presupuesto de tokens.
+
+    Cuenta los tokens de cada mensaje (con caché), resume los resultados de
+    herramientas antiguos, conserva íntegra solo la última explicación SHAP
+    y, si aún se supera el presupuesto, descarta los turnos más antiguos
+    completos, de modo que cada llamada a herramienta sigue acompañada de
+    su resultado.
+
+    Args:
+        token_budget (int): Máximo de tokens por petición.
+    """
+
+    def __init__(self, token_budget=TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self._token_cache = {}
+
+    def count_tokens(self, message):
+        """
+        Tokens que ocupa un mensaje, incluida la sobrecarga del formato.
+        """
+        text = _message_text(message)
+        key = (message.get("role"), text)
+        tokens = self._token_cache.get(key)
+        if tokens is None:
+            tokens = count_text_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+            if len(self._token_cache) > 4096:
+                self._token_cache.clear()
+            self._token_cache[key] = tokens
+        return tokens
+
+    def total_tokens(self, messages):
+        return sum(self.count_tokens(message) for message in messages)
+
+    def compact(self, messages):
+        """
+        Resume los resultados de herramientas antiguos.
+
+        Args:
+            messages (list): Historial sin el mensaje de sistema.
+
+        Returns:
+            list: Copia del historial con los resultados antiguos
+            resumidos.
+        """
+        latest_explanation = None
+        for i in range(len(messages) - 1, -1, -1):
+            if (messages[i]["role"] in TOOL_ROLES
+                    and _is_explanation(_tool_payload(messages[i]))):
+                latest_explanation = i
+                break
+
+        compacted = []
+        for i, message in enumerate(messages):
+            if (message["role"] not in TOOL_ROLES or i == latest_explanation
+                    or len(message.get("content") or "") <= COMPACT_CHARS):
+                compacted.append(message)
+                continue
+            payload = _tool_payload(message)
+            if _is_explanation(payload):
+                summary = compact_explanation(payload)
+            else:
+                summary = {"compacted": True,
+                           "summary": message["content"][:COMPACT_CHARS]}
+            compacted.append(dict(message, content=json.dumps(summary)))
+        return compacted
+
+    def _split_turns(self, messages):
+        # Cada turno empieza en un mensaje del usuario
+        turns = []
+        for message in messages:
+            if message["role"] == "user" or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return turns
+
+    def build_request(self, system_message, messages):
+        """
+        Prepara los mensajes a enviar al LLM.
+
+        Args:
+            system_message (dict): Mensaje de sistema.
+            messages (list): Historial completo de la sesión.
+
+        Returns:
+            tuple: (mensajes a enviar, informe) donde el informe contiene
+            'tokens_before', 'tokens_after', 'tokens_saved',
+            'dropped_messages' y 'token_budget'.
+        """
+        tokens_before = self.total_tokens([system_message] + messages)
+        compacted = self.compact(messages)
+
+        turns = self._split_turns(compacted)
+        system_tokens = self.count_tokens(system_message)
+        turn_tokens = [self.total_tokens(turn) for turn in turns]
+        dropped_messages = 0
+        # Nunca se descarta el turno actual
+        while (len(turns) > 1
+               and system_tokens + sum(turn_tokens) > self.token_budget):
+            dropped_messages += len(turns.pop(0))
+            turn_tokens.pop(0)
+
+        request = [system_message] + [message for turn in turns
+                                      for message in turn]
+        tokens_after = system_tokens + sum(turn_tokens)
+        return request, {
+            "tokens_before": tokens_before,
+            "tokens_after": tokens_after,
+            "tokens_saved": tokens_before - tokens_after,
+            "dropped_messages": dropped_messages,
+            "token_budget": self.token_budget,
+        }
+
+
+# Instancia compartida por todas las sesiones del proceso
+HISTORY_MANAGER = HistoryManager()
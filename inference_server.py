@@ -0,0 +1,503 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import numpy as np
+import stroke_prediction as sp
+from model_registry import COMPONENTS, REGISTRY
+
+HOST = os.environ.get("STROKE_BOT_SERVER_HOST", "127.0.0.1")
+PORT = int(os.environ.get("STROKE_BOT_SERVER_PORT", "8000"))
+# Filas máximas por pasada del modelo y espera máxima para completar un lote
+MAX_BATCH_SIZE = int(os.environ.get("STROKE_BOT_MAX_BATCH", "64"))
+MAX_DELAY_MS = float(os.environ.get("STROKE_BOT_MAX_DELAY_MS", "5"))
+# Peticiones en cola a partir de las cuales se responde 503
+MAX_QUEUE = int(os.environ.get("STROKE_BOT_MAX_QUEUE", "1024"))
+# Explicaciones SHAP por lote; las del modo agrupado se calculan con una
+# sola llamada al explainer sobre la matriz del lote
+EXPLAIN_BATCH_SIZE = int(os.environ.get("STROKE_BOT_EXPLAIN_BATCH", "4"))
+
+# Tamaño máximo aceptado del cuerpo de una petición
+MAX_BODY_BYTES = 1 << 20
+# Latencias recientes conservadas para los percentiles de /metrics
+LATENCY_WINDOW = 2048
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+            405: "Method Not Allowed", 413: "Payload Too Large",
+            500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class QueueFullError(Exception):
+    """
+    La cola del servidor está llena; el cliente debe reintentar más tarde.
+    """
+
+
+class MicroBatcher:
+    """
+    Agrupa en un solo lote las peticiones que llegan casi a la vez.
+
+    El primer elemento de la cola abre un lote, que se cierra al llegar a
+    max_batch_size o cuando han pasado max_delay_ms desde entonces. El lote
+    se procesa en un hilo aparte para no bloquear el bucle de eventos.
+
+    Args:
+        process_batch (callable): Recibe una lista de elementos y devuelve
+            una lista de resultados en el mismo orden.
+        max_batch_size (int): Elementos máximos por lote.
+        max_delay_ms (float): Espera máxima para completar un lote.
+        max_queue (int): Elementos pendientes a partir de los cuales
+            submit() lanza QueueFullError.
+    """
+
+    def __init__(self, process_batch, max_batch_size=MAX_BATCH_SIZE,
+                 max_delay_ms=MAX_DELAY_MS, max_queue=MAX_QUEUE):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_delay = max_delay_ms / 1000
+        self.max_queue = max_queue
+        self._queue = None
+        self._task = None
+        # Un único hilo: los lotes se ejecutan de uno en uno
+        self._executor = ThreadPoolExecutor(max_workers=1,
+                                            thread_name_prefix="batcher")
+        self.stats = {"items": 0, "batches": 0, "rejected": 0}
+        self.batch_sizes = deque(maxlen=LATENCY_WINDOW)
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, item):
+        """
+        Encola un elemento y espera su resultado.
+
+        Raises:
+            QueueFullError: Si hay max_queue elementos pendientes.
+        """
+        results = await self.submit_many([item])
+        return results[0]
+
+    async def submit_many(self, items):
+        """
+        Encola varios elementos a la vez y espera todos sus resultados.
+
+        O caben todos en la cola o no se encola ninguno, de modo que una
+        petición con muchos pacientes no recibe respuestas parciales.
+
+        Raises:
+            QueueFullError: Si no hay sitio para todos los elementos.
+        """
+        if self._queue.qsize() + len(items) > self.max_queue:
+            self.stats["rejected"] += len(items)
+            raise QueueFullError("Cola llena, inténtalo de nuevo.")
+        loop = asyncio.get_running_loop()
+        futures = []
+        for item in items:
+            future = loop.create_future()
+            # Sin await entre comprobación y encolado: la reserva es atómica
+            self._queue.put_nowait((item, future))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(),
+                                                    timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self.process_batch, items)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.stats["items"] += len(batch)
+            self.stats["batches"] += 1
+            self.batch_sizes.append(len(batch))
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def info(self):
+        sizes = list(self.batch_sizes)
+        return dict(self.stats, queued=self._queue.qsize() if self._queue
+                    else 0, max_batch_size=self.max_batch_size,
+                    max_delay_ms=self.max_delay * 1000,
+                    mean_batch_size=float(np.mean(sizes)) if sizes else 0.0)
+
+
+def _check_person_data(person_data):
+    # Se rechaza antes de encolar: en el lote arrastraría a otras peticiones
+    if not isinstance(person_data, dict):
+        raise TypeError("'person_data' debe ser un objeto.")
+
+
+def _explanation_result(prediction, explanation):
+    import stroke_SHAP as shp
+
+    if explanation is None or prediction["probability"] is None:
+        return {"error": prediction["message"]}
+    return {
+        "summary": shp.summarize_explanation(explanation,
+                                             prediction["probability"]),
+        "base_values": np.asarray(explanation.base_values).tolist(),
+        "values": np.asarray(explanation.values).tolist(),
+        "data": np.asarray(explanation.data).tolist(),
+        "feature_names": list(explanation.feature_names),
+    }
+
+
+def _explain_batch(requests):
+    import stroke_SHAP as shp
+
+    # Un lote por modo: las filas de cada uno se explican juntas
+    by_mode = {}
+    for i, request in enumerate(requests):
+        by_mode.setdefault(request.get("mode"), []).append(i)
+    results = [None] * len(requests)
+    for mode, indices in by_mode.items():
+        try:
+            pairs = shp.get_predictions_and_explanations_batch(
+                [requests[i]["person_data"] for i in indices], mode=mode)
+            for i, (prediction, explanation) in zip(indices, pairs):
+                results[i] = _explanation_result(prediction, explanation)
+        except Exception as e:
+            for i in indices:
+                results[i] = {"error": f"Error al calcular SHAP: {e}"}
+    return results
+
+
+class InferenceServer:
+    """
+    Servidor HTTP asíncrono de predicción y explicación.
+
+    Endpoints:
+        POST /predict: {"person_data": {...}} o {"patients": [...]}.
+        POST /explain: {"person_data": {...}, "mode": "grouped"}.
+        GET /health: Estado y componentes cargados.
+        GET /metrics: Contadores, latencias y tamaños de lote.
+
+    Las predicciones concurrentes se agrupan con MicroBatcher en una sola
+    llamada a get_stroke_predictions_batch (una transformación y una pasada
+    del modelo por lote), que reutiliza PREDICTION_CACHE; las explicaciones,
+    en una llamada a get_predictions_and_explanations_batch. Una lista de
+    'patients' se encola entera o se rechaza entera.
+
+    Args:
+        host (str): Dirección de escucha.
+        port (int): Puerto (0 para uno libre).
+        max_batch_size (int): Filas máximas por pasada del modelo.
+        max_delay_ms (float): Espera máxima para completar un lote.
+        max_queue (int): Peticiones pendientes antes de responder 503.
+    """
+
+    def __init__(self, host=HOST, port=PORT, max_batch_size=MAX_BATCH_SIZE,
+                 max_delay_ms=MAX_DELAY_MS, max_queue=MAX_QUEUE):
+        self.host = host
+        self.port = port
+        self.predictions = MicroBatcher(
+            partial(sp.get_stroke_predictions_batch, use_cache=True),
+            max_batch_size, max_delay_ms, max_queue)
+        self.explanations = MicroBatcher(_explain_batch, EXPLAIN_BATCH_SIZE,
+                                         max_delay_ms, max_queue)
+        self._server = None
+        self._started = None
+        self.requests = {}
+        self.latencies = {}
+
+    async def start(self):
+        REGISTRY.get_predictor()
+        REGISTRY.get_encoder()
+        self.predictions.start()
+        self.explanations.start()
+        self._server = await asyncio.start_server(self._handle, self.host,
+                                                  self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started = time.time()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.predictions.stop()
+        await self.explanations.stop()
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"Servidor de inferencia en http://{self.host}:{self.port}")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                start = time.perf_counter()
+                status, payload = await self._dispatch(method, path, body)
+                self._record(path, status, time.perf_counter() - start)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await _write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:
+            await _write_response(writer, 400, {"error": str(e)}, False)
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, path, body):
+        routes = {"/predict": ("POST", self._predict),
+                  "/explain": ("POST", self._explain),
+                  "/health": ("GET", self._health),
+                  "/metrics": ("GET", self._metrics)}
+        if path not in routes:
+            return 404, {"error": f"Ruta desconocida: '{path}'."}
+        expected, handler = routes[path]
+        if method != expected:
+            return 405, {"error": f"Usa {expected} en '{path}'."}
+        try:
+            data = json.loads(body) if body else {}
+            return 200, await handler(data)
+        except QueueFullError as e:
+            return 503, {"error": str(e)}
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {"error": f"Petición no válida: {e}"}
+        except Exception as e:
+            return 500, {"error": str(e)}
+
+    async def _predict(self, data):
+        if "patients" in data:
+            patients = sp.to_records(data["patients"])
+            if len(patients) > self.predictions.max_queue:
+                raise ValueError(f"como máximo "
+                                 f"{self.predictions.max_queue} pacientes "
+                                 f"por petición.")
+            if not all(isinstance(patient, dict) for patient in patients):
+                raise TypeError("cada elemento de 'patients' debe ser un "
+                                "objeto.")
+            results = await self.predictions.submit_many(patients)
+            return {"results": list(results)}
+        _check_person_data(data["person_data"])
+        return await self.predictions.submit(data["person_data"])
+
+    async def _explain(self, data):
+        _check_person_data(data["person_data"])
+        return await self.explanations.submit(data)
+
+    async def _health(self, data):
+        return {"status": "ok", "backend": REGISTRY.backend,
+                "loaded": {name: REGISTRY.is_loaded(name)
+                           for name in COMPONENTS},
+                "uptime_s": time.time() - self._started}
+
+    async def _metrics(self, data):
+        latencies = {}
+        for path, samples in self.latencies.items():
+            samples_ms = np.asarray(samples) * 1000
+            latencies[path] = {
+                "p50_ms": float(np.percentile(samples_ms, 50)),
+                "p99_ms": float(np.percentile(samples_ms, 99)),
+            }
+        return {"requests": self.requests, "latency": latencies,
+                "predict_batching": self.predictions.info(),
+                "explain_batching": self.explanations.info(),
+                "prediction_cache": sp.PREDICTION_CACHE.info()}
+
+    def _record(self, path, status, seconds):
+        counts = self.requests.setdefault(path, {})
+        counts[str(status)] = counts.get(str(status), 0) + 1
+        self.latencies.setdefault(
+            path, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+
+async def _read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise ValueError("Línea de petición HTTP no válida.")
+    method, target, _ = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0"))
+    if length > MAX_BODY_BYTES:
+        raise ValueError("Cuerpo de la petición demasiado grande.")
+    body = await reader.readexactly(length) if length else b""
+    return method, target.split("?", 1)[0], headers, body
+
+
+async def _write_response(writer, status, payload, keep_alive=True):
+    body = json.dumps(payload).encode("utf-8")
+    head = (f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode("latin-1") + body)
+    await writer.drain()
+
+
+async def _post(reader, writer, path, payload):
+    body = json.dumps(payload).encode("utf-8")
+    writer.write((f"POST {path} HTTP/1.1\r\nHost: localhost\r\n"
+                  f"Content-Type: application/json\r\n"
+                  f"Content-Length: {len(body)}\r\n\r\n").encode("latin-1")
+                 + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return int(status_line.split()[1])
+
+
+async def load_test(host, port, patients, concurrency=64, path="/predict"):
+    """
+    Lanza peticiones concurrentes contra un servidor en marcha.
+
+    Args:
+        host (str): Dirección del servidor.
+        port (int): Puerto del servidor.
+        patients (list): Un paciente por petición.
+        concurrency (int): Conexiones simultáneas (keep-alive).
+        path (str): Endpoint a probar.
+
+    Returns:
+        dict: Peticiones por segundo, latencias p50/p99 y errores.
+    """
+    pending = deque(patients)
+    latencies = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while pending:
+                patient = pending.popleft()
+                start = time.perf_counter()
+                status = await _post(reader, writer, path,
+                                     {"person_data": patient})
+                latencies.append(time.perf_counter() - start)
+                errors += status != 200
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_s": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+
+async def compare_batching(n_requests=4000, concurrency=64,
+                           max_batch_size=MAX_BATCH_SIZE,
+                           max_delay_ms=MAX_DELAY_MS):
+    """
+    Compara el servidor con micro-batching frente a una pasada del modelo
+    por petición (max_batch_size=1), con la misma carga.
+
+    Returns:
+        dict: Resultados de load_test de ambas configuraciones, tamaño
+        medio de lote y ganancia de rendimiento.
+    """
+    from benchmark import sample_patients
+
+    patients = sample_patients(n_requests, seed=16)
+    results = {}
+    for name, batch_size in (("per_request", 1),
+                             ("micro_batching", max_batch_size)):
+        # Sin aciertos heredados de la configuración anterior
+        sp.PREDICTION_CACHE.clear()
+        server = InferenceServer(host="127.0.0.1", port=0,
+                                 max_batch_size=batch_size,
+                                 max_delay_ms=max_delay_ms)
+        await server.start()
+        try:
+            # Calentamiento fuera de la medida
+            await load_test(server.host, server.port, patients[:200],
+                            concurrency)
+            results[name] = await load_test(server.host, server.port,
+                                            patients, concurrency)
+            results[name]["mean_batch_size"] = (
+                server.predictions.info()["mean_batch_size"])
+        finally:
+            await server.stop()
+    results["speedup"] = (results["micro_batching"]["requests_per_s"]
+                          / results["per_request"]["requests_per_s"])
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Servidor de inferencia de Stroke Bot.")
+    parser.add_argument("command", choices=["serve", "loadtest"])
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-delay-ms", type=float, default=MAX_DELAY_MS)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        server = InferenceServer(args.host, args.port, args.max_batch,
+                                 args.max_delay_ms)
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+    else:
+        print(json.dumps(asyncio.run(compare_batching(
+            args.requests, args.concurrency, args.max_batch,
+            args.max_delay_ms)), indent=2))
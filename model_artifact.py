@@ -0,0 +1,404 @@
+import argparse
+import json
+import os
+import struct
+import numpy as np
+from explanation_cache import file_fingerprint
+
+ARTIFACT_PATH = os.environ.get("STROKE_BOT_ARTIFACT", "stroke_model.artifact")
+# Precisión de los pesos que se usa al cargar: 'float32', 'float16' o 'int8'
+ARTIFACT_PRECISION = os.environ.get("STROKE_BOT_ARTIFACT_PRECISION",
+                                    "float32")
+
+MAGIC = b"STRKART\0"
+# Versión 2: la cabecera incluye la paridad de cada precisión con Keras
+FORMAT_VERSION = 2
+# Alineación de cada matriz dentro del archivo, en bytes
+ALIGNMENT = 64
+PRECISIONS = ("float32", "float16", "int8")
+
+# Diferencia máxima admitida frente a Keras para cada precisión de pesos
+PRECISION_ATOL = {"float32": 1e-5, "float16": 1e-3, "int8": 2e-2}
+
+# Cabecera fija: firma, versión del formato y longitud del JSON de metadatos
+_PREFIX = struct.Struct("<8sII")
+
+
+class ArtifactError(ValueError):
+    """
+    El artefacto no existe, está corrupto o no corresponde a los archivos
+    originales.
+    """
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def quantize_int8(kernel):
+    """
+    Cuantiza un kernel a int8 de forma simétrica, con una escala por
+    neurona de salida.
+
+    Returns:
+        tuple: (kernel int8, escalas float32).
+    """
+    scale = np.abs(kernel).max(axis=0) / 127.0
+    scale[scale == 0] = 1.0
+    quantized = np.clip(np.round(kernel / scale), -127, 127).astype(np.int8)
+    return quantized, scale.astype(np.float32)
+
+
+def _weight_arrays(numpy_model, precisions):
+    arrays = {}
+    layers = []
+    for i, (kernel, bias, activation) in enumerate(numpy_model.layers):
+        arrays[f"layer{i}.bias"] = bias.astype(np.float32)
+        for precision in precisions:
+            prefix = f"layer{i}.kernel.{precision}"
+            if precision == "int8":
+                arrays[prefix], arrays[f"{prefix}.scale"] = (
+                    quantize_int8(kernel))
+            else:
+                arrays[prefix] = kernel.astype(precision)
+        layers.append({"activation": activation})
+    return arrays, layers
+
+
+def _build_numpy_model(get_array, layers, precision):
+    from numpy_inference import NumpyANN
+
+    built = []
+    for i, layer in enumerate(layers):
+        kernel = get_array(f"layer{i}.kernel.{precision}")
+        if precision == "int8":
+            scale = get_array(f"layer{i}.kernel.int8.scale")
+            kernel = kernel.astype(np.float32) * scale
+        built.append((kernel, get_array(f"layer{i}.bias"),
+                      layer["activation"]))
+    return NumpyANN(built)
+
+
+def _parity(registry, arrays, layers, precisions, inputs):
+    """
+    Diferencia absoluta máxima de cada precisión frente al modelo Keras.
+
+    Se mide una sola vez al exportar para que cargar el artefacto no tenga
+    que importar TensorFlow.
+    """
+    keras_model = registry.get_model()
+    expected = np.asarray(
+        keras_model.predict(inputs, batch_size=len(inputs), verbose=0),
+        dtype=np.float64)
+    parity = {}
+    for precision in precisions:
+        numpy_model = _build_numpy_model(arrays.__getitem__, layers,
+                                         precision)
+        parity[precision] = float(
+            np.max(np.abs(numpy_model.predict(inputs) - expected)))
+    return parity
+
+
+def export_artifact(registry=None, path=ARTIFACT_PATH,
+                    precisions=PRECISIONS):
+    """
+    Escribe el modelo, el preprocesador y el fondo en un único archivo
+    binario versionado que se puede mapear en memoria.
+
+    El archivo empieza con una firma, la versión del formato y un JSON con
+    los metadatos (activaciones, tablas de categorías, posición, tipo y
+    forma de cada matriz) y la diferencia máxima de cada precisión frente a
+    Keras sobre el fondo. Después van las matrices, contiguas y alineadas
+    a 64 bytes: los kernels en cada precisión pedida (float32 siempre), los
+    sesgos en float32, la media y escala del StandardScaler en float64 y el
+    fondo en float32.
+
+    Args:
+        registry (ModelRegistry, optional): Registro del que leer los
+            originales. Por defecto, el compartido.
+        path (str): Archivo de salida.
+        precisions (tuple): Precisiones de los pesos a incluir.
+
+    Returns:
+        dict: Metadatos escritos en la cabecera.
+    """
+    if registry is None:
+        from model_registry import REGISTRY as registry
+
+    precisions = ["float32"] + [p for p in precisions if p != "float32"]
+    unknown = set(precisions) - set(PRECISIONS)
+    if unknown:
+        raise ValueError(f"Precisión no soportada: {sorted(unknown)}")
+
+    # Se parte de los pickles y del .keras, nunca de otro artefacto
+    numpy_model = _original_numpy_model(registry)
+    encoder = _original_encoder(registry)
+    background = _original_background(registry)
+
+    arrays, layers = _weight_arrays(numpy_model, precisions)
+    arrays["encoder.mean"] = encoder.mean.astype(np.float64)
+    arrays["encoder.scale"] = encoder.scale.astype(np.float64)
+    arrays["background"] = np.asarray(background, dtype=np.float32)
+    parity = _parity(registry, arrays, layers, precisions,
+                     arrays["background"])
+
+    metadata = {
+        "format_version": FORMAT_VERSION,
+        "precisions": precisions,
+        "layers": layers,
+        "encoder": {
+            "numerical_features": encoder.numerical_features,
+            "categorical_features": encoder.categorical_features,
+            "categories": [[_to_json(value) for value in values]
+                           for values in encoder.categories],
+            "handle_unknown": encoder.handle_unknown,
+        },
+        "sources": file_fingerprint([registry.model_path,
+                                     registry.preprocessor_path,
+                                     registry.background_data_path]),
+        "parity": {"rows": len(arrays["background"]),
+                   "max_abs_diff": parity},
+        "arrays": {},
+    }
+
+    # Las posiciones dependen del tamaño de la cabecera, que a su vez
+    # depende de ellas; se reserva espacio de sobra y se rellena
+    index = metadata["arrays"]
+    for name, array in arrays.items():
+        index[name] = {"dtype": array.dtype.str, "shape": list(array.shape),
+                       "offset": 0}
+    header_size = _align(_PREFIX.size
+                         + len(json.dumps(metadata).encode("utf-8")) + 1024)
+    offset = header_size
+    for name, array in arrays.items():
+        index[name]["offset"] = offset
+        offset = _align(offset + array.nbytes)
+    header = json.dumps(metadata).encode("utf-8")
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        file.write(header)
+        for name, array in arrays.items():
+            file.seek(index[name]["offset"])
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.truncate(offset)
+    # Sustitución atómica: los procesos que ya lo tienen mapeado siguen
+    # viendo la versión anterior
+    os.replace(tmp_path, path)
+    return metadata
+
+
+def _to_json(value):
+    # Las categorías booleanas del OneHotEncoder llegan como np.bool_
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _original_numpy_model(registry):
+    from numpy_inference import load_numpy_model
+
+    return load_numpy_model(registry.model_path)
+
+
+def _original_encoder(registry):
+    from fast_preprocessing import CompiledEncoder, check_equivalence
+
+    preprocessor = registry.get_preprocessor()
+    encoder = CompiledEncoder.from_preprocessor(preprocessor)
+    check_equivalence(encoder, preprocessor)
+    return encoder
+
+
+def _original_background(registry):
+    import joblib
+
+    return joblib.load(registry.background_data_path)
+
+
+class ModelArtifact:
+    """
+    Artefacto del modelo mapeado en memoria en modo solo lectura.
+
+    Las matrices son vistas sobre el archivo, de modo que abrirlo no copia
+    nada al heap del proceso y todos los procesos que lo mapean comparten
+    las mismas páginas del sistema operativo.
+
+    Args:
+        path (str): Archivo creado con export_artifact.
+
+    Raises:
+        ArtifactError: Si el archivo no es un artefacto válido.
+    """
+
+    def __init__(self, path=ARTIFACT_PATH):
+        self.path = path
+        with open(path, "rb") as file:
+            prefix = file.read(_PREFIX.size)
+            if len(prefix) != _PREFIX.size:
+                raise ArtifactError(f"Artefacto truncado: '{path}'")
+            magic, version, header_size = _PREFIX.unpack(prefix)
+            if magic != MAGIC:
+                raise ArtifactError(f"'{path}' no es un artefacto del modelo.")
+            if version != FORMAT_VERSION:
+                raise ArtifactError(
+                    f"Versión de artefacto {version} no soportada "
+                    f"(se esperaba {FORMAT_VERSION}).")
+            self.metadata = json.loads(file.read(header_size))
+        self._memmap = np.memmap(path, dtype=np.uint8, mode="r")
+
+    @property
+    def precisions(self):
+        return list(self.metadata["precisions"])
+
+    @property
+    def size_bytes(self):
+        return len(self._memmap)
+
+    def array(self, name):
+        """
+        Devuelve una matriz del artefacto como vista de solo lectura.
+        """
+        spec = self.metadata["arrays"][name]
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        start = spec["offset"]
+        end = start + count * dtype.itemsize
+        if end > len(self._memmap):
+            raise ArtifactError(f"Matriz '{name}' fuera del archivo.")
+        return self._memmap[start:end].view(dtype).reshape(spec["shape"])
+
+    def matches_sources(self, paths):
+        """
+        Indica si el artefacto se exportó a partir de estos archivos.
+        """
+        try:
+            return file_fingerprint(paths) == self.metadata["sources"]
+        except OSError:
+            return False
+
+    def parity(self, precision):
+        """
+        Diferencia máxima con Keras medida al exportar.
+
+        Returns:
+            float: Diferencia absoluta máxima sobre el fondo.
+        """
+        return self.metadata["parity"]["max_abs_diff"][precision]
+
+    def weights_nbytes(self, precision):
+        prefix = ".kernel." + precision
+        return sum(self.array(name).nbytes
+                   for name in self.metadata["arrays"]
+                   if prefix in name or name.endswith(".bias"))
+
+    def numpy_model(self, precision=ARTIFACT_PRECISION):
+        """
+        Construye el NumpyANN con los pesos de la precisión indicada.
+
+        En float32 los kernels son vistas del archivo. En float16 e int8 se
+        descuantizan a float32 en memoria del proceso (pocos KB).
+
+        Returns:
+            NumpyANN: Modelo listo para inferencia.
+        """
+        if precision not in self.precisions:
+            raise ArtifactError(
+                f"El artefacto no incluye pesos en '{precision}'.")
+        return _build_numpy_model(self.array, self.metadata["layers"],
+                                  precision)
+
+    def encoder(self):
+        """
+        Construye el CompiledEncoder a partir de las tablas guardadas.
+        """
+        from fast_preprocessing import CompiledEncoder
+
+        spec = self.metadata["encoder"]
+        return CompiledEncoder(
+            self.array("encoder.mean"), self.array("encoder.scale"),
+            spec["categories"], handle_unknown=spec["handle_unknown"],
+            numerical_features=spec["numerical_features"],
+            categorical_features=spec["categorical_features"])
+
+    def background_data(self):
+        return self.array("background")
+
+
+def accuracy_report(artifact, reference=None, inputs=None):
+    """
+    Compara cada precisión del artefacto con el modelo original sobre los
+    datos de fondo.
+
+    Args:
+        artifact (ModelArtifact): Artefacto a evaluar.
+        reference (object, optional): Modelo de referencia con predict().
+            Por defecto, el modelo Keras original.
+        inputs (np.ndarray, optional): Filas preprocesadas. Por defecto,
+            el fondo del artefacto.
+
+    Returns:
+        list: Un diccionario por precisión con el tamaño de los pesos, la
+            diferencia absoluta máxima y media, las predicciones que cambian
+            de clase con umbral 0.5 y si cumple PRECISION_ATOL.
+    """
+    if reference is None:
+        from model_registry import REGISTRY
+
+        reference = REGISTRY.get_model()
+    if inputs is None:
+        inputs = artifact.background_data()
+
+    expected = np.asarray(
+        reference.predict(inputs, batch_size=len(inputs), verbose=0),
+        dtype=np.float64).ravel()
+    report = []
+    for precision in artifact.precisions:
+        actual = artifact.numpy_model(precision).predict(inputs).ravel()
+        diff = np.abs(actual - expected)
+        report.append({
+            "precision": precision,
+            "weights_bytes": artifact.weights_nbytes(precision),
+            "max_abs_diff": float(diff.max()),
+            "mean_abs_diff": float(diff.mean()),
+            "class_flips": int(np.sum((actual >= 0.5) != (expected >= 0.5))),
+            "within_tolerance": bool(diff.max() <= PRECISION_ATOL[precision]),
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Exporta y evalúa el artefacto binario del modelo.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser(
+        "export", help="Escribe el artefacto a partir de los originales.")
+    export_parser.add_argument("--output", default=ARTIFACT_PATH)
+    export_parser.add_argument("--precisions", nargs="+",
+                               default=list(PRECISIONS), choices=PRECISIONS)
+
+    report_parser = subparsers.add_parser(
+        "report", help="Compara cada precisión con el modelo Keras.")
+    report_parser.add_argument("--artifact", default=ARTIFACT_PATH)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        metadata = export_artifact(path=args.output,
+                                   precisions=args.precisions)
+        print(f"Artefacto escrito en {args.output} "
+              f"({os.path.getsize(args.output) / 1024:.1f} KB, "
+              f"precisiones: {', '.join(metadata['precisions'])})")
+        return
+
+    artifact = ModelArtifact(args.artifact)
+    print(f"{'precisión':<10} {'pesos (B)':>10} {'máx |dif|':>11} "
+          f"{'media |dif|':>12} {'cambios':>8}  ok")
+    for row in accuracy_report(artifact):
+        print(f"{row['precision']:<10} {row['weights_bytes']:>10} "
+              f"{row['max_abs_diff']:>11.2e} {row['mean_abs_diff']:>12.2e} "
+              f"{row['class_flips']:>8}  "
+              f"{'sí' if row['within_tolerance'] else 'no'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+import os
+import threading
+import time
+
+MODEL_PATH = "best_ann.keras"
+PREPROCESSOR_PATH = "preprocessor.pkl"
+BACKGROUND_DATA_PATH = "background_data.pkl"
+# Artefacto binario (model_artifact.py) que, si existe y corresponde a los
+# archivos anteriores, sustituye a los pickles del modelo NumPy, el
+# codificador y el fondo
+USE_ARTIFACT = os.environ.get("STROKE_BOT_USE_ARTIFACT", "1") != "0"
+
+# Motor de inferencia: 'numpy' evita importar TensorFlow al predecir
+BACKEND = os.environ.get("STROKE_BOT_BACKEND", "numpy")
+# Verificar el motor NumPy contra Keras al cargarlo ('0' lo desactiva)
+PARITY_CHECK = os.environ.get("STROKE_BOT_PARITY_CHECK", "1") != "0"
+PARITY_ROWS = 256
+
+# Componentes que otro necesita ya cargados, para que el tiempo registrado
+# de cada uno no incluya el de sus dependencias
+DEPENDENCIES = {
+    "encoder": ["preprocessor"],
+    "explainer": ["model", "background_data"],
+    "grouped_explainer": ["encoder", "background_data"],
+}
+
+# Orden en el que se cargan los componentes durante el calentamiento
+COMPONENTS = ["preprocessor", "encoder", "numpy_model", "background_data",
+              "grouped_explainer", "model", "explainer"]
+
+
+class ModelRegistry:
+    """
+    Registro único por proceso del modelo, el preprocesador, los datos de
+    fondo y el explainer de SHAP.
+
+    Cada componente se carga la primera vez que se pide y se comparte entre
+    todas las sesiones de Streamlit del proceso. El tiempo de carga en frío
+    (importaciones incluidas) queda registrado por componente.
+    """
+
+    def __init__(self, model_path=MODEL_PATH,
+                 preprocessor_path=PREPROCESSOR_PATH,
+                 background_data_path=BACKGROUND_DATA_PATH,
+                 backend=BACKEND, parity_check=PARITY_CHECK,
+                 artifact_path=None, artifact_precision=None):
+        if backend not in ("numpy", "keras"):
+            raise ValueError("El backend debe ser 'numpy' o 'keras'.")
+        self.model_path = model_path
+        self.preprocessor_path = preprocessor_path
+        self.background_data_path = background_data_path
+        self.backend = backend
+        self.parity_check = parity_check
+        self.parity_max_abs_diff = None
+        self.artifact_path = artifact_path
+        self.artifact_precision = artifact_precision
+        self._artifact = None
+        self._artifact_checked = False
+        self._artifact_lock = threading.Lock()
+
+        self._loaders = {
+            "model": self._load_model,
+            "numpy_model": self._load_numpy_model,
+            "preprocessor": self._load_preprocessor,
+            "encoder": self._load_encoder,
+            "background_data": self._load_background_data,
+            "explainer": self._load_explainer,
+            "grouped_explainer": self._load_grouped_explainer,
+        }
+        self._resources = {}
+        self._load_times = {}
+        self._locks = {name: threading.Lock() for name in self._loaders}
+        self._warm_up_lock = threading.Lock()
+        self._warm_up_thread = None
+
+    def get(self, name):
+        """
+        Devuelve un componente, cargándolo si todavía no está en memoria.
+
+        Args:
+            name (str): Uno de 'model', 'preprocessor', 'background_data' o
+                'explainer'.
+
+        Returns:
+            object: El componente cargado.
+
+        Raises:
+            KeyError: Si el componente no existe.
+        """
+        if name not in self._loaders:
+            raise KeyError(f"Componente desconocido: '{name}'")
+        if name in self._resources:
+            return self._resources[name]
+
+        # Con el artefacto, el codificador no necesita el preprocesador
+        if name != "encoder" or self.get_artifact() is None:
+            for dependency in DEPENDENCIES.get(name, []):
+                self.get(dependency)
+
+        with self._locks[name]:
+            # Otro hilo pudo terminar la carga mientras esperábamos
+            if name not in self._resources:
+                start = time.perf_counter()
+                resource = self._loaders[name]()
+                self._load_times[name] = time.perf_counter() - start
+                self._resources[name] = resource
+        return self._resources[name]
+
+    def get_model(self):
+        return self.get("model")
+
+    def get_numpy_model(self):
+        return self.get("numpy_model")
+
+    def get_predictor(self):
+        """
+        Devuelve el motor de inferencia configurado.
+
+        Ambos motores exponen predict(x, batch_size=..., verbose=...).
+
+        Returns:
+            NumpyANN | keras.Model: Modelo NumPy o modelo Keras.
+        """
+        if self.backend == "numpy":
+            return self.get_numpy_model()
+        return self.get_model()
+
+    def predictor_signature(self):
+        """
+        Identifica los pesos con los que predice get_predictor().
+
+        Distingue el motor y, con el artefacto, la precisión de los pesos,
+        que cambian los resultados en hasta ~7e-3.
+
+        Returns:
+            str: Por ejemplo 'keras', 'numpy/float32' o
+                'numpy/artifact/int8'.
+        """
+        if self.backend == "keras":
+            return "keras"
+        if self.get_artifact() is None:
+            return "numpy/float32"
+        from model_artifact import ARTIFACT_PRECISION
+
+        return (f"numpy/artifact/"
+                f"{self.artifact_precision or ARTIFACT_PRECISION}")
+
+    def get_preprocessor(self):
+        return self.get("preprocessor")
+
+    def get_encoder(self):
+        return self.get("encoder")
+
+    def get_background_data(self):
+        return self.get("background_data")
+
+    def get_explainer(self):
+        return self.get("explainer")
+
+    def get_grouped_explainer(self):
+        return self.get("grouped_explainer")
+
+    def get_artifact(self):
+        """
+        Abre el artefacto binario del modelo si está disponible.
+
+        Solo se usa si se exportó a partir de los mismos archivos .keras y
+        .pkl que tiene configurados el registro; si no, se cargan los
+        originales.
+
+        Returns:
+            ModelArtifact | None: Artefacto mapeado en memoria, o None.
+        """
+        if self._artifact_checked:
+            return self._artifact
+        with self._artifact_lock:
+            if not self._artifact_checked:
+                self._artifact = self._open_artifact()
+                self._artifact_checked = True
+        return self._artifact
+
+    def _open_artifact(self):
+        import model_artifact
+
+        path = self.artifact_path or model_artifact.ARTIFACT_PATH
+        if not USE_ARTIFACT or not os.path.exists(path):
+            return None
+        try:
+            artifact = model_artifact.ModelArtifact(path)
+        except (OSError, ValueError) as e:
+            print(f"Artefacto del modelo no válido, se usan los originales: "
+                  f"{e}")
+            return None
+        if not artifact.matches_sources([self.model_path,
+                                         self.preprocessor_path,
+                                         self.background_data_path]):
+            print(f"El artefacto '{path}' no corresponde al modelo actual; "
+                  f"vuelve a exportarlo con 'python model_artifact.py "
+                  f"export'.")
+            return None
+        return artifact
+
+    def is_loaded(self, name):
+        return name in self._resources
+
+    def load_times(self):
+        """
+        Devuelve el coste de arranque en frío de cada componente ya cargado.
+
+        Returns:
+            dict: Segundos de carga por componente.
+        """
+        return dict(self._load_times)
+
+    def default_components(self, shap_mode=None):
+        """
+        Componentes que usan la configuración actual, en orden de carga.
+
+        El modelo Keras y el explainer genérico solo se incluyen con el
+        motor Keras o el modo SHAP 'generic', para no importar TensorFlow
+        cuando no hace falta.
+
+        Args:
+            shap_mode (str, optional): 'grouped' o 'generic'. Por defecto,
+                SHAP_MODE de stroke_SHAP.
+
+        Returns:
+            list: Nombres de los componentes.
+        """
+        if shap_mode is None:
+            from stroke_SHAP import SHAP_MODE
+
+            shap_mode = SHAP_MODE
+        excluded = set()
+        if self.get_artifact() is not None:
+            # El artefacto ya contiene lo que se usaba del preprocesador
+            excluded.add("preprocessor")
+        if shap_mode == "generic":
+            excluded.add("grouped_explainer")
+        else:
+            excluded.add("explainer")
+        if self.backend == "keras":
+            excluded.add("numpy_model")
+        elif shap_mode != "generic":
+            excluded.add("model")
+        return [name for name in COMPONENTS if name not in excluded]
+
+    def warm_up(self, components=None, background=True):
+        """
+        Carga por adelantado los componentes indicados.
+
+        Args:
+            components (list, optional): Componentes a cargar. Por defecto,
+                default_components().
+            background (bool): Si es True, la carga se hace en un hilo
+                daemon y la función vuelve de inmediato.
+
+        Returns:
+            threading.Thread | None: El hilo de calentamiento, si se usa.
+        """
+        if components is None:
+            components = self.default_components()
+        components = list(components)
+
+        def _run():
+            for name in components:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    print(f"Error al precargar '{name}': {e}")
+
+        if not background:
+            _run()
+            return None
+
+        # Un único calentamiento en curso por proceso, aunque Streamlit
+        # vuelva a ejecutar el script en cada interacción
+        with self._warm_up_lock:
+            if (self._warm_up_thread is None
+                    or not self._warm_up_thread.is_alive()):
+                pending = [name for name in components
+                           if not self.is_loaded(name)]
+                if pending:
+                    components = pending
+                    self._warm_up_thread = threading.Thread(
+                        target=_run, name="model-registry-warm-up",
+                        daemon=True)
+                    self._warm_up_thread.start()
+            return self._warm_up_thread
+
+    def clear(self):
+        """
+        Libera todos los componentes para forzar su recarga.
+        """
+        for name in self._loaders:
+            with self._locks[name]:
+                self._resources.pop(name, None)
+                self._load_times.pop(name, None)
+        with self._artifact_lock:
+            self._artifact = None
+            self._artifact_checked = False
+
+    def _load_model(self):
+        # noinspection PyUnresolvedReferences
+        from tensorflow.keras.models import load_model
+
+        model = load_model(self.model_path)
+        model.trainable = False
+        for layer in model.layers:
+            layer.trainable = False
+        return model
+
+    def _load_numpy_model(self):
+        from numpy_inference import load_numpy_model
+
+        artifact = self.get_artifact()
+        if artifact is not None:
+            from model_artifact import ARTIFACT_PRECISION, PRECISION_ATOL
+
+            precision = self.artifact_precision or ARTIFACT_PRECISION
+            # La paridad con Keras se midió al exportar: sin TensorFlow
+            self.parity_max_abs_diff = artifact.parity(precision)
+            if self.parity_max_abs_diff > PRECISION_ATOL[precision]:
+                print(f"Los pesos '{precision}' del artefacto difieren de "
+                      f"Keras en {self.parity_max_abs_diff:.2e}, se usa "
+                      f"Keras.")
+                return self._fall_back_to_keras()
+            return artifact.numpy_model(precision)
+
+        numpy_model = load_numpy_model(self.model_path)
+        # Sin artefacto, la verificación contra Keras importa TensorFlow; se
+        # hace antes de devolver el modelo para que ninguna predicción ni
+        # componente dependa de un motor sin verificar
+        if self.parity_check and not self._verify_numpy_model(numpy_model):
+            return self._fall_back_to_keras()
+        return numpy_model
+
+    def _verify_numpy_model(self, numpy_model):
+        from numpy_inference import check_parity
+
+        try:
+            inputs = self.get_background_data()[:PARITY_ROWS]
+            self.parity_max_abs_diff = check_parity(
+                numpy_model, self.get_model(), inputs)
+            return True
+        except Exception as e:
+            print(f"Verificación del motor NumPy fallida, se usa Keras: {e}")
+            return False
+
+    def _fall_back_to_keras(self):
+        # Quien pida el modelo NumPy recibe el de Keras: nunca se sirve un
+        # motor que no ha pasado la verificación
+        self.backend = "keras"
+        return self.get_model()
+
+    def _load_preprocessor(self):
+        import joblib
+
+        return joblib.load(self.preprocessor_path)
+
+    def _load_encoder(self):
+        from fast_preprocessing import CompiledEncoder, check_equivalence
+
+        artifact = self.get_artifact()
+        if artifact is not None:
+            # La equivalencia ya se comprobó al exportar el artefacto
+            return artifact.encoder()
+        preprocessor = self.get_preprocessor()
+        encoder = CompiledEncoder.from_preprocessor(preprocessor)
+        # Comprobación barata: no se usa el codificador si no reproduce
+        # exactamente al ColumnTransformer
+        check_equivalence(encoder, preprocessor)
+        return encoder
+
+    def _load_background_data(self):
+        import joblib
+
+        artifact = self.get_artifact()
+        if artifact is not None:
+            return artifact.background_data()
+        return joblib.load(self.background_data_path)
+
+    def _load_explainer(self):
+        import shap
+
+        return shap.Explainer(self.get_model(), self.get_background_data(),
+                              framework='tensorflow')
+
+    def _load_grouped_explainer(self):
+        from grouped_shap import build_grouped_explainer
+
+        return build_grouped_explainer(self)
+
+
+# Instancia compartida por todos los módulos y sesiones del proceso
+REGISTRY = ModelRegistry()
@@ -0,0 +1,189 @@
+import io
+import json
+import re
+import zipfile
+import numpy as np
+
+MODEL_PATH = "best_ann.keras"
+
+# Tolerancia máxima entre la salida NumPy y la de Keras
+PARITY_ATOL = 1e-5
+
+
+def _relu(x):
+    return np.maximum(x, 0.0, out=x)
+
+
+def _sigmoid(x):
+    # Forma estable numéricamente para valores muy negativos
+    out = np.empty_like(x)
+    positive = x >= 0
+    out[positive] = 1.0 / (1.0 + np.exp(-x[positive]))
+    exp_x = np.exp(x[~positive])
+    out[~positive] = exp_x / (1.0 + exp_x)
+    return out
+
+
+def _tanh(x):
+    return np.tanh(x, out=x)
+
+
+def _softmax(x):
+    shifted = np.exp(x - x.max(axis=1, keepdims=True))
+    return shifted / shifted.sum(axis=1, keepdims=True)
+
+
+def _linear(x):
+    return x
+
+
+ACTIVATIONS = {
+    "relu": _relu,
+    "sigmoid": _sigmoid,
+    "tanh": _tanh,
+    "softmax": _softmax,
+    "linear": _linear,
+}
+
+# Capas que no intervienen en la inferencia
+_PASSTHROUGH_LAYERS = {"InputLayer", "Dropout"}
+
+
+class NumpyANN:
+    """
+    Red densa evaluada únicamente con NumPy.
+
+    Reproduce el forward pass de un modelo Keras secuencial formado por
+    capas Dense (las capas Dropout se ignoran en inferencia), sin importar
+    TensorFlow.
+
+    Args:
+        layers (list): Lista de tuplas (kernel, bias, activation) con los
+            pesos de cada capa Dense en orden.
+    """
+
+    def __init__(self, layers):
+        self.layers = [
+            (np.ascontiguousarray(kernel, dtype=np.float32),
+             np.ascontiguousarray(bias, dtype=np.float32),
+             activation)
+            for kernel, bias, activation in layers
+        ]
+        for _, _, activation in self.layers:
+            if activation not in ACTIVATIONS:
+                raise ValueError(
+                    f"Activación no soportada: '{activation}'")
+
+    @property
+    def input_dim(self):
+        return self.layers[0][0].shape[0]
+
+    def predict(self, x, batch_size=None, verbose=0):
+        """
+        Calcula la salida del modelo para un lote de filas.
+
+        Acepta los mismos argumentos que keras.Model.predict para poder
+        usarse como sustituto directo; 'batch_size' y 'verbose' se ignoran
+        porque el lote se procesa entero.
+
+        Args:
+            x (np.ndarray): Matriz (n_filas, n_entradas) ya preprocesada.
+
+        Returns:
+            np.ndarray: Matriz (n_filas, n_salidas) en float32.
+        """
+        out = np.asarray(x, dtype=np.float32)
+        if out.ndim == 1:
+            out = out.reshape(1, -1)
+        for kernel, bias, activation in self.layers:
+            out = out @ kernel
+            out += bias
+            out = ACTIVATIONS[activation](out)
+        return out
+
+    __call__ = predict
+
+
+def _weights_key(class_name, counters):
+    # Keras 3 guarda los pesos bajo nombres derivados de la clase
+    # ('dense', 'dense_1', ...), no bajo el nombre configurado de la capa
+    base = re.sub(r"(?<!^)(?=[A-Z])", "_", class_name).lower()
+    index = counters.get(base, 0)
+    counters[base] = index + 1
+    return base if index == 0 else f"{base}_{index}"
+
+
+def load_numpy_model(model_path=MODEL_PATH):
+    """
+    Extrae las capas Dense de un archivo .keras y construye un NumpyANN.
+
+    Lee directamente config.json y model.weights.h5 del archivo, por lo que
+    no necesita TensorFlow.
+
+    Args:
+        model_path (str): Ruta al archivo .keras.
+
+    Returns:
+        NumpyANN: Modelo listo para inferencia.
+
+    Raises:
+        ValueError: Si el modelo contiene capas no soportadas.
+    """
+    import h5py
+
+    with zipfile.ZipFile(model_path) as archive:
+        config = json.loads(archive.read("config.json"))
+        weights_bytes = archive.read("model.weights.h5")
+
+    if config.get("class_name") != "Sequential":
+        raise ValueError("Solo se admiten modelos Sequential.")
+
+    layers = []
+    counters = {}
+    with h5py.File(io.BytesIO(weights_bytes), "r") as weights:
+        for layer in config["config"]["layers"]:
+            class_name = layer["class_name"]
+            if class_name == "InputLayer":
+                continue
+            key = _weights_key(class_name, counters)
+            if class_name in _PASSTHROUGH_LAYERS:
+                continue
+            if class_name != "Dense":
+                raise ValueError(f"Capa no soportada: '{class_name}'")
+
+            layer_vars = weights["layers"][key]["vars"]
+            kernel = layer_vars["0"][()]
+            if layer["config"].get("use_bias", True):
+                bias = layer_vars["1"][()]
+            else:
+                bias = np.zeros(kernel.shape[1], dtype=np.float32)
+            layers.append(
+                (kernel, bias, layer["config"].get("activation", "linear")))
+
+    return NumpyANN(layers)
+
+
+def check_parity(numpy_model, keras_model, inputs, atol=PARITY_ATOL):
+    """
+    Compara la salida de NumpyANN con la del modelo Keras original.
+
+    Args:
+        numpy_model (NumpyANN): Modelo NumPy a verificar.
+        keras_model (keras.Model): Modelo de referencia.
+        inputs (np.ndarray): Filas preprocesadas de prueba.
+        atol (float): Diferencia absoluta máxima admitida.
+
+    Returns:
+        float: Diferencia absoluta máxima observada.
+
+    Raises:
+        ValueError: Si la diferencia supera 'atol'.
+    """
+    expected = keras_model.predict(inputs, batch_size=len(inputs), verbose=0)
+    actual = numpy_model.predict(inputs)
+    max_abs_diff = float(np.max(np.abs(actual - expected)))
+    if max_abs_diff > atol:
+        raise ValueError(
+            f"La salida NumPy difiere de Keras en {max_abs_diff:.2e} "
+            f"(tolerancia {atol:.0e}).")
+    return max_abs_diff
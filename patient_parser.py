@@ -0,0 +1,240 @@
+import os
+import re
+import unicodedata
+from prediction_cache import canonicalize_person_data
+from stroke_prediction import (CATEGORICAL_FEATURES, NUMERICAL_FEATURES,
+                               extract_dictionary, validate_input)
+
+# Si está activo, los mensajes con los 10 datos del paciente se predicen sin
+# esperar a que GPT construya el diccionario
+FAST_PATH = os.environ.get("STROKE_BOT_FAST_PATH", "1") != "0"
+
+REQUIRED_FEATURES = NUMERICAL_FEATURES + CATEGORICAL_FEATURES
+
+_NUMBER = r"(\d+(?:[.,]\d+)?)"
+
+# Expresiones sobre el texto en minúsculas y sin tildes. Cada variable
+# numérica admite varias formas y se recogen todas las coincidencias; si dan
+# valores distintos, la variable es ambigua
+NUMERIC_PATTERNS = {
+    "age": [
+        rf"\b(?:edad|age|aged)\b\s*(?:de|:|=|is|of)?\s*{_NUMBER}",
+        rf"\b(?:de|tiene|tengo)\s+{_NUMBER}\s*(?:anos|ano|a\.)(?!\w)",
+        rf"{_NUMBER}\s*(?:anos|ano)\s+de\s+edad\b",
+        rf"{_NUMBER}[\s-]*(?:years?|yrs?)[\s-]*old\b",
+    ],
+    "avg_glucose_level": [
+        rf"\b(?:glucosa|glucemia|glucose|glucose level|avg_glucose_level)"
+        rf"(?:\s+(?:media|promedio|en sangre|average|level|de))*"
+        rf"\s*(?::|=|de|of|is)?\s*{_NUMBER}",
+    ],
+    "bmi": [
+        rf"\b(?:bmi|imc|indice de masa corporal|body mass index)\b"
+        rf"\s*(?::|=|de|of|is)?\s*{_NUMBER}",
+    ],
+}
+
+# Formas de respaldo sin contexto ('67 años'), solo si ninguna de las
+# anteriores encaja: 'desde hace 10 años' también las cumple
+NUMERIC_FALLBACK_PATTERNS = {
+    "age": [rf"{_NUMBER}\s*(?:anos|ano|a\.|years?|yrs?|-year)(?!\w)"],
+}
+
+# Variables categóricas: (expresión, valor). Se recogen todas las
+# coincidencias; si apuntan a valores distintos, la variable es ambigua
+CATEGORICAL_PATTERNS = {
+    "gender": [
+        (r"\b(?:mujer|femenin[oa]|female|woman)\b", "Female"),
+        (r"\b(?:hombre|varon|masculin[oa]|male|man)\b", "Male"),
+    ],
+    "work_type": [
+        (r"\b(?:nunca ha trabajado|no ha trabajado nunca|sin empleo previo"
+         r"|never worked|never_worked)\b", "Never_worked"),
+        (r"\b(?:funcionari[oa]|emplead[oa] public[oa]|sector publico"
+         r"|govt_job|government job|public sector|civil servant)\b",
+         "Govt_job"),
+        (r"\b(?:autonom[oa]|por cuenta propia|self-employed|self employed"
+         r"|freelance)\b", "Self-employed"),
+        (r"\b(?:privad[oa]|sector privado|empresa privada|private"
+         r"|private sector)\b", "Private"),
+        (r"\b(?:nin[oa]|menor de edad|children|child)\b", "children"),
+    ],
+    "Residence_type": [
+        (r"\b(?:urban[oa]|ciudad|urban|city)\b", "Urban"),
+        (r"\b(?:rural|campo|pueblo|countryside)\b", "Rural"),
+    ],
+    "smoking_status": [
+        (r"\b(?:ex-? ?fumador(?:a)?|dejo de fumar|former smoker"
+         r"|formerly smoked|ex-? ?smoker|quit smoking)\b", "formerly smoked"),
+        (r"\b(?:nunca (?:ha )?fumad[oa]|nunca fumo|no fumador(?:a)?|no fuma"
+         r"|never smoked|non-? ?smoker|does not smoke)\b", "never smoked"),
+        (r"\b(?:fumador(?:a)?|fuma|smoker|smokes)\b", "smokes"),
+        (r"\b(?:tabaco|tabaquismo|smoking)\b\s*(?::|=)?\s*"
+         r"(?:desconocido|unknown|no consta)\b", "Unknown"),
+    ],
+}
+
+# Variables booleanas: expresiones de la condición y, opcionalmente, valores
+# fijos (p. ej. 'soltero' implica ever_married=False)
+BOOLEAN_PATTERNS = {
+    "hypertension": [r"\b(?:hipertens\w*|tension alta|presion alta"
+                     r"|hypertension|hypertensive|high blood pressure)"],
+    "heart_disease": [r"\b(?:enfermedad(?:es)? cardiac\w*|cardiopatia\w*"
+                      r"|cardiopata|problemas? (?:de|del) corazon"
+                      r"|heart disease|cardiac disease)"],
+    "ever_married": [r"\b(?:casad[oa]|married|ever_married)"],
+}
+BOOLEAN_FIXED = {
+    "ever_married": [
+        (r"\b(?:solter[oa]|never married|nunca (?:se )?(?:ha )?casad[oa]"
+         r"|single)\b", False),
+        (r"\b(?:viud[oa]|divorciad[oa]|separad[oa]|widow(?:ed)?|divorced)\b",
+         True),
+    ],
+}
+
+# Peticiones que van más allá de la predicción (explicación, gráficos,
+# escenarios o comparación con la cohorte) y que necesitan las herramientas
+_OTHER_REQUESTS = re.compile(
+    r"\b(?:explic\w*|explain\w*|why|por ?que|shap|grafic\w*|plot\w*"
+    r"|waterfall|force|decision|dibuj\w*|factor(?:es)?|influ\w*"
+    r"|contribu\w*|que pasaria|y si|what if|simul\w*|compar\w*"
+    r"|cohorte?|poblacion|percentil\w*)\b")
+
+# Respuesta explícita justo después de la condición ('hipertensión: sí')
+_ANSWER = re.compile(r"^\s*(?::|=|\?)?\s*(si|yes|true|no|false)\b")
+# Negación justo antes de la condición ('sin hipertensión', 'no es casado')
+_NEGATION = re.compile(r"\b(?:no|sin|without|not|never|nunca|niega)\b"
+                       r"(?:\s+\w+){0,2}\s*$")
+
+
+def normalize_text(text):
+    """
+    Pasa el texto a minúsculas y elimina las tildes.
+    """
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed
+                   if not unicodedata.combining(char))
+
+
+def _boolean_value(text, match):
+    answer = _ANSWER.match(text[match.end():])
+    if answer:
+        return answer.group(1) in ("si", "yes", "true")
+    before = text[max(0, match.start() - 25):match.start()]
+    return not _NEGATION.search(before)
+
+
+class ParseResult:
+    """
+    Resultado de extraer los datos de un paciente de un mensaje.
+
+    Args:
+        person_data (dict): Variables reconocidas, ya normalizadas.
+        ambiguous (list): Variables con valores contradictorios en el texto.
+    """
+
+    def __init__(self, person_data, ambiguous=None):
+        self.person_data = person_data
+        self.ambiguous = list(ambiguous or [])
+
+    @property
+    def missing(self):
+        return [key for key in REQUIRED_FEATURES
+                if key not in self.person_data]
+
+    @property
+    def is_complete(self):
+        """
+        True si están las 10 variables, sin ambigüedades, y pasan
+        validate_input.
+        """
+        if self.missing or self.ambiguous:
+            return False
+        try:
+            validate_input(self.person_data)
+        except ValueError:
+            return False
+        return True
+
+
+def asks_only_prediction(text):
+    """
+    Indica si un mensaje solo pide la predicción del riesgo.
+
+    Args:
+        text (str): Mensaje del usuario.
+
+    Returns:
+        bool: False si además pide explicaciones, gráficos, escenarios o
+        comparaciones, que necesitan que GPT elija las herramientas.
+    """
+    return _OTHER_REQUESTS.search(normalize_text(text)) is None
+
+
+def parse_patient_text(text):
+    """
+    Extrae los datos de un paciente de un mensaje en español o inglés.
+
+    Reconoce un diccionario escrito tal cual (con extract_dictionary) o
+    frases clínicas como "45 años, glucosa 120, IMC 25, hipertensión: sí,
+    exfumador, funcionario...", traduciendo los sinónimos a los valores
+    que acepta el modelo.
+
+    Args:
+        text (str): Mensaje del usuario.
+
+    Returns:
+        ParseResult: Variables reconocidas, ambiguas y faltantes.
+    """
+    if "{" in text:
+        dictionary = extract_dictionary(text)
+        if dictionary is not None:
+            return ParseResult(canonicalize_person_data(dictionary))
+
+    normalized = normalize_text(text)
+    person_data = {}
+    ambiguous = []
+
+    for key, patterns in NUMERIC_PATTERNS.items():
+        for candidates in (patterns, NUMERIC_FALLBACK_PATTERNS.get(key, [])):
+            found = {float(match.group(1).replace(",", "."))
+                     for pattern in candidates
+                     for match in re.finditer(pattern, normalized)}
+            if not found:
+                continue
+            if len(found) == 1:
+                person_data[key] = found.pop()
+            else:
+                # 'hace 10 años ... 67 años': mejor preguntar que adivinar
+                ambiguous.append(key)
+            break
+
+    for key, patterns in CATEGORICAL_PATTERNS.items():
+        found = set()
+        remaining = normalized
+        # Se borra cada coincidencia para que 'exfumador' no cuente
+        # también como 'fumador'
+        for pattern, value in patterns:
+            if re.search(pattern, remaining):
+                found.add(value)
+                remaining = re.sub(pattern, " ", remaining)
+        if len(found) == 1:
+            person_data[key] = found.pop()
+        elif found:
+            ambiguous.append(key)
+
+    for key, patterns in BOOLEAN_PATTERNS.items():
+        found = set()
+        for pattern, value in BOOLEAN_FIXED.get(key, []):
+            if re.search(pattern, normalized):
+                found.add(value)
+        for pattern in patterns:
+            for match in re.finditer(pattern, normalized):
+                found.add(_boolean_value(normalized, match))
+        if len(found) == 1:
+            person_data[key] = found.pop()
+        elif found:
+            ambiguous.append(key)
+
+    return ParseResult(canonicalize_person_data(person_data), ambiguous)
@@ -0,0 +1,353 @@
+import math
+import numbers
+import numpy as np
+
+# Definición única de las variables del paciente, en el orden del dataset.
+# De aquí salen tanto el validador como los esquemas de las herramientas
+PATIENT_SCHEMA = {
+    "gender": {
+        "type": "string",
+        "enum": ["Male", "Female"],
+        "description": "Género del paciente, debe ser 'Male' o 'Female'.",
+    },
+    "age": {
+        "type": "number",
+        "exclusiveMinimum": 0,
+        "description": "Edad del paciente en años.",
+    },
+    "hypertension": {
+        "type": "boolean",
+        "description": "Indica si el paciente tiene hipertensión.",
+    },
+    "heart_disease": {
+        "type": "boolean",
+        "description": "Indica si el paciente tiene enfermedades cardíacas.",
+    },
+    "ever_married": {
+        "type": "boolean",
+        "description": "Indica si el paciente ha estado alguna vez casado.",
+    },
+    "work_type": {
+        "type": "string",
+        "enum": ["Private", "Self-employed", "Govt_job", "children",
+                 "Never_worked"],
+        "description": "Tipo de trabajo del paciente.",
+    },
+    "Residence_type": {
+        "type": "string",
+        "enum": ["Urban", "Rural"],
+        "description": "Tipo de residencia del paciente.",
+    },
+    "avg_glucose_level": {
+        "type": "number",
+        "exclusiveMinimum": 0,
+        "description": "Nivel promedio de glucosa en sangre.",
+    },
+    "bmi": {
+        "type": "number",
+        "exclusiveMinimum": 0,
+        "description": "Índice de masa corporal del paciente.",
+    },
+    "smoking_status": {
+        "type": "string",
+        "enum": ["never smoked", "formerly smoked", "smokes", "Unknown"],
+        "description": "Estado de tabaquismo del paciente.",
+    },
+}
+
+
+class _Missing:
+    def __repr__(self):
+        return "MISSING"
+
+
+# Marca de las claves ausentes en los datos columnares
+MISSING = _Missing()
+
+# Tipos numéricos exactos que se reconocen sin pasar por numbers.Real, cuya
+# comprobación con isinstance es diez veces más lenta
+_REAL_TYPES = (int, float, np.float64, np.float32, np.float16, np.int64,
+               np.int32, np.int16, np.int8, np.uint64, np.uint32, np.uint16,
+               np.uint8)
+_NON_REAL_TYPES = (str, bool, np.bool_, type(None), _Missing)
+
+
+class ValidationError(ValueError):
+    """
+    Datos de paciente inválidos. 'errors' contiene todos los problemas
+    encontrados, no solo el primero.
+    """
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        super().__init__(" ".join(self.errors))
+
+
+def person_data_schema(description="Datos del paciente.", required=None):
+    """
+    Genera el JSON Schema del parámetro 'person_data' de las herramientas.
+
+    Args:
+        description (str): Descripción del objeto.
+        required (list, optional): Claves obligatorias. Por defecto, todas.
+
+    Returns:
+        dict: Esquema del objeto con una propiedad por variable.
+    """
+    return {
+        "type": "object",
+        "description": description,
+        "properties": {name: dict(spec)
+                       for name, spec in PATIENT_SCHEMA.items()},
+        "required": list(PATIENT_SCHEMA if required is None else required),
+        "additionalProperties": False,
+    }
+
+
+def _is_real(value):
+    return (isinstance(value, numbers.Real)
+            and not isinstance(value, (bool, np.bool_)))
+
+
+_type_array = np.frompyfunc(type, 1, 1)
+_is_real_array = np.frompyfunc(_is_real, 1, 1)
+
+
+def _object_column(values, n_rows):
+    if isinstance(values, np.ndarray) and values.dtype == object:
+        return values
+    # fromiter no anida: una lista o un dict como valor sigue siendo un
+    # único elemento y no una dimensión más
+    return np.fromiter(values, dtype=object, count=n_rows)
+
+
+class _Field:
+    """
+    Comprobación compilada de una variable del esquema.
+
+    'check' es el predicado de la vía rápida: solo acepta los tipos
+    exactos habituales (str, bool, int, float), así que un False no implica
+    un error; is_valid da la respuesta definitiva.
+    """
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.type = spec["type"]
+        if self.type == "string":
+            allowed = frozenset(spec["enum"])
+            self.allowed = allowed
+            self._enum = np.array(spec["enum"], dtype=object)
+            options = ", ".join(f"'{value}'" for value in spec["enum"])
+            self.message = f"El valor de '{name}' debe ser uno de: {options}."
+            self.check = lambda value: (value.__class__ is str
+                                        and value in allowed)
+        elif self.type == "boolean":
+            self.message = f"El valor de '{name}' debe ser True o False."
+            self.check = lambda value: value is True or value is False
+        elif self.type == "number":
+            minimum = spec.get("exclusiveMinimum", -math.inf)
+            self.minimum = minimum
+            self.message = (f"El valor de '{name}' debe ser un número "
+                            f"positivo." if minimum == 0 else
+                            f"El valor de '{name}' debe ser mayor que "
+                            f"{minimum}.")
+            # NaN no cumple ninguna comparación
+            self.check = lambda value: ((value.__class__ is float
+                                         or value.__class__ is int)
+                                        and minimum < value < math.inf)
+        else:
+            raise ValueError(f"Tipo de variable no soportado: '{self.type}'")
+
+    def is_valid(self, value):
+        if self.type == "string":
+            return isinstance(value, str) and value in self.allowed
+        if self.type == "boolean":
+            return isinstance(value, (bool, np.bool_))
+        return (_is_real(value) and math.isfinite(value)
+                and value > self.minimum)
+
+    def valid_mask(self, values, n_rows, column=None, types=None):
+        """
+        Devuelve un vector booleano con las filas válidas de la columna.
+
+        Args:
+            values (Sequence | np.ndarray): Valores de la columna.
+            n_rows (int): Número de filas.
+            column (np.ndarray, optional): Valores como matriz object.
+            types (np.ndarray, optional): Tipo de cada valor de 'column'.
+        """
+        # Columnas ya tipadas (p. ej. de un DataFrame): sin mirar cada valor
+        if isinstance(values, np.ndarray) and values.dtype != object:
+            if self.type == "boolean":
+                return np.full(n_rows, values.dtype == np.bool_)
+            if self.type == "number" and values.dtype.kind in "iuf":
+                with np.errstate(invalid="ignore"):
+                    return np.isfinite(values) & (values > self.minimum)
+            if self.type == "string" and values.dtype.kind == "U":
+                return np.isin(values, list(self.allowed))
+
+        if column is None:
+            column = _object_column(values, n_rows)
+        if types is None:
+            types = _type_array(column)
+        if self.type == "string":
+            valid = np.isin(types, (str, np.str_))
+            valid[valid] = np.isin(column[valid], self._enum)
+            return valid
+        if self.type == "boolean":
+            return np.isin(types, (bool, np.bool_))
+
+        is_real = np.isin(types, _REAL_TYPES)
+        # Tipos poco habituales (p. ej. Decimal o Fraction): se comprueban
+        # uno a uno
+        unusual = ~is_real & ~np.isin(types, _NON_REAL_TYPES)
+        if unusual.any():
+            is_real[unusual] = _is_real_array(column[unusual]).astype(bool)
+        parsed = np.full(n_rows, np.nan)
+        parsed[is_real] = column[is_real].astype(np.float64)
+        with np.errstate(invalid="ignore"):
+            return is_real & np.isfinite(parsed) & (parsed > self.minimum)
+
+
+class SchemaValidator:
+    """
+    Validador compilado una sola vez a partir de un esquema de variables.
+
+    Comprueba columnas completas con operaciones vectorizadas y devuelve
+    todos los errores de cada fila en una sola pasada. Los mensajes solo se
+    construyen para las filas que fallan, de modo que un lote válido cuesta
+    unas pocas operaciones por columna.
+
+    Args:
+        schema (dict): Especificación de cada variable ('type' y, según el
+            tipo, 'enum' o 'exclusiveMinimum').
+    """
+
+    def __init__(self, schema=PATIENT_SCHEMA):
+        self.fields = [_Field(name, spec) for name, spec in schema.items()]
+        self.names = [field.name for field in self.fields]
+        self._checks = [(field.name, field.check) for field in self.fields]
+
+    def is_valid(self, person_data):
+        """
+        Comprobación rápida de un único paciente, sin construir mensajes.
+
+        Returns:
+            bool: True si es válido. False puede ser un falso negativo con
+                tipos poco habituales (p. ej. np.float64 o np.str_).
+        """
+        get = person_data.get
+        for name, check in self._checks:
+            if not check(get(name, MISSING)):
+                return False
+        return True
+
+    def record_errors(self, person_data):
+        """
+        Devuelve todos los errores de un paciente (lista vacía si es válido).
+        """
+        if self.is_valid(person_data):
+            return []
+        missing = [name for name in self.names if name not in person_data]
+        errors = ([f"Faltan las claves necesarias: {missing}"]
+                  if missing else [])
+        errors += [field.message for field in self.fields
+                   if field.name in person_data
+                   and not field.is_valid(person_data[field.name])]
+        return errors
+
+    def validate(self, person_data):
+        """
+        Valida un paciente.
+
+        Raises:
+            ValidationError: Con todos los errores encontrados.
+        """
+        errors = self.record_errors(person_data)
+        if errors:
+            raise ValidationError(errors)
+
+    def column_errors(self, columns, n_rows=None):
+        """
+        Valida datos columnares de una sola pasada.
+
+        Args:
+            columns (dict): Secuencia de valores por variable. Una columna
+                ausente, o el valor MISSING en una fila, cuenta como clave
+                que falta.
+            n_rows (int, optional): Número de filas; por defecto, la
+                longitud de la primera columna.
+
+        Returns:
+            dict: Lista de errores por índice de fila, solo para las filas
+                inválidas.
+        """
+        if n_rows is None:
+            n_rows = len(next(iter(columns.values()))) if columns else 0
+        missing = {}
+        invalid = {}
+        all_valid = np.ones(n_rows, dtype=bool)
+        for field in self.fields:
+            values = columns.get(field.name)
+            if values is None:
+                missing[field.name] = np.ones(n_rows, dtype=bool)
+                all_valid[:] = False
+                continue
+            if len(values) != n_rows:
+                raise ValueError(
+                    "Todas las columnas del lote deben tener la misma "
+                    "longitud.")
+            if isinstance(values, np.ndarray) and values.dtype != object:
+                valid = field.valid_mask(values, n_rows)
+            else:
+                column = _object_column(values, n_rows)
+                types = _type_array(column)
+                is_missing = types == _Missing
+                valid = field.valid_mask(values, n_rows, column, types)
+                if is_missing.any():
+                    missing[field.name] = is_missing
+                    valid |= is_missing
+                    all_valid &= ~is_missing
+            invalid[field.name] = ~valid
+            all_valid &= valid
+
+        # Vía rápida: ninguna fila falla, no hay mensajes que construir
+        if all_valid.all():
+            return {}
+
+        errors = {}
+        for row in np.flatnonzero(~all_valid).tolist():
+            names = [name for name in self.names
+                     if name in missing and missing[name][row]]
+            row_errors = ([f"Faltan las claves necesarias: {names}"]
+                          if names else [])
+            row_errors += [field.message for field in self.fields
+                           if field.name in invalid
+                           and invalid[field.name][row]]
+            errors[row] = row_errors
+        return errors
+
+    def record_list_errors(self, records):
+        """
+        Valida una lista de pacientes en una sola pasada.
+
+        Las filas que superan la comprobación rápida no se vuelven a
+        examinar; el resto se valida por columnas para obtener todos sus
+        errores.
+
+        Returns:
+            dict: Lista de errores por índice de fila inválida.
+        """
+        suspects = [i for i, record in enumerate(records)
+                    if not self.is_valid(record)]
+        if not suspects:
+            return {}
+        columns = {name: [records[i].get(name, MISSING) for i in suspects]
+                   for name in self.names}
+        errors = self.column_errors(columns, n_rows=len(suspects))
+        return {suspects[row]: row_errors
+                for row, row_errors in errors.items()}
+
+
+# Validador compartido por todos los módulos del proceso
+VALIDATOR = SchemaValidator()
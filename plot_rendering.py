@@ -0,0 +1,179 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import numpy as np
+from prediction_cache import TTLCache
+from tracing import TRACER
+
+PNG_CACHE_ENTRIES = int(os.environ.get("STROKE_BOT_PNG_CACHE_SIZE", "128"))
+PNG_CACHE_TTL = float(os.environ.get("STROKE_BOT_PNG_CACHE_TTL", "86400"))
+PNG_DPI = 100
+# 'vega': especificación Vega-Lite que dibuja el navegador; 'matplotlib':
+# PNG dibujado en el servidor
+PLOT_BACKEND = os.environ.get("STROKE_BOT_PLOT_BACKEND", "vega")
+PLOT_BACKENDS = ("vega", "matplotlib")
+
+PLOT_TYPES = ("force", "waterfall", "decision")
+
+# SHAP dibuja sobre el estado global de pyplot, que no es seguro entre
+# hilos: solo las llamadas a SHAP que lo usan se hacen bajo este cerrojo
+# (véase stroke_SHAP); las figuras se crean y codifican fuera de pyplot
+_PYPLOT_LOCK = threading.Lock()
+
+
+def explanation_hash(explanation):
+    """
+    Calcula un hash estable del contenido de una explicación SHAP.
+
+    Args:
+        explanation (shap.Explanation): Explicación a identificar.
+
+    Returns:
+        str: Hash SHA-256 hexadecimal.
+    """
+    digest = hashlib.sha256()
+    for array in (explanation.values, explanation.base_values):
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        digest.update(str(array.shape).encode("utf-8"))
+        digest.update(array.tobytes())
+    digest.update(json.dumps([list(explanation.feature_names),
+                              np.asarray(explanation.data).tolist()],
+                             default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _build_figure(explanation, plot_type, max_display):
+    import stroke_SHAP as shp
+
+    if plot_type == "force":
+        return shp.get_force_plot(explanation)
+    if plot_type == "waterfall":
+        return shp.get_waterfall_plot(explanation, max_display=max_display)
+    return shp.get_decision_plot(explanation)
+
+
+class PlotRenderer:
+    """
+    Servicio que dibuja los gráficos SHAP y devuelve los PNG ya
+    codificados.
+
+    Cada figura se cierra en cuanto se codifica, así que la memoria de
+    matplotlib no crece con el número de gráficos. Los bytes se guardan por
+    hash de explicación, tipo de gráfico y parámetros, de modo que repetir
+    un gráfico no vuelve a dibujarlo.
+
+    Args:
+        cache (TTLCache, optional): Caché de PNG.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache or TTLCache(PNG_CACHE_ENTRIES, PNG_CACHE_TTL)
+
+    def render(self, explanation, plot_type, max_display=10):
+        """
+        Dibuja un gráfico y devuelve sus bytes PNG en el hilo actual.
+
+        Args:
+            explanation (shap.Explanation): Explicación a dibujar.
+            plot_type (str): 'force', 'waterfall' o 'decision'.
+            max_display (int): Variables mostradas en el waterfall plot.
+
+        Returns:
+            bytes: Imagen PNG.
+
+        Raises:
+            ValueError: Si el tipo de gráfico no existe.
+        """
+        if plot_type not in PLOT_TYPES:
+            raise ValueError(
+                f"El tipo de gráfico debe ser uno de: {PLOT_TYPES}.")
+        if plot_type != "waterfall":
+            max_display = None
+        key = (explanation_hash(explanation), plot_type, max_display)
+        return self._render_png(
+            key, lambda: _build_figure(explanation, plot_type, max_display),
+            plot_type=plot_type)
+
+    def render_spec(self, explanation, plot_type, max_display=10):
+        """
+        Devuelve la especificación Vega-Lite de un gráfico SHAP.
+
+        No se cachea: construirla cuesta menos que calcular su clave.
+
+        Returns:
+            dict: Especificación para st.vega_lite_chart.
+
+        Raises:
+            ValueError: Si el tipo de gráfico no existe.
+        """
+        from chart_specs import build_chart_spec
+
+        if plot_type not in PLOT_TYPES:
+            raise ValueError(
+                f"El tipo de gráfico debe ser uno de: {PLOT_TYPES}.")
+        with TRACER.span("plot.spec", plot_type=plot_type):
+            return build_chart_spec(explanation, plot_type, max_display)
+
+    def render_plot(self, explanation, plot_type, max_display=10,
+                    backend=None):
+        """
+        Dibuja un gráfico SHAP con el motor configurado.
+
+        Args:
+            backend (str, optional): 'vega' o 'matplotlib'. Por defecto,
+                PLOT_BACKEND.
+
+        Returns:
+            dict | bytes: Especificación Vega-Lite o imagen PNG.
+        """
+        backend = backend or PLOT_BACKEND
+        if backend not in PLOT_BACKENDS:
+            raise ValueError(
+                f"El motor de gráficos debe ser uno de: {PLOT_BACKENDS}.")
+        if backend == "vega":
+            return self.render_spec(explanation, plot_type, max_display)
+        return self.render(explanation, plot_type, max_display)
+
+    def render_sweep(self, sweep):
+        """
+        Dibuja el resultado de what_if.risk_sweep y devuelve sus bytes PNG.
+
+        Args:
+            sweep (dict): Curva o superficie de riesgo.
+
+        Returns:
+            bytes: Imagen PNG.
+        """
+        from what_if import build_sweep_figure
+
+        digest = hashlib.sha256(
+            json.dumps(sweep, sort_keys=True).encode("utf-8")).hexdigest()
+        return self._render_png((digest, "what_if"),
+                                lambda: build_sweep_figure(sweep),
+                                plot_type="what_if")
+
+    def _render_png(self, key, build_figure, **attributes):
+        with TRACER.span("plot.render", **attributes) as span:
+            png = self.cache.get(key)
+            if span is not None:
+                span.set(cache_hit=png is not None)
+            if png is not None:
+                return png
+
+            with TRACER.span("plot.figure"):
+                fig = build_figure()
+
+            with TRACER.span("plot.png"):
+                buffer = io.BytesIO()
+                fig.savefig(buffer, format="png", dpi=PNG_DPI,
+                            bbox_inches="tight")
+                fig.clear()
+                png = buffer.getvalue()
+            self.cache.put(key, png)
+            return png
+
+
+# Instancia compartida por todas las sesiones del proceso
+RENDERER = PlotRenderer()
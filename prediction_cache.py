@@ -0,0 +1,222 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+# Configuración de columnas
+CATEGORICAL_FEATURES = [
+    "gender", "hypertension", "heart_disease", "ever_married",
+    "work_type", "Residence_type", "smoking_status"
+]
+NUMERICAL_FEATURES = ["age", "avg_glucose_level", "bmi"]
+BOOLEAN_FEATURES = ["hypertension", "heart_disease", "ever_married"]
+
+# Decimales conservados en las variables numéricas. Las diferencias menores
+# son ruido de formato (45 frente a 45.0000001) y no cambian la probabilidad
+# al nivel de 4 decimales con el que se informa
+NUMERIC_DECIMALS = 3
+
+MAX_ENTRIES = int(os.environ.get("STROKE_BOT_PREDICTION_CACHE_SIZE", "1024"))
+TTL_SECONDS = float(os.environ.get("STROKE_BOT_PREDICTION_CACHE_TTL", "3600"))
+
+_TRUE_VALUES = {"true", "yes", "y", "si", "sí", "s", "1"}
+_FALSE_VALUES = {"false", "no", "n", "0"}
+
+
+def _coerce_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str):
+        normalized = value.strip().lower()
+        if normalized in _TRUE_VALUES:
+            return True
+        if normalized in _FALSE_VALUES:
+            return False
+    # Valor no reconocible: se deja tal cual para que lo rechace la validación
+    return value
+
+
+def _coerce_number(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            value = float(value.strip().replace(",", "."))
+        except ValueError:
+            return value
+    if isinstance(value, (int, float)):
+        return round(float(value), NUMERIC_DECIMALS)
+    return value
+
+
+def canonicalize_person_data(person_data):
+    """
+    Normaliza los datos de un paciente para que entradas equivalentes
+    produzcan el mismo diccionario.
+
+    Las variables numéricas pasan a float redondeado a NUMERIC_DECIMALS
+    (también si llegan como texto), las booleanas aceptan 'Sí'/'No',
+    'true'/'false' o 0/1, y las claves quedan en un orden fijo. Los valores
+    que no se pueden interpretar se conservan para que validate_input
+    informe del error.
+
+    Args:
+        person_data (dict): Datos del paciente.
+
+    Returns:
+        dict: Copia normalizada de los datos.
+    """
+    ordered_keys = NUMERICAL_FEATURES + CATEGORICAL_FEATURES
+    keys = [key for key in ordered_keys if key in person_data]
+    keys += sorted(key for key in person_data if key not in ordered_keys)
+
+    canonical = {}
+    for key in keys:
+        value = person_data[key]
+        if key in NUMERICAL_FEATURES:
+            value = _coerce_number(value)
+        elif key in BOOLEAN_FEATURES:
+            value = _coerce_bool(value)
+        elif isinstance(value, str):
+            value = value.strip()
+        canonical[key] = value
+    return canonical
+
+
+def canonicalize_columns(columns):
+    """
+    Versión columnar de canonicalize_person_data para lotes grandes.
+
+    Las columnas ya tipadas se normalizan con operaciones vectorizadas; solo
+    las de tipo object se recorren valor a valor con las mismas reglas.
+
+    Args:
+        columns (dict): Secuencia de valores por variable.
+
+    Returns:
+        dict: Matriz NumPy normalizada por variable.
+    """
+    canonical = {}
+    for key, values in columns.items():
+        values = np.asarray(values)
+        kind = values.dtype.kind
+        if key in NUMERICAL_FEATURES and kind in "iuf":
+            values = np.round(values.astype(np.float64), NUMERIC_DECIMALS)
+        elif key in BOOLEAN_FEATURES and kind in "iuf":
+            is_binary = np.isin(values, (0, 1))
+            values = (values.astype(bool) if is_binary.all()
+                      else np.array([_coerce_bool(value)
+                                     for value in values.tolist()],
+                                    dtype=object))
+        elif kind == "O":
+            if key in NUMERICAL_FEATURES:
+                coerce = _coerce_number
+            elif key in BOOLEAN_FEATURES:
+                coerce = _coerce_bool
+            else:
+                def coerce(value):
+                    return value.strip() if isinstance(value, str) else value
+            values = np.fromiter((coerce(value) for value in values),
+                                 dtype=object, count=len(values))
+        canonical[key] = values
+    return canonical
+
+
+def cache_key(person_data):
+    """
+    Clave hashable de un paciente ya normalizado.
+
+    Incluye la firma del predictor (motor y precisión de los pesos), de
+    modo que tras cambiar de motor no se sirven probabilidades del
+    anterior.
+
+    Args:
+        person_data (dict): Datos devueltos por canonicalize_person_data.
+
+    Returns:
+        tuple: Firma del predictor seguida de los pares (clave, valor) en
+        orden fijo.
+
+    Raises:
+        TypeError: Si algún valor no es hashable.
+    """
+    from model_registry import REGISTRY
+
+    # El predictor se carga antes de firmar: si la paridad falla, el motor
+    # pasa a Keras durante la carga
+    REGISTRY.get_predictor()
+    key = (REGISTRY.predictor_signature(),) + tuple(
+        (key, value) for key, value in person_data.items())
+    hash(key)
+    return key
+
+
+class TTLCache:
+    """
+    Caché LRU acotada con caducidad por entrada, segura entre hilos.
+
+    Args:
+        max_entries (int): Número máximo de entradas.
+        ttl (float): Segundos de vida de cada entrada.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0,
+                      "expirations": 0}
+
+    def get(self, key):
+        """
+        Devuelve el valor guardado o None si no existe o ha caducado.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        """
+        Devuelve los contadores de la caché para monitorización.
+
+        Returns:
+            dict: Aciertos, fallos, expulsiones, caducidades, tamaño y tasa
+            de aciertos.
+        """
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats, size=len(self._entries),
+                        max_entries=self.max_entries, ttl=self.ttl,
+                        hit_rate=(self.stats["hits"] / lookups
+                                  if lookups else 0.0))
+
+
+# Instancia compartida por todas las sesiones del proceso
+PREDICTION_CACHE = TTLCache()
@@ -0,0 +1,309 @@
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import deque
+
+STORE_PATH = os.environ.get("STROKE_BOT_SESSION_PATH",
+                            os.path.join(".cache", "sessions.sqlite3"))
+# Mensajes más recientes de cada sesión que se conservan en memoria
+HOT_MESSAGES = int(os.environ.get("STROKE_BOT_SESSION_HOT_MESSAGES", "20"))
+# Segundos sin actividad tras los que una sesión se borra
+IDLE_SECONDS = float(os.environ.get("STROKE_BOT_SESSION_IDLE_SECONDS",
+                                    str(6 * 3600)))
+# Intervalo mínimo entre dos barridos de sesiones inactivas
+EXPIRE_INTERVAL = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    last_seen REAL NOT NULL,
+    explanation BLOB
+);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    payload BLOB NOT NULL,
+    PRIMARY KEY (session_id, seq)
+);
+"""
+
+
+def _pack_message(message):
+    raw = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    return raw, zlib.compress(raw)
+
+
+def _unpack_message(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class _HotSession:
+    """
+    Parte en memoria de una sesión: sus últimos mensajes y contadores.
+    """
+
+    def __init__(self, n_messages=0, disk_bytes=0):
+        self.hot = deque()
+        self.hot_sizes = deque()
+        self.n_messages = n_messages
+        self.disk_bytes = disk_bytes
+        self.has_explanation = False
+        self.explanation_bytes = 0
+        self.last_seen = time.time()
+
+    @property
+    def hot_bytes(self):
+        return sum(self.hot_sizes)
+
+
+class SessionStore:
+    """
+    Historial de chat y última explicación SHAP de cada sesión, acotados en
+    memoria y respaldados en SQLite.
+
+    Todos los mensajes se escriben en disco comprimidos en cuanto llegan;
+    en memoria solo se conservan los 'hot_messages' más recientes de cada
+    sesión. El historial completo se reconstruye desde disco cuando se pide
+    entero. La explicación SHAP no se guarda en memoria: se serializa
+    comprimida y se lee al empezar cada turno. Las sesiones sin actividad
+    durante 'idle_seconds' se borran de memoria y de disco.
+
+    Args:
+        path (str): Base de datos SQLite.
+        hot_messages (int): Mensajes por sesión que se mantienen en memoria.
+        idle_seconds (float): Inactividad tras la que caduca una sesión.
+    """
+
+    def __init__(self, path=STORE_PATH, hot_messages=HOT_MESSAGES,
+                 idle_seconds=IDLE_SECONDS):
+        self.path = path
+        self.hot_messages = hot_messages
+        self.idle_seconds = idle_seconds
+        self._sessions = {}
+        self._connection = None
+        self._lock = threading.RLock()
+        self._last_expiry = 0.0
+        self.stats = {"expired": 0, "disk_reads": 0}
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Una conexión por proceso protegida por el cerrojo: Streamlit
+            # ejecuta cada sesión en su propio hilo
+            self._connection = sqlite3.connect(self.path,
+                                               check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(_SCHEMA)
+        return self._connection
+
+    def _session(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            # Sesión ya conocida en disco (p. ej. tras expulsarla de
+            # memoria) o nueva
+            row = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) "
+                "FROM messages WHERE session_id = ?",
+                (session_id,)).fetchone()
+            session = _HotSession(n_messages=row[0], disk_bytes=row[1])
+            explanation = self._connect().execute(
+                "SELECT LENGTH(explanation) FROM sessions "
+                "WHERE session_id = ?", (session_id,)).fetchone()
+            if explanation is not None and explanation[0]:
+                session.has_explanation = True
+                session.explanation_bytes = explanation[0]
+            self._sessions[session_id] = session
+        session.last_seen = time.time()
+        return session
+
+    def _touch(self, connection, session_id, session):
+        connection.execute(
+            "INSERT INTO sessions (session_id, last_seen) VALUES (?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET last_seen = "
+            "excluded.last_seen", (session_id, session.last_seen))
+
+    def append(self, session_id, messages):
+        """
+        Añade mensajes al final del historial de una sesión.
+
+        Args:
+            session_id (str): Identificador de la sesión.
+            messages (list): Mensajes en el formato de la API de chat.
+        """
+        with self._lock:
+            self._maybe_expire()
+            session = self._session(session_id)
+            connection = self._connect()
+            with connection:
+                for message in messages:
+                    raw, blob = _pack_message(message)
+                    connection.execute(
+                        "INSERT INTO messages (session_id, seq, payload) "
+                        "VALUES (?, ?, ?)",
+                        (session_id, session.n_messages, blob))
+                    session.n_messages += 1
+                    session.disk_bytes += len(blob)
+                    session.hot.append(message)
+                    session.hot_sizes.append(len(raw))
+                self._touch(connection, session_id, session)
+            while len(session.hot) > self.hot_messages:
+                session.hot.popleft()
+                session.hot_sizes.popleft()
+
+    def messages(self, session_id):
+        """
+        Devuelve el historial completo de una sesión.
+
+        Si todo cabe en la ventana caliente no se lee el disco; si no, los
+        mensajes antiguos se leen de SQLite solo para esta llamada.
+
+        Returns:
+            list: Mensajes en orden.
+        """
+        with self._lock:
+            session = self._session(session_id)
+            n_cold = session.n_messages - len(session.hot)
+            if n_cold == 0:
+                return list(session.hot)
+            self.stats["disk_reads"] += 1
+            rows = self._connect().execute(
+                "SELECT payload FROM messages WHERE session_id = ? "
+                "AND seq < ? ORDER BY seq", (session_id, n_cold)).fetchall()
+            return ([_unpack_message(blob) for (blob,) in rows]
+                    + list(session.hot))
+
+    def set_explanation(self, session_id, explanation):
+        """
+        Guarda la última explicación SHAP de la sesión en disco.
+
+        Args:
+            session_id (str): Identificador de la sesión.
+            explanation (shap.Explanation): Explicación a guardar.
+        """
+        from explanation_cache import to_payload
+
+        blob = zlib.compress(pickle.dumps(to_payload(explanation),
+                                          protocol=pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            session = self._session(session_id)
+            connection = self._connect()
+            with connection:
+                self._touch(connection, session_id, session)
+                connection.execute(
+                    "UPDATE sessions SET explanation = ? "
+                    "WHERE session_id = ?", (blob, session_id))
+            session.has_explanation = True
+            session.explanation_bytes = len(blob)
+
+    def get_explanation(self, session_id):
+        """
+        Lee la última explicación SHAP de la sesión.
+
+        Returns:
+            shap.Explanation | None: Explicación, o None si no hay.
+        """
+        from explanation_cache import from_payload
+
+        with self._lock:
+            session = self._session(session_id)
+            if not session.has_explanation:
+                return None
+            row = self._connect().execute(
+                "SELECT explanation FROM sessions WHERE session_id = ?",
+                (session_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return from_payload(pickle.loads(zlib.decompress(row[0])))
+
+    def usage(self, session_id):
+        """
+        Contabilidad de memoria y disco de una sesión.
+
+        Los bytes en memoria se estiman con el tamaño en JSON de los
+        mensajes calientes; los de disco son los ya comprimidos.
+
+        Returns:
+            dict: Mensajes y bytes en memoria y en disco.
+        """
+        with self._lock:
+            session = self._session(session_id)
+            return {
+                "messages": session.n_messages,
+                "hot_messages": len(session.hot),
+                "hot_bytes": session.hot_bytes,
+                "disk_bytes": session.disk_bytes,
+                "explanation_bytes": session.explanation_bytes,
+                "idle_seconds": round(time.time() - session.last_seen, 1),
+            }
+
+    def info(self):
+        """
+        Totales del proceso para monitorización.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+            return dict(self.stats, sessions=len(sessions),
+                        hot_messages=sum(len(s.hot) for s in sessions),
+                        hot_bytes=sum(s.hot_bytes for s in sessions))
+
+    def _maybe_expire(self):
+        now = time.time()
+        if now - self._last_expiry >= EXPIRE_INTERVAL:
+            self._last_expiry = now
+            self.expire_idle(now)
+
+    def expire_idle(self, now=None):
+        """
+        Borra de memoria y de disco las sesiones inactivas.
+
+        Returns:
+            int: Sesiones borradas.
+        """
+        now = time.time() if now is None else now
+        cutoff = now - self.idle_seconds
+        with self._lock:
+            connection = self._connect()
+            expired = [row[0] for row in connection.execute(
+                "SELECT session_id FROM sessions WHERE last_seen < ?",
+                (cutoff,))]
+            with connection:
+                for session_id in expired:
+                    connection.execute(
+                        "DELETE FROM messages WHERE session_id = ?",
+                        (session_id,))
+                    connection.execute(
+                        "DELETE FROM sessions WHERE session_id = ?",
+                        (session_id,))
+            for session_id in expired:
+                self._sessions.pop(session_id, None)
+            # Sesiones en memoria que nunca llegaron a escribir nada
+            for session_id, session in list(self._sessions.items()):
+                if session.last_seen < cutoff:
+                    del self._sessions[session_id]
+            self.stats["expired"] += len(expired)
+            return len(expired)
+
+    def delete(self, session_id):
+        """
+        Borra una sesión (p. ej. al reiniciar la conversación).
+        """
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "DELETE FROM messages WHERE session_id = ?",
+                    (session_id,))
+                connection.execute(
+                    "DELETE FROM sessions WHERE session_id = ?",
+                    (session_id,))
+            self._sessions.pop(session_id, None)
+
+
+# Instancia compartida por todas las sesiones del proceso
+SESSION_STORE = SessionStore()
@@ -0,0 +1,229 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# Procesos que calculan explicaciones SHAP; 0 las calcula en el propio hilo
+# que las pide. Por defecto se deja un núcleo libre para Streamlit
+WORKERS = int(os.environ.get("STROKE_BOT_SHAP_WORKERS",
+                             str(min(4, (os.cpu_count() or 1) - 1))))
+# Explicaciones en curso o en cola a partir de las cuales se rechazan más
+MAX_PENDING = int(os.environ.get("STROKE_BOT_SHAP_MAX_PENDING", "8"))
+TIMEOUT_SECONDS = float(os.environ.get("STROKE_BOT_SHAP_TIMEOUT", "60"))
+
+
+class SHAPPoolBusyError(RuntimeError):
+    """
+    Hay demasiadas explicaciones SHAP pendientes en el pool.
+    """
+
+
+class SHAPTimeoutError(RuntimeError):
+    """
+    Una explicación SHAP no terminó dentro del tiempo límite.
+    """
+
+
+def worker_initargs(mode):
+    """
+    Argumentos de _init_worker con el motor ya resuelto en este proceso.
+
+    Se carga el predictor antes de arrancar el pool para que, si la
+    verificación de paridad hizo pasar el proceso a Keras, los procesos
+    hijos usen el mismo motor y la misma precisión.
+
+    Args:
+        mode (str): 'grouped' o 'generic'.
+
+    Returns:
+        tuple: (mode, backend, artifact_precision).
+    """
+    from model_registry import REGISTRY
+
+    REGISTRY.get_predictor()
+    return mode, REGISTRY.backend, REGISTRY.artifact_precision
+
+
+def _init_worker(mode, backend, artifact_precision):
+    # Cada proceso prepara el codificador y el explainer antes de recibir
+    # trabajo. Si existe el artefacto binario, los pesos y el fondo se mapean
+    # en memoria y sus páginas se comparten entre procesos
+    from model_registry import REGISTRY
+
+    # El motor y la precisión los decide el proceso principal, que ya
+    # comprobó la paridad NumPy/Keras; repetirla aquí cargaría TensorFlow y
+    # una copia de Keras en cada proceso
+    REGISTRY.backend = backend
+    REGISTRY.artifact_precision = artifact_precision
+    REGISTRY.parity_check = False
+    REGISTRY.get_encoder()
+    if mode == "grouped":
+        REGISTRY.get_grouped_explainer()
+    else:
+        REGISTRY.get_explainer()
+
+
+def _ping():
+    return os.getpid()
+
+
+def _explain_in_worker(person_data, mode):
+    import stroke_SHAP as shp
+    from explanation_cache import to_payload
+
+    # Sin caché: el proceso principal consulta y guarda las explicaciones,
+    # así que el cálculo aquí siempre es un fallo de caché
+    return to_payload(shp._compute_explanation(person_data, mode))
+
+
+def _explain_rows_in_worker(rows):
+    from model_registry import REGISTRY
+
+    # Filas ya transformadas: solo viaja la matriz, no los diccionarios
+    return REGISTRY.get_grouped_explainer().shapley_values(rows)
+
+
+class SHAPPool:
+    """
+    Pool de procesos para calcular explicaciones SHAP fuera del proceso de
+    Streamlit, de modo que una explicación no bloquea al resto de sesiones
+    por el GIL.
+
+    La cola está acotada: con max_pending explicaciones pendientes, las
+    nuevas se rechazan con SHAPPoolBusyError en lugar de esperar sin
+    límite. Si un proceso muere, el pool se vuelve a crear en la siguiente
+    petición.
+
+    Args:
+        workers (int): Número de procesos; 0 desactiva el pool.
+        max_pending (int): Explicaciones en curso o en cola admitidas.
+        timeout (float): Segundos máximos de espera por explicación.
+        mode (str, optional): Modo SHAP cuyo explainer se precarga.
+    """
+
+    def __init__(self, workers=WORKERS, max_pending=MAX_PENDING,
+                 timeout=TIMEOUT_SECONDS, mode=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.mode = mode
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.stats = {"submitted": 0, "completed": 0, "rejected": 0,
+                      "timeouts": 0, "restarts": 0}
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                from stroke_SHAP import SHAP_MODE
+
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=worker_initargs(self.mode or SHAP_MODE))
+            return self._executor
+
+    def start(self):
+        """
+        Arranca los procesos y precarga sus modelos sin esperar a que
+        terminen.
+        """
+        if not self.enabled:
+            return
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(_ping)
+
+    def explain(self, person_data, mode):
+        """
+        Calcula una explicación en un proceso del pool.
+
+        Args:
+            person_data (dict): Datos del paciente ya normalizados.
+            mode (str): 'grouped' o 'generic'.
+
+        Returns:
+            shap.Explanation: Explicación del paciente.
+
+        Raises:
+            SHAPPoolBusyError: Si hay max_pending explicaciones pendientes.
+            SHAPTimeoutError: Si no termina en 'timeout' segundos.
+        """
+        from explanation_cache import from_payload
+
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise SHAPPoolBusyError(
+                    "Hay demasiadas explicaciones SHAP en curso. Inténtalo "
+                    "de nuevo en unos segundos.")
+            self._pending += 1
+            self.stats["submitted"] += 1
+        try:
+            future = self._get_executor().submit(_explain_in_worker,
+                                                 person_data, mode)
+        except BaseException:
+            self._release()
+            raise
+        # La plaza se libera cuando el cálculo termina de verdad, no cuando
+        # se deja de esperar: tras un timeout el proceso sigue ocupado
+        future.add_done_callback(self._release)
+        try:
+            payload = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Si ya había empezado, el proceso termina el cálculo en
+            # segundo plano; solo se deja de esperar
+            future.cancel()
+            self._count("timeouts")
+            raise SHAPTimeoutError(
+                f"La explicación SHAP superó el tiempo límite de "
+                f"{self.timeout:.0f} s.")
+        except BrokenProcessPool as e:
+            # Un proceso murió (p. ej. sin memoria): se recrea el pool
+            # para la siguiente petición y esta se calcula aquí mismo
+            print(f"Error en el pool de SHAP, se calcula en línea: {e}")
+            self._restart()
+            payload = _explain_in_worker(person_data, mode)
+        self._count("completed")
+        return from_payload(payload)
+
+    def _release(self, future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _restart(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self.stats["restarts"] += 1
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+    def info(self):
+        """
+        Devuelve contadores del pool para monitorización.
+        """
+        with self._lock:
+            return dict(self.stats, workers=self.workers,
+                        pending=self._pending, max_pending=self.max_pending)
+
+
+# Instancia compartida por todas las sesiones del proceso
+SHAP_POOL = SHAPPool()
@@ -1,26 +1,24 @@
-import joblib
-import numpy as np
-import pandas as pd
-import shap
-import matplotlib
-matplotlib.use('Agg')  # Backend para entornos sin interfaz gráfica
-import matplotlib.pyplot as plt
+import json
 import os
-from tensorflow.keras.models import load_model
-
-
-MODEL_PATH = "best_ann.keras"
-PREPROCESSOR_PATH = "preprocessor.pkl"
+from contextlib import contextmanager
+import numpy as np
+from explanation_cache import EXPLANATION_CACHE
+from model_registry import REGISTRY
+from shap_pool import SHAP_POOL
+from prediction_cache import (PREDICTION_CACHE, cache_key,
+                              canonicalize_person_data)
+from stroke_prediction import (_canonical_row, _error_result,
+                               prediction_result, to_records, validate_input)
+from tracing import TRACER
 
-# Cargar modelo y preprocesador globalmente
-MODEL = load_model(MODEL_PATH)
-MODEL.trainable = False
-for layer in MODEL.layers:
-    layer.trainable = False
+# 'grouped': Shapley exacto por variable original; 'generic': shap.Explainer
+# sobre las columnas one-hot
+SHAP_MODE = os.environ.get("STROKE_BOT_SHAP_MODE", "grouped")
 
-PREPROCESSOR = joblib.load(PREPROCESSOR_PATH)
-BACKGROUND_DATA = joblib.load("background_data.pkl")
-EXPLAINER = shap.Explainer(MODEL, BACKGROUND_DATA, framework='tensorflow')
+# Tamaño del resumen de SHAP que se envía al LLM
+SUMMARY_TOP_K = int(os.environ.get("STROKE_BOT_SHAP_SUMMARY_TOP_K", "5"))
+SUMMARY_MAX_CHARS = int(os.environ.get("STROKE_BOT_SHAP_SUMMARY_CHARS",
+                                       "800"))
 
 # Configuración de columnas
 CATEGORICAL_FEATURES = [
@@ -30,7 +28,58 @@ CATEGORICAL_FEATURES = [
 NUMERICAL_FEATURES = ["age", "avg_glucose_level", "bmi"]
 
 
-def get_reverted_shap_explanation(person_data):
+def __getattr__(name):
+    # Los recursos pesados se obtienen del registro compartido bajo demanda
+    if name == "MODEL":
+        return REGISTRY.get_model()
+    if name == "PREPROCESSOR":
+        return REGISTRY.get_preprocessor()
+    if name == "BACKGROUND_DATA":
+        return REGISTRY.get_background_data()
+    if name == "EXPLAINER":
+        return REGISTRY.get_explainer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _load_plotting():
+    """
+    Importa SHAP y pyplot solo cuando se dibuja un gráfico.
+
+    Returns:
+        tuple: Módulos (shap, matplotlib.pyplot).
+    """
+    import shap
+    import matplotlib
+    matplotlib.use('Agg')  # Backend para entornos sin interfaz gráfica
+    import matplotlib.pyplot as plt
+
+    return shap, plt
+
+
+@contextmanager
+def _pyplot_target(fig):
+    """
+    Deja fig como figura activa de pyplot mientras SHAP dibuja en ella.
+
+    SHAP no acepta unos ejes propios y dibuja con pyplot, que es estado
+    global: solo este tramo se hace bajo el cerrojo y al salir la figura
+    se retira de pyplot.
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.backends import backend_agg
+    from plot_rendering import _PYPLOT_LOCK
+
+    with _PYPLOT_LOCK:
+        backend_agg.new_figure_manager_given_figure(
+            max(plt.get_fignums(), default=0) + 1, fig)
+        plt.figure(fig)
+        try:
+            yield fig
+        finally:
+            plt.close(fig)
+
+
+def get_reverted_shap_explanation(person_data, mode=None, use_cache=True):
     """
     Combina la generación de valores SHAP y la reversión de los datos
     transformados. Devuelve un objeto shap.Explanation cuyas 'data' y
@@ -42,46 +91,274 @@ def get_reverted_shap_explanation(person_data):
             ['age', 'avg_glucose_level', 'bmi', 'gender', 'hypertension',
              'heart_disease', 'ever_married', 'work_type',
              'Residence_type', 'smoking_status']
+        mode (str, optional): 'grouped' calcula valores de Shapley exactos
+            para las 10 variables originales; 'generic' usa shap.Explainer
+            sobre las columnas one-hot. Por defecto, SHAP_MODE.
+        use_cache (bool): Si es True, reutiliza explicaciones previas del
+            mismo paciente desde EXPLANATION_CACHE.
 
     Returns:
         shap.Explanation: Objeto con .data, .base_values, .values,
         .feature_names (con los datos desescalados y revertidos de su nombre
         ‘one-hot’).
     """
+    person_data = canonicalize_person_data(person_data)
+    mode = _check_mode(mode)
+    with TRACER.span("shap.explanation", mode=mode, use_cache=use_cache):
+        if not use_cache:
+            return _dispatch_explanation(person_data, mode)
+
+        return EXPLANATION_CACHE.get_or_compute(
+            person_data, lambda: _dispatch_explanation(person_data, mode),
+            *_cache_parts(mode))
+
+
+def _dispatch_explanation(person_data, mode, transformed_data=None):
+    # Con el pool activo el cálculo va a otro proceso y no retiene el GIL
+    # del proceso de Streamlit
+    if SHAP_POOL.enabled:
+        with TRACER.span("shap.pool", workers=SHAP_POOL.workers):
+            return SHAP_POOL.explain(person_data, mode)
+    return _compute_explanation(person_data, mode, transformed_data)
+
+
+def _check_mode(mode):
+    mode = mode or SHAP_MODE
+    if mode not in ("grouped", "generic"):
+        raise ValueError("El modo debe ser 'grouped' o 'generic'.")
+    return mode
+
+
+def _cache_parts(mode):
+    from grouped_shap import BACKGROUND_METHOD, BACKGROUND_SIZE
+
+    # El tamaño y el resumen del fondo agrupado también cambian el resultado,
+    # igual que el motor y la precisión de los pesos con los que se evalúa;
+    # el modo genérico siempre usa el modelo Keras
+    if mode == "grouped":
+        return (mode, BACKGROUND_SIZE, BACKGROUND_METHOD,
+                REGISTRY.predictor_signature())
+    return mode, None
+
+
+def _compute_explanation(person_data, mode, transformed_data=None):
+    if transformed_data is None:
+        with TRACER.span("shap.preprocess"):
+            transformed_data = REGISTRY.get_encoder().transform(person_data)
+    if mode == "grouped":
+        with TRACER.span("shap.grouped_explainer"):
+            return _get_grouped_explanation(person_data, transformed_data)
+
     # Generar shap_values con EXPLAINER
-    df = pd.DataFrame([person_data])[NUMERICAL_FEATURES + CATEGORICAL_FEATURES]
-    transformed_data = PREPROCESSOR.transform(df)
-    shap_values = EXPLAINER(transformed_data)
+    encoder = REGISTRY.get_encoder()
+    with TRACER.span("shap.generic_explainer"):
+        shap_values = REGISTRY.get_explainer()(
+            transformed_data.astype(np.float64))
 
     # Revertir valores numéricos en shap_values.data a escala original
     data_reverted = shap_values.data.copy()
-    scaler = PREPROCESSOR.named_transformers_['num']
     data_reverted[:, :len(NUMERICAL_FEATURES)] = (
-            data_reverted[:, :len(NUMERICAL_FEATURES)] * scaler.scale_
-            + scaler.mean_
+            data_reverted[:, :len(NUMERICAL_FEATURES)] * encoder.scale
+            + encoder.mean
     )
 
     # Actualizar los feature_names
-    encoder = PREPROCESSOR.named_transformers_['cat']
-    onehot_feature_names = encoder.get_feature_names_out(CATEGORICAL_FEATURES)
-    feature_names_reverted = list(NUMERICAL_FEATURES) + list(
-        onehot_feature_names)
-
     shap_values.data = data_reverted
-    shap_values.feature_names = feature_names_reverted
+    shap_values.feature_names = encoder.output_names
 
     return shap_values
 
 
+def _get_grouped_explanation(person_data, transformed_data):
+    """
+    Explicación con una contribución por variable original, calculada con
+    GroupedShapleyExplainer.
+    """
+    values, base_values = REGISTRY.get_grouped_explainer().shapley_values(
+        transformed_data)
+    return _grouped_explanation(person_data, values, base_values)
+
+
+def _grouped_explanation(person_data, values, base_values):
+    import shap
+
+    encoder = REGISTRY.get_encoder()
+    data = np.array([[person_data[key] for key in encoder.feature_names]],
+                    dtype=object)
+
+    return shap.Explanation(values=values,
+                            base_values=base_values.reshape(-1, 1),
+                            data=data,
+                            feature_names=list(encoder.feature_names))
+
+
+def get_prediction_and_explanation(person_data, mode=None, use_cache=True):
+    """
+    Predice y explica a un paciente con una sola transformación de los datos.
+
+    La predicción se hace sobre la misma matriz ya transformada que usa
+    SHAP, de modo que sirve para comprobar que la explicación cuadra con la
+    probabilidad del modelo (véase summarize_explanation). Ambas
+    respuestas se guardan en sus cachés, así que las herramientas sueltas
+    las reutilizan después.
+
+    Args:
+        person_data (dict): Datos del paciente.
+        mode (str, optional): 'grouped' o 'generic'. Por defecto, SHAP_MODE.
+        use_cache (bool): Si es True, reutiliza predicciones y explicaciones
+            previas del mismo paciente.
+
+    Returns:
+        tuple: (predicción, explicación), donde la predicción tiene el
+        formato de get_stroke_prediction.
+
+    Raises:
+        ValueError: Si los datos o el modo no son válidos.
+    """
+    with TRACER.span("predict_and_explain", mode=mode or SHAP_MODE):
+        return _predict_and_explain(person_data, mode, use_cache)
+
+
+def _predict_and_explain(person_data, mode, use_cache):
+    person_data = canonicalize_person_data(person_data)
+    mode = _check_mode(mode)
+    with TRACER.span("prediction.validate"):
+        validate_input(person_data)
+
+    prediction_key = cache_key(person_data)
+    explanation_key = EXPLANATION_CACHE.key(person_data, *_cache_parts(mode))
+    prediction = explanation = None
+    if use_cache:
+        prediction = PREDICTION_CACHE.get(prediction_key)
+        explanation = EXPLANATION_CACHE.get(explanation_key)
+    if prediction is not None and explanation is not None:
+        return dict(prediction), explanation
+
+    with TRACER.span("shap.preprocess"):
+        transformed_data = REGISTRY.get_encoder().transform(person_data)
+    if explanation is None:
+        explanation = _dispatch_explanation(person_data, mode,
+                                            transformed_data)
+        if use_cache:
+            EXPLANATION_CACHE.put(explanation_key, explanation)
+    if prediction is None:
+        # Siempre una pasada real del modelo: sumar los valores SHAP daría
+        # una probabilidad que cuadra con la explicación por construcción
+        with TRACER.span("prediction.model", backend=REGISTRY.backend):
+            probability = float(REGISTRY.get_predictor().predict(
+                transformed_data, verbose=0)[0][0])
+        prediction = prediction_result(probability)
+        if use_cache:
+            PREDICTION_CACHE.put(prediction_key, prediction)
+    return dict(prediction), explanation
+
+
+def get_predictions_and_explanations_batch(batch, mode=None, use_cache=True):
+    """
+    Predice y explica un lote de pacientes.
+
+    En modo 'grouped' los pacientes que no están en caché se transforman
+    juntos y se explican con una sola llamada a
+    GroupedShapleyExplainer.shapley_values sobre la matriz completa; la
+    predicción es otra única pasada del modelo. En modo 'generic' cada
+    paciente se explica por separado.
+
+    Las filas inválidas no interrumpen el lote: su predicción lleva
+    'probability' a None y el motivo del error en 'message', y su
+    explicación es None.
+
+    Args:
+        batch (list | dict | pd.DataFrame): Pacientes, como en
+            get_stroke_predictions_batch.
+        mode (str, optional): 'grouped' o 'generic'. Por defecto, SHAP_MODE.
+        use_cache (bool): Si es True, reutiliza predicciones y explicaciones
+            previas y guarda las nuevas.
+
+    Returns:
+        list: Tuplas (predicción, explicación) en el orden de entrada.
+
+    Raises:
+        ValueError: Si el modo no es válido.
+    """
+    mode = _check_mode(mode)
+    records = to_records(batch)
+    with TRACER.span("predict_and_explain.batch", mode=mode,
+                     rows=len(records)):
+        return _predict_and_explain_batch(records, mode, use_cache)
+
+
+def _predict_and_explain_batch(records, mode, use_cache):
+    results = [None] * len(records)
+    pending = []
+    for i, person_data in enumerate(records):
+        try:
+            person_data = records[i] = _canonical_row(person_data)
+            validate_input(person_data)
+        except Exception as e:
+            results[i] = (_error_result(e), None)
+            continue
+        if use_cache:
+            prediction = PREDICTION_CACHE.get(cache_key(person_data))
+            explanation = EXPLANATION_CACHE.get(EXPLANATION_CACHE.key(
+                person_data, *_cache_parts(mode)))
+            if prediction is not None and explanation is not None:
+                results[i] = (dict(prediction), explanation)
+                continue
+        pending.append(i)
+
+    if mode == "generic":
+        for i in pending:
+            try:
+                results[i] = _predict_and_explain(records[i], mode,
+                                                  use_cache)
+            except Exception as e:
+                results[i] = (_error_result(e), None)
+        return results
+
+    if pending:
+        try:
+            with TRACER.span("shap.preprocess", rows=len(pending)):
+                transformed_data = REGISTRY.get_encoder().transform(
+                    [records[i] for i in pending])
+            with TRACER.span("prediction.model", rows=len(pending),
+                             backend=REGISTRY.backend):
+                probabilities = REGISTRY.get_predictor().predict(
+                    transformed_data, batch_size=len(pending), verbose=0)
+            with TRACER.span("shap.grouped_explainer", rows=len(pending)):
+                values, base_values = (REGISTRY.get_grouped_explainer()
+                                       .shapley_values(transformed_data))
+        except Exception as e:
+            for i in pending:
+                results[i] = (_error_result(e), None)
+            return results
+        for row, i in enumerate(pending):
+            prediction = prediction_result(float(probabilities[row, 0]))
+            explanation = _grouped_explanation(
+                records[i], values[[row]], base_values[[row]])
+            if use_cache:
+                PREDICTION_CACHE.put(cache_key(records[i]), prediction)
+                EXPLANATION_CACHE.put(EXPLANATION_CACHE.key(
+                    records[i], *_cache_parts(mode)), explanation)
+            results[i] = (dict(prediction), explanation)
+    return results
+
+
 def get_force_plot(shap_explanation):
-    # Con show=False y matplotlib=True, fuerza a SHAP a generar una figura
-    # Matplotlib
-    shap.plots.force(shap_explanation.base_values[0],
-                     shap_explanation.values[0],
-                     feature_names=shap_explanation.feature_names,
-                     matplotlib=True,
-                     show=False)
-    fig = plt.gcf()
+    """
+    Genera un SHAP force plot y retorna su figura de matplotlib.
+    """
+    from plot_rendering import _PYPLOT_LOCK
+
+    shap, plt = _load_plotting()
+    # Con show=False y matplotlib=True, SHAP crea y devuelve su propia figura
+    # Matplotlib, que se saca de pyplot antes de soltar el cerrojo
+    with _PYPLOT_LOCK:
+        fig = shap.plots.force(shap_explanation.base_values[0],
+                               shap_explanation.values[0],
+                               feature_names=shap_explanation.feature_names,
+                               matplotlib=True,
+                               show=False)
+        plt.close(fig)
     return fig
 
 
@@ -89,10 +366,14 @@ def get_waterfall_plot(shap_explanation, max_display=10):
     """
     Genera un SHAP waterfall plot y retorna la figura de matplotlib.
     """
-    shap.plots.waterfall(shap_explanation[0],
-                         max_display=max_display,
-                         show=True)
-    fig = plt.gcf()
+    from matplotlib.figure import Figure
+
+    shap, _ = _load_plotting()
+    fig = Figure()
+    with _pyplot_target(fig):
+        shap.plots.waterfall(shap_explanation[0],
+                             max_display=max_display,
+                             show=False)
     return fig
 
 
@@ -100,9 +381,113 @@ def get_decision_plot(shap_explanation):
     """
     Genera un decision plot de SHAP.
     """
-    shap.decision_plot(shap_explanation.base_values[0],
-                       shap_explanation.values[0],
-                       shap_explanation.feature_names,
-                       show=False)
-    fig = plt.gcf()
+    from matplotlib.figure import Figure
+
+    shap, _ = _load_plotting()
+    fig = Figure()
+    with _pyplot_target(fig):
+        shap.decision_plot(shap_explanation.base_values[0],
+                           shap_explanation.values[0],
+                           shap_explanation.feature_names,
+                           show=False)
     return fig
+
+
+def _group_contributions(shap_explanation):
+    """
+    Agrupa las contribuciones por variable original.
+
+    Admite tanto explicaciones agrupadas (una columna por variable) como
+    explicaciones one-hot ('work_type_Private', ...), cuyas columnas se
+    suman y cuyo valor original es la categoría activa.
+
+    Returns:
+        list: Tuplas (variable, valor original, contribución) en el orden
+        de NUMERICAL_FEATURES + CATEGORICAL_FEATURES.
+    """
+    names = list(shap_explanation.feature_names)
+    values = np.asarray(shap_explanation.values[0], dtype=np.float64)
+    data = np.asarray(shap_explanation.data[0], dtype=object)
+
+    grouped = []
+    for feature in NUMERICAL_FEATURES + CATEGORICAL_FEATURES:
+        if feature in names:
+            i = names.index(feature)
+            grouped.append((feature, data[i], float(values[i])))
+            continue
+        prefix = f"{feature}_"
+        columns = [i for i, name in enumerate(names)
+                   if name.startswith(prefix)]
+        active = [names[i][len(prefix):] for i in columns if data[i] == 1]
+        grouped.append((feature, active[0] if active else None,
+                        float(values[columns].sum())))
+    return grouped
+
+
+def _to_native(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        return round(value, 3)
+    return value
+
+
+def summarize_explanation(shap_explanation, probability,
+                          top_k=SUMMARY_TOP_K, max_chars=SUMMARY_MAX_CHARS):
+    """
+    Resume una explicación SHAP en un formato compacto para el LLM.
+
+    Contiene las top_k contribuciones (agrupadas por variable original, con
+    su valor en escala original y su signo) ordenadas por magnitud, más un
+    término 'others' con la suma del resto. 'reconciliation_error' es la
+    diferencia entre base_value + contribuciones + others y la probabilidad
+    que da el modelo, así que revela explicaciones que no cuadran con la
+    predicción (fondo o modelo distintos, aproximaciones de SHAP, etc.).
+
+    Args:
+        shap_explanation (shap.Explanation): Explicación de un paciente.
+        probability (float): Probabilidad predicha por el modelo para el
+            mismo paciente (get_stroke_prediction).
+        top_k (int): Máximo de variables listadas.
+        max_chars (int): Tamaño máximo del resumen serializado en JSON; si
+            se supera, se reduce top_k.
+
+    Returns:
+        dict: Resumen con 'base_value', 'predicted_probability',
+        'contributions', 'others' y 'reconciliation_error'.
+
+    Raises:
+        ValueError: Si no hay probabilidad (la predicción falló).
+    """
+    if probability is None:
+        raise ValueError("No hay probabilidad con la que resumir la "
+                         "explicación: la predicción falló.")
+    grouped = sorted(_group_contributions(shap_explanation),
+                     key=lambda item: -abs(item[2]))
+    base_value = float(np.ravel(shap_explanation.base_values)[0])
+
+    top_k = max(0, min(top_k, len(grouped)))
+    while True:
+        top, rest = grouped[:top_k], grouped[top_k:]
+        summary = {
+            "base_value": round(base_value, 4),
+            "predicted_probability": round(float(probability), 4),
+            "contributions": [
+                {"feature": feature, "value": _to_native(value),
+                 "shap": round(contribution, 4),
+                 "sign": "+" if contribution >= 0 else "-"}
+                for feature, value, contribution in top
+            ],
+            "others": {"n_features": len(rest),
+                       "shap": round(sum(c for _, _, c in rest), 4)},
+        }
+        # Error de cuadre frente al modelo, redondeo incluido, para que el
+        # LLM sepa si puede fiarse de que los términos suman la probabilidad
+        reconstructed = (summary["base_value"] + summary["others"]["shap"]
+                         + sum(item["shap"]
+                               for item in summary["contributions"]))
+        summary["reconciliation_error"] = round(
+            abs(reconstructed - summary["predicted_probability"]), 4)
+        if top_k == 0 or len(json.dumps(summary)) <= max_chars:
+            return summary
+        top_k -= 1
@@ -1,14 +1,22 @@
 from openai import OpenAI
 import streamlit as st
-import os
-import shelve
 import json
-import stroke_prediction as sp
-import stroke_SHAP as shp
+import os
+import uuid
+from chat_engine import as_chat_tools, run_local_turn, run_turn
+from explanation_cache import EXPLANATION_CACHE
+from history_manager import HISTORY_MANAGER
+from model_registry import REGISTRY
+from patient_parser import (FAST_PATH, asks_only_prediction,
+                            parse_patient_text)
+from prediction_cache import PREDICTION_CACHE
+from session_store import SESSION_STORE
+from shap_pool import SHAP_POOL
 from tools_config import tools
+from tracing import TRACER
 
 # Definición de herramientas para GPT
-tools = tools
+tools = as_chat_tools(tools)
 
 
 # Configuración de la página y variables iniciales
@@ -21,20 +29,18 @@ BOT_AVATAR = "🧠"
 client = OpenAI(api_key=st.secrets["API_KEY"])
 LLM_MODEL = "gpt-4o-mini-2024-07-18"
 
+# Precargar modelo, preprocesador y explainer en segundo plano: la interfaz
+# se muestra sin esperar a TensorFlow y todas las sesiones comparten la copia
+REGISTRY.warm_up()
+# Los procesos de SHAP cargan su propia copia del modelo mientras tanto
+SHAP_POOL.start()
+
 
 def load_text(file_path):
     with open(file_path, "r", encoding="utf-8") as file:
         return file.read()
 
 
-def create_function_message(name: str, payload: dict) -> dict:
-    """
-    Crea un mensaje con role='function' para alimentar a GPT
-    tras la llamada a una de las funciones.
-    """
-    return {"role": "function", "name": name, "content": json.dumps(payload)}
-
-
 app_info = load_text("app_info.txt")
 accepted_variables = load_text("accepted_variables.txt")
 
@@ -43,8 +49,11 @@ system_message = {
     "content": load_text("system_message.txt")
 }
 
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+# El historial y la última explicación SHAP viven en SESSION_STORE (memoria
+# acotada y disco); en st.session_state solo queda el identificador
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
+session_id = st.session_state["session_id"]
 
 col1, col2 = st.columns([1.5, 2])
 
@@ -53,167 +62,120 @@ with col1:
         st.markdown(app_info)
     with st.expander("📋 Variables aceptadas y su descripción"):
         st.markdown(accepted_variables)
+    with st.expander("⏱️ Tiempos de carga del modelo"):
+        load_times = REGISTRY.load_times()
+        if load_times:
+            st.table({"Componente": list(load_times),
+                      "Segundos": [round(t, 3) for t in load_times.values()]})
+        else:
+            st.markdown("Los componentes del modelo se están cargando.")
+        if REGISTRY.parity_max_abs_diff is not None:
+            st.caption(f"Motor '{REGISTRY.backend}', diferencia máxima con "
+                       f"Keras: {REGISTRY.parity_max_abs_diff:.1e}")
+        st.caption(f"Caché de explicaciones SHAP: {EXPLANATION_CACHE.info()}")
+        st.caption(f"Caché de predicciones: {PREDICTION_CACHE.info()}")
+        st.caption(f"Pool de SHAP: {SHAP_POOL.info()}")
+        st.caption(f"Sesión actual: {SESSION_STORE.usage(session_id)}")
+        st.caption(f"Almacén de sesiones: {SESSION_STORE.info()}")
 
 with col2:
     st.subheader("💬 Interacción con Stroke Bot")
 
     # Renderizar mensajes del usuario y del asistente
-    for message in st.session_state.messages:
-        if message["role"] in ("assistant", "user"):
+    messages = SESSION_STORE.messages(session_id)
+    for message in messages:
+        if message["role"] in ("assistant", "user") and message.get(
+                "content"):
             avatar = USER_AVATAR if message["role"] == "user" else BOT_AVATAR
             with st.chat_message(message["role"], avatar=avatar):
                 st.markdown(message["content"])
 
     if prompt := st.chat_input("Escribe tu mensaje:"):
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        user_message = {"role": "user", "content": prompt}
+        SESSION_STORE.append(session_id, [user_message])
+        messages.append(user_message)
         with st.chat_message("user", avatar=USER_AVATAR):
             st.markdown(prompt)
 
-        # Enviar mensajes al modelo GPT luego de recibir el prompt del
-        # usuario y guardarlo
-
-        response = client.chat.completions.create(
-            model=LLM_MODEL,
-            messages=[system_message] + st.session_state.messages,
-            functions=tools,
-            function_call="auto"
-        )
-
-        message = response.choices[0].message
-
-        while True:
-            if message.function_call:
-                func_call = message.function_call
-                arguments = json.loads(func_call.arguments)
-
-                if func_call.name == "get_stroke_prediction":
-                    person_data = arguments["person_data"]
-                    prediction_result = sp.get_stroke_prediction(person_data)
-
-                    st.session_state.messages.append(
-                        create_function_message(func_call.name,
-                                                prediction_result)
-                    )
-
-                elif func_call.name == "validate_input":
-                    person_data = arguments["person_data"]
-                    try:
-                        sp.validate_input(person_data)
-                        validation_result = {"valid": True,
-                                             "message": "Datos válidos."}
-                    except Exception as e:
-                        validation_result = {"valid": False, "message": str(e)}
-
-                    st.session_state.messages.append(
-                        create_function_message(func_call.name,
-                                                validation_result)
-                    )
-
-                elif func_call.name == "get_reverted_shap_explanation":
-                    person_data = arguments["person_data"]
-                    shap_explanation = shp.get_reverted_shap_explanation(
-                        person_data)
-                    st.session_state[
-                        "reverted_shap_explanation"] = shap_explanation
-
-                    base_values_list = shap_explanation.base_values.tolist()
-                    data_list = shap_explanation.data.tolist()
-                    values_list = shap_explanation.values.tolist()
-                    feature_names = shap_explanation.feature_names
-
-                    response_dict = {
-                        "base_values": base_values_list,
-                        "data": data_list,
-                        "values": values_list,
-                        "feature_names": feature_names
-                    }
-
-                    st.session_state.messages.append(
-                        create_function_message(func_call.name, response_dict)
-                    )
-
-                elif func_call.name == "get_force_plot":
-                    shap_explanation = st.session_state.get(
-                        "reverted_shap_explanation")
-                    if shap_explanation is None:
-                        function_result = {
-                            "error": "No hay 'reverted_shap_explanation' en "
-                                     "la sesión."
-                                     "Primero genera la explicación."
-                        }
-                    else:
-                        fig = shp.get_force_plot(shap_explanation)
-                        st.pyplot(fig)
-                        function_result = {
-                            "status": "Force plot generado y mostrado en la "
-                                      "interfaz."
-                        }
-
-                    st.session_state.messages.append(
-                        create_function_message(func_call.name,
-                                                function_result)
-                    )
-
-                elif func_call.name == "get_waterfall_plot":
-                    shap_explanation = st.session_state.get(
-                        "reverted_shap_explanation")
-                    if shap_explanation is None:
-                        function_result = {
-                            "error": "No hay 'reverted_shap_explanation' en "
-                                     "la sesión."
-                                     "Primero genera la explicación."
-                        }
-                    else:
-                        max_display = arguments.get("max_display", 10)
-                        fig = shp.get_waterfall_plot(shap_explanation,
-                                                     max_display=max_display)
-                        st.pyplot(fig)
-                        function_result = {
-                            "status": f"Waterfall plot generado con "
-                                      f"max_display={max_display}."
-                        }
-
-                    st.session_state.messages.append(
-                        create_function_message(func_call.name,
-                                                function_result)
-                    )
-
-                elif func_call.name == "get_decision_plot":
-                    shap_explanation = st.session_state.get(
-                        "reverted_shap_explanation")
-                    if shap_explanation is None:
-                        function_result = {
-                            "error": "No hay 'reverted_shap_explanation' en "
-                                     "la sesión. Primero genera la "
-                                     "explicación."
-                        }
-                    else:
-                        fig = shp.get_decision_plot(shap_explanation)
-                        st.pyplot(fig)
-                        function_result = {
-                            "status": "Decision plot generado y mostrado en "
-                                      "la interfaz."
-                        }
-
-                    st.session_state.messages.append(
-                        create_function_message(func_call.name,
-                                                function_result)
-                    )
-
-                # Segunda llamada a GPT con el historial
-                response = client.chat.completions.create(
-                    model=LLM_MODEL,
-                    messages=[system_message] + st.session_state.messages
-                )
-                message = response.choices[0].message
-
-            else:
-                # Si GPT no llama a ninguna función, da su "respuesta final"
-                break
-
-        # Al salir del bucle, 'message' es la resp final (assistant) de GPT
-        assistant_reply = message.content
-        st.session_state.messages.append(
-            {"role": "assistant", "content": assistant_reply})
-        with st.chat_message("assistant", avatar=BOT_AVATAR):
-            st.markdown(assistant_reply)
+        # Cada turno se traza por etapas (LLM, herramientas, modelo, SHAP,
+        # gráficos) para el panel lateral y el archivo de trazas
+        with TRACER.trace("turn", model=LLM_MODEL) as trace:
+            # Las herramientas se ejecutan fuera del hilo del script, así
+            # que reciben una copia del estado que necesitan
+            previous_explanation = SESSION_STORE.get_explanation(session_id)
+            context = {"reverted_shap_explanation": previous_explanation}
+
+            # Historial compactado y recortado al presupuesto de tokens
+            with TRACER.span("history.build_request") as span:
+                request_messages, token_report = (
+                    HISTORY_MANAGER.build_request(
+                        system_message, messages))
+                if span is not None:
+                    span.set(**token_report)
+
+            with st.chat_message("assistant", avatar=BOT_AVATAR):
+                reply_placeholder = st.empty()
+
+                def show_tool_result(result):
+                    if result.image is not None:
+                        st.image(result.image)
+                    if result.chart is not None:
+                        st.vega_lite_chart(result.chart)
+
+                with TRACER.span("parse.fast_path") as span:
+                    parsed = parse_patient_text(prompt) if FAST_PATH else None
+                    complete = parsed is not None and parsed.is_complete
+                    fast_path = complete and asks_only_prediction(prompt)
+                    if span is not None:
+                        span.set(complete=complete, fast_path=fast_path)
+                if complete and not fast_path:
+                    # Además de predecir pide explicaciones o gráficos: GPT
+                    # elige las herramientas, pero con los datos ya leídos
+                    request_messages = request_messages + [{
+                        "role": "system",
+                        "content": "Datos del paciente reconocidos en el "
+                                   "último mensaje; úsalos como person_data "
+                                   "en las herramientas: "
+                                   + json.dumps(parsed.person_data,
+                                                ensure_ascii=False)}]
+                if fast_path:
+                    # Datos completos en el mensaje: se predice sin esperar
+                    # a que GPT construya el diccionario y GPT solo lo
+                    # redacta
+                    st.caption(
+                        "⚡ Datos del paciente reconocidos localmente.")
+                    new_messages = run_local_turn(
+                        client, LLM_MODEL, request_messages,
+                        "get_stroke_prediction",
+                        {"person_data": parsed.person_data}, context,
+                        on_token=reply_placeholder.markdown,
+                        on_tool_result=show_tool_result)
+                else:
+                    # Los tokens se muestran según llegan; si GPT pide
+                    # varias herramientas, se ejecutan en paralelo y sus
+                    # resultados van en una sola petición de seguimiento
+                    new_messages = run_turn(
+                        client, LLM_MODEL, request_messages, tools, context,
+                        on_token=reply_placeholder.markdown,
+                        on_tool_result=show_tool_result)
+                if token_report["tokens_saved"]:
+                    st.caption(
+                        f"Tokens enviados: {token_report['tokens_after']} "
+                        f"(ahorrados: {token_report['tokens_saved']})")
+
+        # Solo se reescribe en disco si una herramienta calculó una nueva
+        explanation = context.get("reverted_shap_explanation")
+        if explanation is not None and explanation is not previous_explanation:
+            SESSION_STORE.set_explanation(session_id, explanation)
+        SESSION_STORE.append(session_id, new_messages)
+        st.session_state["last_trace"] = trace
+
+# Panel opcional con la traza del último turno
+with st.sidebar:
+    if st.checkbox("⏱️ Mostrar traza del último turno"):
+        last_trace = st.session_state.get("last_trace")
+        if last_trace is None:
+            st.markdown("Aún no hay turnos trazados.")
+        else:
+            st.caption(f"Total: {last_trace.duration * 1000:.0f} ms")
+            st.dataframe(last_trace.rows(), hide_index=True)
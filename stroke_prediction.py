@@ -1,20 +1,11 @@
-import joblib
 import pandas as pd
 import re
 import ast
-# noinspection PyUnresolvedReferences
-from tensorflow.keras.models import load_model
-
-MODEL_PATH = "best_ann.keras"
-PREPROCESSOR_PATH = "preprocessor.pkl"
-
-# Cargar modelo y preprocesador globalmente
-MODEL = load_model(MODEL_PATH)
-MODEL.trainable = False
-for layer in MODEL.layers:
-    layer.trainable = False
-
-PREPROCESSOR = joblib.load(PREPROCESSOR_PATH)
+from model_registry import REGISTRY
+from patient_schema import VALIDATOR, ValidationError
+from prediction_cache import (PREDICTION_CACHE, cache_key,
+                              canonicalize_person_data)
+from tracing import TRACER
 
 # Configuración de columnas
 CATEGORICAL_FEATURES = [
@@ -24,6 +15,16 @@ CATEGORICAL_FEATURES = [
 NUMERICAL_FEATURES = ["age", "avg_glucose_level", "bmi"]
 
 
+def __getattr__(name):
+    # MODEL y PREPROCESSOR se resuelven contra el registro compartido la
+    # primera vez que se usan, en lugar de cargarse al importar el módulo
+    if name == "MODEL":
+        return REGISTRY.get_model()
+    if name == "PREPROCESSOR":
+        return REGISTRY.get_preprocessor()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def extract_dictionary(response_text):
     """
     Extrae un diccionario de texto utilizando expresiones regulares.
@@ -48,84 +49,204 @@ def extract_dictionary(response_text):
 
 def validate_input(person_data):
     """
-    Valida que los datos de entrada contengan todas las claves necesarias.
+    Valida que los datos de entrada contengan todas las claves necesarias
+    con valores admitidos por PATIENT_SCHEMA.
 
     Args:
         person_data (dict): Información de la persona.
 
     Raises:
-        ValueError: Si faltan claves necesarias en los datos.
+        ValidationError: Con todos los errores encontrados (es un
+            ValueError).
     """
-    required_keys = NUMERICAL_FEATURES + CATEGORICAL_FEATURES
-    missing_keys = [key for key in required_keys if key not in person_data]
-    if missing_keys:
-        raise ValueError(f"Faltan las claves necesarias: {missing_keys}")
-
-    # Validación de variables categóricas
-    for key in CATEGORICAL_FEATURES:
-        if key == "gender" and person_data[key] not in ["Male", "Female"]:
-            raise ValueError(
-                f"El valor de 'gender' debe ser 'Male' o 'Female'.")
-        elif key == "work_type" and person_data[key] not in ["Private",
-                                                             "Self-employed",
-                                                             "Govt_job",
-                                                             "children",
-                                                             "Never_worked"]:
-            raise ValueError(
-                f"El valor de 'work_type' debe ser uno de: 'Private',"
-                f"'Self-employed', 'Govt_job', 'children', 'Never_worked'.")
-        elif key == "Residence_type" and person_data[key] not in ["Urban",
-                                                                  "Rural"]:
-            raise ValueError(
-                f"El valor de 'Residence_type' debe ser 'Urban' o 'Rural'.")
-        elif key == "smoking_status" and person_data[key] not in [
-                "never smoked", "formerly smoked", "smokes", "Unknown"]:
-            raise ValueError(
-                f"El valor de 'smoking_status' debe ser uno de:"
-                f"'never smoked', 'formerly smoked', 'smokes', 'Unknown'.")
-
-    # Validación de variables booleanas
-    for key in ["hypertension", "heart_disease", "ever_married"]:
-        if not isinstance(person_data[key], bool):
-            raise ValueError(f"El valor de '{key}' debe ser True o False.")
-
-    # Validación de variables numéricas
-    for key in NUMERICAL_FEATURES:
-        if not isinstance(person_data[key], (int, float)) or person_data[
-                key] <= 0:
-            raise ValueError(
-                f"El valor de '{key}' debe ser un número positivo.")
+    VALIDATOR.validate(person_data)
 
 
-def get_stroke_prediction(person_data):
+def validate_batch(batch):
+    """
+    Valida un lote de pacientes de una sola pasada, sin detenerse en el
+    primer error.
+
+    Args:
+        batch (list | dict | pd.DataFrame): Lista de diccionarios de
+            pacientes o estructura columnar con las mismas claves.
+
+    Returns:
+        dict: Lista de errores por índice de fila, solo para las filas
+            inválidas.
+    """
+    records = [canonicalize_person_data(person_data)
+               for person_data in to_records(batch)]
+    return VALIDATOR.record_list_errors(records)
+
+
+def get_stroke_prediction(person_data, use_cache=True):
     """
     Predice la probabilidad de ictus para un paciente.
 
+    Los datos se normalizan antes de predecir (orden de claves, redondeo
+    numérico y booleanos como 'Sí'/'No'), de modo que las peticiones
+    repetidas del mismo paciente se sirven desde PREDICTION_CACHE.
+
     Args:
         person_data (dict): Datos del paciente.
+        use_cache (bool): Si es False, se ignora la caché de predicciones.
 
     Returns:
         dict: Probabilidad de ictus y un mensaje explicativo.
     """
     try:
+        person_data = canonicalize_person_data(person_data)
+        key = None
+        if use_cache:
+            try:
+                key = cache_key(person_data)
+            except TypeError:
+                # Valores no hashables: la validación los rechazará
+                key = None
+        if key is not None:
+            cached = PREDICTION_CACHE.get(key)
+            if cached is not None:
+                with TRACER.span("prediction.cache_hit"):
+                    return dict(cached)
+
         # Validar entrada
-        validate_input(person_data)
+        with TRACER.span("prediction.validate"):
+            validate_input(person_data)
 
         # Preprocesar los datos
-        df = pd.DataFrame([person_data])[NUMERICAL_FEATURES +
-                                         CATEGORICAL_FEATURES]
-        transformed_data = PREPROCESSOR.transform(df)
+        with TRACER.span("prediction.preprocess"):
+            transformed_data = REGISTRY.get_encoder().transform(person_data)
 
         # Realizar predicción y convertir a float nativo
-        probability = float(MODEL.predict(transformed_data)[0][0])
-
-        return {
-            "probability": round(probability, 4),
-            "message": f"La probabilidad estimada de ictus es del"
-                       f"{probability: .2%}."
-        }
+        with TRACER.span("prediction.model", backend=REGISTRY.backend):
+            probability = float(
+                REGISTRY.get_predictor().predict(transformed_data)[0][0])
+
+        result = prediction_result(probability)
+        if key is not None:
+            PREDICTION_CACHE.put(key, result)
+        return dict(result)
     except Exception as e:
-        return {
-            "probability": None,
-            "message": f"Error al calcular la predicción: {str(e)}"
-        }
+        return _error_result(e)
+
+
+def prediction_result(probability):
+    """
+    Da formato de respuesta a una probabilidad de ictus.
+    """
+    return {
+        "probability": round(probability, 4),
+        "message": f"La probabilidad estimada de ictus es del"
+                   f"{probability: .2%}."
+    }
+
+
+def _error_result(error):
+    return {
+        "probability": None,
+        "message": f"Error al calcular la predicción: {str(error)}"
+    }
+
+
+def to_records(batch):
+    """
+    Normaliza un lote de pacientes a una lista de diccionarios.
+
+    Args:
+        batch (list | dict | pd.DataFrame): Lista de diccionarios, o
+            estructura columnar ({clave: lista de valores} o DataFrame).
+
+    Returns:
+        list: Un diccionario por paciente.
+
+    Raises:
+        ValueError: Si las columnas tienen longitudes distintas.
+    """
+    if isinstance(batch, pd.DataFrame):
+        return batch.to_dict(orient="records")
+    if isinstance(batch, dict):
+        lengths = {len(values) for values in batch.values()}
+        if len(lengths) > 1:
+            raise ValueError(
+                "Todas las columnas del lote deben tener la misma longitud.")
+        n_rows = lengths.pop() if lengths else 0
+        return [{key: values[i] for key, values in batch.items()}
+                for i in range(n_rows)]
+    return list(batch)
+
+
+def _canonical_row(person_data):
+    if not isinstance(person_data, dict):
+        raise TypeError("Los datos de cada paciente deben ser un objeto "
+                        "con sus variables.")
+    return canonicalize_person_data(person_data)
+
+
+def get_stroke_predictions_batch(batch, use_cache=False):
+    """
+    Predice la probabilidad de ictus para un lote de pacientes con una única
+    transformación y una única llamada al modelo.
+
+    Las filas inválidas no interrumpen el lote: su resultado lleva
+    'probability' a None y el motivo del error en 'message'.
+
+    Args:
+        batch (list | dict | pd.DataFrame): Lista de diccionarios de
+            pacientes o estructura columnar con las mismas claves.
+        use_cache (bool): Si es True, las filas ya presentes en
+            PREDICTION_CACHE no pasan por el modelo y las nuevas se guardan.
+            Desactivado por defecto para que los lotes grandes no desplacen
+            a los pacientes del chat.
+
+    Returns:
+        list: Un diccionario por paciente, en el mismo orden de entrada y con
+        el mismo formato que get_stroke_prediction.
+    """
+    records, results = [], []
+    for person_data in to_records(batch):
+        # Una fila mal formada no debe arrastrar al resto del lote
+        try:
+            records.append(_canonical_row(person_data))
+            results.append(None)
+        except Exception as e:
+            records.append(None)
+            results.append(_error_result(e))
+    rows = [i for i, record in enumerate(records) if record is not None]
+
+    # Validar todas las filas de una vez y quedarse con las correctas
+    with TRACER.span("prediction.validate", rows=len(records)) as span:
+        errors = {rows[row]: row_errors for row, row_errors in
+                  VALIDATOR.record_list_errors(
+                      [records[i] for i in rows]).items()}
+        if span is not None:
+            span.set(invalid=len(errors) + len(records) - len(rows))
+    for i, row_errors in errors.items():
+        results[i] = _error_result(ValidationError(row_errors))
+    valid_rows = [i for i in rows if i not in errors]
+    if use_cache:
+        for i in valid_rows:
+            cached = PREDICTION_CACHE.get(cache_key(records[i]))
+            if cached is not None:
+                results[i] = dict(cached)
+        valid_rows = [i for i in valid_rows if results[i] is None]
+
+    if valid_rows:
+        try:
+            with TRACER.span("prediction.preprocess", rows=len(valid_rows)):
+                transformed_data = REGISTRY.get_encoder().transform(
+                    [records[i] for i in valid_rows])
+            with TRACER.span("prediction.model", rows=len(valid_rows),
+                             backend=REGISTRY.backend):
+                probabilities = REGISTRY.get_predictor().predict(
+                    transformed_data, batch_size=len(valid_rows), verbose=0)
+            for i, probability in zip(valid_rows, probabilities[:, 0]):
+                results[i] = prediction_result(float(probability))
+                if use_cache:
+                    PREDICTION_CACHE.put(cache_key(records[i]),
+                                         dict(results[i]))
+        except Exception as e:
+            for i in valid_rows:
+                results[i] = _error_result(e)
+
+    return results
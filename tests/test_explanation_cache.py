@@ -0,0 +1,54 @@
+import numpy as np
+import shap
+
+from explanation_cache import ExplanationCache
+
+
+def _explanation(value):
+    return shap.Explanation(values=np.full((1, 2), value, dtype=float),
+                            base_values=np.array([0.1]),
+                            data=np.zeros((1, 2)), feature_names=["a", "b"])
+
+
+def _cache(tmp_path, **kwargs):
+    artifact = tmp_path / "model.bin"
+    if not artifact.exists():
+        artifact.write_bytes(b"v1")
+    return ExplanationCache(path=str(tmp_path / "cache.sqlite3"),
+                            artifact_paths=[str(artifact)], **kwargs)
+
+
+def test_disk_tier_is_shared_between_instances(tmp_path):
+    writer = _cache(tmp_path)
+    key = writer.key({"age": 60})
+    writer.put(key, _explanation(3.0))
+
+    reader = _cache(tmp_path)
+    assert reader.get(reader.key({"age": 60})).values[0, 0] == 3.0
+    assert reader.stats["disk_hits"] == 1
+
+
+def test_eviction_keeps_recently_read_entries(tmp_path):
+    cache = _cache(tmp_path, memory_entries=1, disk_entries=10)
+    keys = [cache.key({"age": age}) for age in range(10)]
+    for age, key in enumerate(keys):
+        cache.put(key, _explanation(age))
+    # La primera entrada se lee desde disco y pasa a ser la más reciente
+    cache._memory.clear()
+    assert cache.get(keys[0]) is not None
+
+    cache.put(cache.key({"age": 99}), _explanation(99))
+    assert cache.info()["disk_size"] == 9
+    cache._memory.clear()
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+
+
+def test_artifact_change_invalidates(tmp_path):
+    cache = _cache(tmp_path)
+    key = cache.key({"age": 60})
+    cache.put(key, _explanation(1.0))
+
+    (tmp_path / "model.bin").write_bytes(b"v2")
+    assert cache.get(key) is None
+    assert cache.info()["disk_size"] == 0
@@ -0,0 +1,64 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from fast_preprocessing import EQUIVALENCE_ATOL, probe_records
+from model_registry import REGISTRY
+
+# Extremos y valores habituales de cada variable numérica
+NUMERIC_EDGES = {
+    "age": [0.0, 0.08, 1, 43.085, 82.0, 120.0],
+    "avg_glucose_level": [0.0, 55.12, 105.1, 271.74, 500.0],
+    "bmi": [0.0, 10.3, 29.06, 97.6, 150.0],
+}
+
+
+def _category_options(encoder):
+    # Categorías del modelo más los valores de la app y los desconocidos
+    options = {key: [] for key in encoder.categorical_features}
+    for record in probe_records(encoder):
+        for key in options:
+            if record[key] not in options[key]:
+                options[key].append(record[key])
+    return options
+
+
+def _records(encoder):
+    options = _category_options(encoder)
+    numeric = list(itertools.product(
+        *(NUMERIC_EDGES[key] for key in encoder.numerical_features)))
+    combinations = list(itertools.product(*options.values()))
+    records = []
+    for i, categories in enumerate(combinations):
+        record = dict(zip(options, categories))
+        record.update(zip(encoder.numerical_features,
+                          numeric[i % len(numeric)]))
+        records.append(record)
+    # Todas las combinaciones numéricas con las mismas categorías
+    for values in numeric:
+        records.append(dict(records[0],
+                            **dict(zip(encoder.numerical_features, values))))
+    return records
+
+
+def test_compiled_encoder_matches_preprocessor():
+    encoder = REGISTRY.get_encoder()
+    records = _records(encoder)
+    expected = REGISTRY.get_preprocessor().transform(
+        pd.DataFrame(records)[encoder.feature_names])
+    actual = encoder.transform(records)
+
+    assert actual.dtype == np.float32
+    assert actual.shape == expected.shape
+    np.testing.assert_allclose(actual, expected.astype(np.float32),
+                               rtol=0, atol=EQUIVALENCE_ATOL)
+
+
+def test_single_record_matches_batch():
+    encoder = REGISTRY.get_encoder()
+    records = _records(encoder)[:50]
+    batch = encoder.transform(records)
+
+    for i, record in enumerate(records):
+        np.testing.assert_array_equal(encoder.transform(record), batch[[i]])
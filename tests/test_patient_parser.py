@@ -0,0 +1,63 @@
+import pytest
+
+from patient_parser import asks_only_prediction, parse_patient_text
+
+REST = (", hipertenso, sin cardiopatía, casado, sector privado, urbano, "
+        "glucosa 120, IMC 28, exfumador")
+
+
+def test_age_ignores_unrelated_durations():
+    result = parse_patient_text(
+        "Exfumador desde hace 10 años, hombre de 67 años" + REST)
+    assert result.person_data["age"] == 67
+    assert result.ambiguous == []
+    assert result.is_complete
+
+
+@pytest.mark.parametrize("text, age", [
+    ("Mujer de 72.5 años" + REST, 72.5),
+    ("Mujer, 72 años de edad" + REST, 72),
+    ("Mujer, edad: 58" + REST, 58),
+    ("Mujer, 72 años" + REST, 72),
+    ("67-year-old female" + REST, 67),
+])
+def test_age_phrasings(text, age):
+    result = parse_patient_text(text)
+    assert result.person_data["age"] == age
+    assert result.is_complete
+
+
+def test_conflicting_ages_are_ambiguous():
+    result = parse_patient_text(
+        "Hombre, dejó de fumar hace 10 años, 67 años" + REST)
+    assert "age" not in result.person_data
+    assert result.ambiguous == ["age"]
+    assert not result.is_complete
+
+
+def test_repeated_age_is_not_ambiguous():
+    result = parse_patient_text("Mujer de 45 años, 45 años de edad" + REST)
+    assert result.person_data["age"] == 45
+    assert result.ambiguous == []
+
+
+@pytest.mark.parametrize("text, gender", [
+    ("Femenina, 60 años", "Female"),
+    ("Paciente femenina de 60 años", "Female"),
+    ("Persona masculina de 60 años", "Male"),
+])
+def test_gender_adjectives(text, gender):
+    assert parse_patient_text(text).person_data["gender"] == gender
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Mujer de 72 años" + REST, True),
+    ("Calcula el riesgo de esta mujer de 72 años" + REST, True),
+    ("Mujer de 72 años" + REST
+     + ". Calcula el riesgo, explícalo y enséñame el waterfall plot.",
+     False),
+    ("¿Por qué tiene este riesgo? Mujer de 72 años" + REST, False),
+    ("Mujer de 72 años" + REST + ". ¿Qué pasaría con glucosa 90?", False),
+])
+def test_asks_only_prediction(text, expected):
+    assert asks_only_prediction(text) is expected
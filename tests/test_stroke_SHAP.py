@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+import shap
+
+import stroke_SHAP as shp
+
+PATIENT = {"gender": "Female", "age": 72.5, "hypertension": True,
+           "heart_disease": False, "ever_married": True,
+           "work_type": "Private", "Residence_type": "Urban",
+           "avg_glucose_level": 135.7, "bmi": 29.3,
+           "smoking_status": "formerly smoked"}
+
+
+def _explanation(values, base_value):
+    names = ["age", "avg_glucose_level", "bmi"]
+    return shap.Explanation(values=np.array([values], dtype=float),
+                            base_values=np.array([[base_value]]),
+                            data=np.array([[70.0, 100.0, 25.0]],
+                                          dtype=object),
+                            feature_names=names)
+
+
+def test_reconciliation_is_measured_against_the_model():
+    explanation = _explanation([0.2, 0.1, -0.05], 0.3)
+
+    assert shp.summarize_explanation(
+        explanation, 0.55)["reconciliation_error"] == 0.0
+    # Una explicación que no suma la probabilidad del modelo se delata
+    summary = shp.summarize_explanation(explanation, 0.6)
+    assert summary["predicted_probability"] == 0.6
+    assert summary["reconciliation_error"] == 0.05
+
+
+def test_grouped_explanation_reconciles_with_prediction():
+    prediction, explanation = shp.get_prediction_and_explanation(
+        PATIENT, mode="grouped", use_cache=False)
+    summary = shp.summarize_explanation(explanation,
+                                        prediction["probability"])
+
+    assert summary["predicted_probability"] == prediction["probability"]
+    assert summary["reconciliation_error"] <= 1e-3
+
+
+def test_batch_matches_single_patient_path():
+    other = dict(PATIENT, age=45.0, smoking_status="never smoked")
+    invalid = dict(PATIENT, age=-5)
+    results = shp.get_predictions_and_explanations_batch(
+        [PATIENT, invalid, other], mode="grouped", use_cache=False)
+
+    assert results[1][0]["probability"] is None and results[1][1] is None
+    for patient, (prediction, explanation) in zip((PATIENT, other),
+                                                  results[::2]):
+        expected, single = shp.get_prediction_and_explanation(
+            patient, mode="grouped", use_cache=False)
+        assert prediction == expected
+        np.testing.assert_allclose(explanation.values, single.values,
+                                   atol=1e-12)
+        np.testing.assert_allclose(explanation.base_values,
+                                   single.base_values, atol=1e-12)
+
+
+def test_batch_survives_malformed_rows():
+    results = shp.get_predictions_and_explanations_batch(
+        [PATIENT, "oops"], mode="grouped", use_cache=False)
+
+    assert results[0][0]["probability"] is not None
+    assert results[1] == (results[1][0], None)
+    assert results[1][0]["probability"] is None
+
+
+def test_invalid_patient_returns_the_prediction_error():
+    from chat_engine import run_tool
+
+    invalid = dict(PATIENT, age=-5)
+    payload, image, updates = run_tool(
+        "get_reverted_shap_explanation", {"person_data": invalid}, {})
+
+    assert payload["probability"] is None
+    assert "message" in payload and "contributions" not in payload
+    assert image is None and updates == {}
+    with pytest.raises(ValueError):
+        shp.summarize_explanation(_explanation([0.2, 0.1, -0.05], 0.3),
+                                  payload["probability"])
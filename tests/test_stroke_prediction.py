@@ -0,0 +1,30 @@
+import stroke_prediction as sp
+
+PATIENT = {"gender": "Female", "age": 72.5, "hypertension": True,
+           "heart_disease": False, "ever_married": True,
+           "work_type": "Private", "Residence_type": "Urban",
+           "avg_glucose_level": 135.7, "bmi": 29.3,
+           "smoking_status": "formerly smoked"}
+
+
+def test_bad_rows_do_not_break_the_batch():
+    other = dict(PATIENT, age=45.0)
+    results = sp.get_stroke_predictions_batch(
+        [PATIENT, "oops", other, None, dict(PATIENT, age=-5)])
+
+    assert results[0] == sp.get_stroke_prediction(PATIENT, use_cache=False)
+    assert results[2] == sp.get_stroke_prediction(other, use_cache=False)
+    for result in (results[1], results[3], results[4]):
+        assert result["probability"] is None
+    assert "objeto" in results[1]["message"]
+    assert "age" in results[4]["message"]
+
+
+def test_cache_key_depends_on_predictor(monkeypatch):
+    from model_registry import REGISTRY
+    from prediction_cache import cache_key, canonicalize_person_data
+
+    person_data = canonicalize_person_data(PATIENT)
+    key = cache_key(person_data)
+    monkeypatch.setattr(REGISTRY, "predictor_signature", lambda: "keras")
+    assert cache_key(person_data) != key
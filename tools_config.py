@@ -1,3 +1,5 @@
+from patient_schema import PATIENT_SCHEMA, person_data_schema
+
 tools = [
     {
         "name": "get_stroke_prediction",
@@ -6,69 +8,7 @@ tools = [
             "type": "object",
             "required": ["person_data"],
             "properties": {
-                "person_data": {
-                    "type": "object",
-                    "description": "Datos del paciente.",
-                    "properties": {
-                        "gender": {
-                            "type": "string",
-                            "description": "Género del paciente, debe ser 'Male' o 'Female'.",
-                            "enum": ["Male", "Female"]
-                        },
-                        "age": {
-                            "type": "number",
-                            "description": "Edad del paciente en años."
-                        },
-                        "hypertension": {
-                            "type": "boolean",
-                            "description": "Indica si el paciente tiene hipertensión."
-                        },
-                        "heart_disease": {
-                            "type": "boolean",
-                            "description": "Indica si el paciente tiene enfermedades cardíacas."
-                        },
-                        "ever_married": {
-                            "type": "boolean",
-                            "description": "Indica si el paciente ha estado alguna vez casado."
-                        },
-                        "work_type": {
-                            "type": "string",
-                            "description": "Tipo de trabajo del paciente.",
-                            "enum": ["Private", "Self-employed", "Govt_job", "children", "Never_worked"]
-                        },
-                        "Residence_type": {
-                            "type": "string",
-                            "description": "Tipo de residencia del paciente.",
-                            "enum": ["Urban", "Rural"]
-                        },
-                        "avg_glucose_level": {
-                            "type": "number",
-                            "description": "Nivel promedio de glucosa en sangre."
-                        },
-                        "bmi": {
-                            "type": "number",
-                            "description": "Índice de masa corporal del paciente."
-                        },
-                        "smoking_status": {
-                            "type": "string",
-                            "description": "Estado de tabaquismo del paciente.",
-                            "enum": ["never smoked", "formerly smoked", "smokes", "Unknown"]
-                        }
-                    },
-                    "required": [
-                        "gender",
-                        "age",
-                        "hypertension",
-                        "heart_disease",
-                        "ever_married",
-                        "work_type",
-                        "Residence_type",
-                        "avg_glucose_level",
-                        "bmi",
-                        "smoking_status"
-                    ],
-                    "additionalProperties": False
-                }
+                "person_data": person_data_schema("Datos del paciente.")
             },
             "additionalProperties": False
         }
@@ -80,128 +20,114 @@ tools = [
             "type": "object",
             "required": ["person_data"],
             "properties": {
-                "person_data": {
-                    "type": "object",
-                    "description": "Información de la persona que necesita validarse.",
-                    "properties": {
-                        "gender": {
-                            "type": "string",
-                            "description": "Género de la persona; debe ser 'Male' o 'Female'.",
-                            "enum": ["Male", "Female"]
-                        },
-                        "work_type": {
-                            "type": "string",
-                            "description": "Tipo de trabajo; debe ser una de las categorías predefinidas.",
-                            "enum": ["Private", "Self-employed", "Govt_job", "children", "Never_worked"]
-                        },
-                        "Residence_type": {
-                            "type": "string",
-                            "description": "Tipo de residencia; debe ser 'Urban' o 'Rural'.",
-                            "enum": ["Urban", "Rural"]
-                        },
-                        "smoking_status": {
-                            "type": "string",
-                            "description": "Estado de tabaquismo; debe ser una de las categorías predefinidas.",
-                            "enum": ["never smoked", "formerly smoked", "smokes", "Unknown"]
-                        },
-                        "hypertension": {
-                            "type": "boolean",
-                            "description": "Indica si la persona tiene hipertensión; debe ser True o False."
-                        },
-                        "heart_disease": {
-                            "type": "boolean",
-                            "description": "Indica si la persona tiene enfermedad cardíaca; debe ser True o False."
-                        },
-                        "ever_married": {
-                            "type": "boolean",
-                            "description": "Indica si la persona ha estado alguna vez casada; debe ser True o False."
-                        }
-                    },
-                    "required": [
-                        "gender",
-                        "work_type",
-                        "Residence_type",
-                        "smoking_status",
-                        "hypertension",
-                        "heart_disease",
-                        "ever_married"
-                    ],
-                    "additionalProperties": False
-                }
+                "person_data": person_data_schema(
+                    "Información de la persona que necesita validarse.",
+                    required=["gender", "work_type", "Residence_type",
+                              "smoking_status", "hypertension",
+                              "heart_disease", "ever_married"])
             },
             "additionalProperties": False
         }
     },
     {
         "name": "get_reverted_shap_explanation",
-        "description": "Combina la generación de valores SHAP y la reversión de los datos transformados. Devuelve un objeto shap.Explanation cuyas 'data' y 'feature_names' coinciden con los valores originales en lugar de los datos escalados/one-hot.",
+        "description": "Calcula los valores SHAP de una persona y devuelve un resumen compacto: 'base_value', 'predicted_probability', las variables más influyentes en 'contributions' (variable, valor original, valor SHAP y signo, ordenadas por magnitud), el término 'others' con la suma del resto y 'reconciliation_error', la diferencia entre base_value + contribuciones + others y la probabilidad predicha por el modelo (debería ser casi cero). La explicación completa queda guardada para los gráficos.",
         "parameters": {
             "type": "object",
             "required": ["person_data"],
             "properties": {
-                "person_data": {
-                    "type": "object",
-                    "description": "Diccionario con los datos de una persona",
-                    "properties": {
-                        "age": {
-                            "type": "number",
-                            "description": "Edad de la persona"
-                        },
-                        "avg_glucose_level": {
-                            "type": "number",
-                            "description": "Nivel promedio de glucosa"
-                        },
-                        "bmi": {
-                            "type": "number",
-                            "description": "Índice de masa corporal"
-                        },
-                        "gender": {
-                            "type": "string",
-                            "description": "Género de la persona"
-                        },
-                        "hypertension": {
-                            "type": "boolean",
-                            "description": "Si la persona tiene hipertensión o no"
-                        },
-                        "heart_disease": {
-                            "type": "boolean",
-                            "description": "Si la persona tiene enfermedad cardíaca o no"
-                        },
-                        "ever_married": {
-                            "type": "boolean",
-                            "description": "Si la persona se ha casado alguna vez"
-                        },
-                        "work_type": {
-                            "type": "string",
-                            "description": "Tipo de trabajo de la persona"
-                        },
-                        "Residence_type": {
-                            "type": "string",
-                            "description": "Tipo de residencia de la persona"
+                "person_data": person_data_schema("Diccionario con los datos de una persona")
+            },
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "predict_and_explain",
+        "description": "Predice la probabilidad de ictus, calcula su explicación SHAP y, si se pide, dibuja un gráfico, todo en una sola llamada. Devuelve 'prediction' (igual que get_stroke_prediction), 'explanation' (el mismo resumen que get_reverted_shap_explanation) y, si se dibujó, 'plot'. Úsala en lugar de llamar por separado a get_stroke_prediction, get_reverted_shap_explanation y a las funciones de gráficos cuando el usuario quiera varias de estas cosas.",
+        "parameters": {
+            "type": "object",
+            "required": ["person_data"],
+            "properties": {
+                "person_data": person_data_schema("Datos del paciente."),
+                "plot_type": {
+                    "type": "string",
+                    "description": "Gráfico a dibujar con la explicación. Por defecto, 'none'.",
+                    "enum": ["none", "force", "waterfall", "decision"]
+                },
+                "max_display": {
+                    "type": "integer",
+                    "description": "Número máximo de características en el waterfall plot. Por defecto, 10."
+                }
+            },
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "what_if_sweep",
+        "description": "Análisis de sensibilidad: calcula cómo cambia la probabilidad de ictus de un paciente al variar una o dos variables numéricas (age, avg_glucose_level, bmi) dentro de un rango, en una sola llamada. Devuelve 'base_probability', los valores de cada eje en 'axes', la curva (una variable) o la matriz (dos variables, una fila por valor del primer eje) en 'probabilities', y los puntos de riesgo mínimo y máximo. Úsala para preguntas como '¿y si bajara el IMC a 28?' o '¿cómo cambia con la edad?'.",
+        "parameters": {
+            "type": "object",
+            "required": ["person_data", "sweeps"],
+            "properties": {
+                "person_data": person_data_schema("Paciente base."),
+                "sweeps": {
+                    "type": "array",
+                    "description": "Una o dos variables a barrer.",
+                    "minItems": 1,
+                    "maxItems": 2,
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "feature": {
+                                "type": "string",
+                                "enum": ["age", "avg_glucose_level", "bmi"]
+                            },
+                            "start": {
+                                "type": "number",
+                                "description": "Valor inicial (mayor que 0)."
+                            },
+                            "stop": {
+                                "type": "number",
+                                "description": "Valor final (mayor que start)."
+                            },
+                            "steps": {
+                                "type": "integer",
+                                "description": "Número de puntos del eje. Por defecto, 11; con dos variables conviene usar menos (p. ej. 8)."
+                            }
                         },
-                        "smoking_status": {
-                            "type": "string",
-                            "description": "Estado de fumar de la persona"
-                        }
-                    },
-                    "required": [
-                        "age",
-                        "avg_glucose_level",
-                        "bmi",
-                        "gender",
-                        "hypertension",
-                        "heart_disease",
-                        "ever_married",
-                        "work_type",
-                        "Residence_type",
-                        "smoking_status"
-                    ],
-                    "additionalProperties": False
+                        "required": ["feature", "start", "stop"],
+                        "additionalProperties": False
+                    }
+                },
+                "plot": {
+                    "type": "boolean",
+                    "description": "Si es true, dibuja la curva o el mapa de calor en la interfaz. Por defecto, false."
                 }
             },
             "additionalProperties": False
         }
     },
+    {
+        "name": "get_cohort_statistics",
+        "description": "Devuelve estadísticas globales del modelo precalculadas sobre la cohorte de referencia (background_data): importancia media |SHAP| de cada variable en 'importance', distribución del riesgo en 'risk' (media, percentiles y proporción con riesgo >= 50%) y, si se piden variables en 'features', cómo influye cada una según su valor en 'dependence' (SHAP medio y riesgo medio por intervalo o categoría). Si se pasa 'person_data', incluye en 'patient' el percentil de su riesgo dentro de la cohorte. Úsala para preguntas generales como '¿qué variables pesan más en general?' o '¿es alto este riesgo comparado con otros pacientes?'.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "features": {
+                    "type": "array",
+                    "description": "Variables cuyo resumen de dependencia se quiere. Por defecto, ninguna.",
+                    "items": {
+                        "type": "string",
+                        "enum": list(PATIENT_SCHEMA)
+                    }
+                },
+                "person_data": person_data_schema(
+                    "Paciente a situar en la distribución de riesgo "
+                    "(opcional).")
+            },
+            "additionalProperties": False
+        }
+    },
     {
         "name": "get_force_plot",
         "description": "Generates a force plot using SHAP values and returns the figure.",
@@ -0,0 +1,184 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+TRACING = os.environ.get("STROKE_BOT_TRACING", "1") != "0"
+TRACE_PATH = os.environ.get("STROKE_BOT_TRACE_PATH",
+                            os.path.join(".cache", "traces.jsonl"))
+TRACE_MAX_BYTES = int(os.environ.get("STROKE_BOT_TRACE_MAX_BYTES",
+                                     str(5 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.environ.get("STROKE_BOT_TRACE_BACKUPS", "3"))
+# Trazas recientes que se conservan en memoria para el panel lateral
+RECENT_TRACES = 20
+
+# Tramo activo en el contexto actual (hilo o tarea)
+_CURRENT_SPAN = contextvars.ContextVar("stroke_bot_span", default=None)
+
+
+class Span:
+    """
+    Tramo cronometrado de un turno, con atributos y tramos hijos.
+
+    Args:
+        name (str): Nombre de la etapa (p. ej. 'llm.request').
+        attributes (dict, optional): Datos adicionales de la etapa.
+    """
+
+    def __init__(self, name, attributes=None):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.children = []
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.thread = threading.current_thread().name
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def finish(self):
+        self.duration = self.elapsed()
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": (None if self.duration is None
+                            else round(self.duration * 1000, 3)),
+            "thread": self.thread,
+            "attributes": self.attributes,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+    def rows(self, depth=0):
+        """
+        Aplana el árbol de tramos para mostrarlo como tabla.
+
+        Returns:
+            list: Diccionarios con 'etapa', 'ms' y 'detalles'.
+        """
+        rows = [{"etapa": "  " * depth + self.name,
+                 "ms": (None if self.duration is None
+                        else round(self.duration * 1000, 1)),
+                 "detalles": json.dumps(self.attributes, default=str)}]
+        for child in sorted(self.children, key=lambda span: span.start):
+            rows.extend(child.rows(depth + 1))
+        return rows
+
+
+class Tracer:
+    """
+    Registra los tramos de cada turno y los guarda en un JSONL rotativo.
+
+    Args:
+        path (str): Archivo de trazas.
+        max_bytes (int): Tamaño a partir del cual se rota el archivo.
+        backups (int): Archivos rotados que se conservan.
+        enabled (bool): Si es False, span() no registra nada.
+    """
+
+    def __init__(self, path=TRACE_PATH, max_bytes=TRACE_MAX_BYTES,
+                 backups=TRACE_BACKUPS, enabled=TRACING):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.enabled = enabled
+        self.recent = deque(maxlen=RECENT_TRACES)
+        self._logger = None
+        self._lock = threading.Lock()
+
+    def _get_logger(self):
+        with self._lock:
+            if self._logger is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                logger = logging.getLogger(f"stroke_bot.traces.{id(self)}")
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                handler = RotatingFileHandler(
+                    self.path, maxBytes=self.max_bytes,
+                    backupCount=self.backups, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.addHandler(handler)
+                self._logger = logger
+            return self._logger
+
+    @contextmanager
+    def trace(self, name, **attributes):
+        """
+        Abre el tramo raíz de un turno. Al cerrarse, el árbol completo se
+        guarda en memoria y en el archivo de trazas.
+
+        Yields:
+            Span | None: Tramo raíz, o None si el trazado está desactivado.
+        """
+        if not self.enabled:
+            yield None
+            return
+        root = Span(name, attributes)
+        token = _CURRENT_SPAN.set(root)
+        try:
+            yield root
+        except Exception as e:
+            root.set(error=str(e))
+            raise
+        finally:
+            _CURRENT_SPAN.reset(token)
+            root.finish()
+            self.recent.append(root)
+            try:
+                self._get_logger().info(json.dumps(root.to_dict(),
+                                                   default=str))
+            except OSError as e:
+                print(f"Error al guardar la traza: {e}")
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Cronometra una etapa dentro del turno en curso. Fuera de un turno
+        (p. ej. en un script) no registra nada.
+
+        Yields:
+            Span | None: Tramo abierto, o None si no hay turno activo.
+        """
+        parent = _CURRENT_SPAN.get()
+        if parent is None:
+            yield None
+            return
+        span = Span(name, attributes)
+        parent.children.append(span)
+        token = _CURRENT_SPAN.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.set(error=str(e))
+            raise
+        finally:
+            _CURRENT_SPAN.reset(token)
+            span.finish()
+
+    def last_trace(self):
+        return self.recent[-1] if self.recent else None
+
+
+def submit_in_context(executor, function, *args, **kwargs):
+    """
+    Envía una tarea a un pool conservando el tramo activo, para que los
+    tramos abiertos en otros hilos cuelguen del turno correcto.
+    """
+    context = contextvars.copy_context()
+    return executor.submit(context.run, function, *args, **kwargs)
+
+
+# Instancia compartida por todas las sesiones del proceso
+TRACER = Tracer()
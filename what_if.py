@@ -0,0 +1,154 @@
+import os
+import numpy as np
+from model_registry import REGISTRY
+from prediction_cache import canonicalize_person_data
+from stroke_prediction import NUMERICAL_FEATURES, validate_input
+from tracing import TRACER
+
+# Puntos por eje si no se indican, y límites del barrido completo
+DEFAULT_STEPS = 11
+MAX_STEPS = int(os.environ.get("STROKE_BOT_SWEEP_MAX_STEPS", "50"))
+MAX_POINTS = int(os.environ.get("STROKE_BOT_SWEEP_MAX_POINTS", "400"))
+
+# Nombres de las variables en los ejes de los gráficos
+AXIS_LABELS = {
+    "age": "Edad (años)",
+    "avg_glucose_level": "Glucosa media (mg/dL)",
+    "bmi": "IMC",
+}
+
+
+def _sweep_axis(sweep):
+    feature = sweep.get("feature")
+    if feature not in NUMERICAL_FEATURES:
+        raise ValueError(
+            f"Solo se pueden barrer variables numéricas: "
+            f"{NUMERICAL_FEATURES}.")
+    start, stop = float(sweep["start"]), float(sweep["stop"])
+    steps = int(sweep.get("steps") or DEFAULT_STEPS)
+    if not 0 < start < stop:
+        raise ValueError(
+            f"El rango de '{feature}' debe cumplir 0 < start < stop.")
+    if not 2 <= steps <= MAX_STEPS:
+        raise ValueError(
+            f"'steps' de '{feature}' debe estar entre 2 y {MAX_STEPS}.")
+    return feature, np.round(np.linspace(start, stop, steps), 3)
+
+
+def risk_sweep(person_data, sweeps):
+    """
+    Calcula la probabilidad de ictus al variar una o dos variables numéricas
+    de un paciente, con una única llamada al modelo.
+
+    El paciente base se codifica una sola vez; cada punto de la malla es
+    una copia de esa fila con las columnas barridas sustituidas ya
+    estandarizadas.
+
+    Args:
+        person_data (dict): Paciente base.
+        sweeps (list): Uno o dos diccionarios con 'feature' ('age',
+            'avg_glucose_level' o 'bmi'), 'start', 'stop' y, opcionalmente,
+            'steps'.
+
+    Returns:
+        dict: 'base_probability', 'axes' (variable y valores de cada eje),
+            'probabilities' (curva, o matriz con una fila por valor del
+            primer eje) y los puntos de riesgo mínimo y máximo.
+
+    Raises:
+        ValueError: Si el paciente o el barrido no son válidos.
+    """
+    person_data = canonicalize_person_data(person_data)
+    validate_input(person_data)
+    if not 1 <= len(sweeps) <= 2:
+        raise ValueError("El barrido admite una o dos variables.")
+    axes = [_sweep_axis(sweep) for sweep in sweeps]
+    features = [feature for feature, _ in axes]
+    if len(set(features)) != len(features):
+        raise ValueError("Las variables del barrido deben ser distintas.")
+    shape = tuple(len(values) for _, values in axes)
+    n_points = int(np.prod(shape))
+    if n_points > MAX_POINTS:
+        raise ValueError(
+            f"El barrido tiene {n_points} puntos; el máximo es "
+            f"{MAX_POINTS}.")
+
+    with TRACER.span("what_if.sweep", points=n_points):
+        encoder = REGISTRY.get_encoder()
+        base_row = encoder.transform(person_data)
+        grid = np.repeat(base_row, n_points + 1, axis=0)
+        mesh = np.meshgrid(*[values for _, values in axes], indexing="ij")
+        for (feature, _), values in zip(axes, mesh):
+            j = encoder.numerical_features.index(feature)
+            # La última fila se deja sin tocar: es el paciente base
+            grid[:n_points, j] = ((values.ravel() - encoder.mean[j])
+                                  / encoder.scale[j])
+        probabilities = REGISTRY.get_predictor().predict(
+            grid, batch_size=len(grid), verbose=0)[:, 0].astype(np.float64)
+
+    surface = probabilities[:n_points].reshape(shape)
+
+    def _point(index):
+        position = np.unravel_index(index, shape)
+        point = {feature: float(values[i])
+                 for (feature, values), i in zip(axes, position)}
+        point["probability"] = round(float(surface[position]), 4)
+        return point
+
+    return {
+        "base_probability": round(float(probabilities[-1]), 4),
+        "base_values": {feature: person_data[feature]
+                        for feature in features},
+        "axes": [{"feature": feature, "values": values.tolist()}
+                 for feature, values in axes],
+        "probabilities": np.round(surface, 4).tolist(),
+        "min": _point(int(np.argmin(surface))),
+        "max": _point(int(np.argmax(surface))),
+    }
+
+
+def build_sweep_figure(sweep):
+    """
+    Dibuja el resultado de risk_sweep: una curva de riesgo para una variable
+    o un mapa de calor para dos. El paciente base se marca en ambos casos.
+
+    Args:
+        sweep (dict): Resultado de risk_sweep.
+
+    Returns:
+        matplotlib.figure.Figure: Figura independiente de pyplot.
+    """
+    from matplotlib.figure import Figure
+
+    axes = sweep["axes"]
+    base = sweep["base_values"]
+    probabilities = np.asarray(sweep["probabilities"]) * 100
+    fig = Figure(figsize=(7, 4.5))
+    ax = fig.subplots()
+
+    if len(axes) == 1:
+        feature = axes[0]["feature"]
+        ax.plot(axes[0]["values"], probabilities, marker="o", markersize=3)
+        ax.scatter([base[feature]], [sweep["base_probability"] * 100],
+                   color="crimson", zorder=3, label="Paciente actual")
+        ax.set_xlabel(AXIS_LABELS[feature])
+        ax.set_ylabel("Probabilidad de ictus (%)")
+        ax.grid(alpha=0.3)
+        ax.legend()
+    else:
+        first, second = axes
+        mesh = ax.pcolormesh(second["values"], first["values"],
+                             probabilities, shading="nearest",
+                             cmap="RdYlGn_r")
+        fig.colorbar(mesh, ax=ax, label="Probabilidad de ictus (%)")
+        ax.scatter([base[second["feature"]]], [base[first["feature"]]],
+                   color="black", marker="x", label="Paciente actual")
+        ax.set_xlabel(AXIS_LABELS[second["feature"]])
+        ax.set_ylabel(AXIS_LABELS[first["feature"]])
+        ax.legend(loc="upper left")
+
+    ax.set_title("Riesgo de ictus al variar "
+                 + " y ".join(AXIS_LABELS[axis["feature"]].split(" (")[0]
+                              for axis in axes))
+    fig.tight_layout()
+    return fig